@@ -1,66 +1,173 @@
-import pandas as pd
-import os 
-
-# on défini les chemins 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-RAW_PATH = os.path.join(BASE_DIR, "data", "raw", "ValeursFoncieres-2024.txt")
-CLEAN_PATH = os.path.join(BASE_DIR, "data", "clean", "dvf_2024_prefiltre.parquet")
-
-# on liste les colonnes utiles pour le pré filtrage
-COLUMNS_TO_KEEP = [
-    "Date mutation",
-    "Nature mutation",
-    "Valeur fonciere",
-    "Code postal",
-    "Commune",
-    "Code departement",
-    "Code commune",
-    "Type local",
-    "Surface reelle bati",
-    "Nombre pieces principales",
-    "Surface terrain",
-    "Type de voie",
-    "Voie",
-    "No voie"
-]
-
-
-def load_and_prefilter_dvf(filepath, chunksize=200_000):
-    """
-    Charge DVF par chunks, filtre les ventes, 
-    supprime les lignes vides et conserve uniquement les colonnes essentielles.
-    """
-    filtered_chunks = []
-
-    for chunk in pd.read_csv(filepath, sep="|", dtype=str, chunksize=chunksize):
-        # Garder uniquement les ventes
-        chunk = chunk[chunk["Nature mutation"] == "Vente"]
-
-        # Supprimer les lignes sans valeur foncière
-        chunk = chunk.dropna(subset=["Valeur fonciere"])
-
-        # Garder uniquement les colonnes essentielles
-        chunk = chunk[COLUMNS_TO_KEEP]
-
-        # Ajouter le chunk filtré à la liste
-        filtered_chunks.append(chunk)
-
-    # Concaténer tous les chunks filtrés
-    df_filtered = pd.concat(filtered_chunks, ignore_index=True)
-
-    return df_filtered
-
-
-def main():
-    print("Chargement DVF 2024 en cours...")
-    df = load_and_prefilter_dvf(RAW_PATH)
-
-    print(f"Nombre de lignes après pré-filtrage : {len(df):,}")
-
-    # Sauvegarde en parquet (plus compact et plus rapide)
-    df.to_parquet(CLEAN_PATH, index=False)
-    print(f"Fichier pré-filtré sauvegardé dans : {CLEAN_PATH}")
-
-
-if __name__ == "__main__":
-    main()
+import pandas as pd
+import numpy as np
+import os 
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from dvf_dataset import ANNEES, write_dvf_dataset, list_annees
+
+# on défini les chemins 
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAW_PATH = os.path.join(BASE_DIR, "data", "raw", "ValeursFoncieres-{annee}.txt")
+# jeu partitionné annee=/Code departement=
+CLEAN_PATH = os.path.join(BASE_DIR, "data", "clean", "dvf_prefiltre")
+
+# Mode d'ingestion : "parallele" (projection + filtres à la lecture, plages
+# d'octets lues en parallèle) ou "chunks" (lecture historique, tout en str)
+MODE_INGESTION = "parallele"
+N_WORKERS = os.cpu_count() or 1
+TAILLE_PLAGE = 64 * 1024 * 1024  # octets lus par tâche en mode parallèle
+
+# on liste les colonnes utiles pour le pré filtrage
+COLUMNS_TO_KEEP = [
+    "Date mutation",
+    "Nature mutation",
+    "Valeur fonciere",
+    "Code postal",
+    "Commune",
+    "Code departement",
+    "Code commune",
+    "Type local",
+    "Surface reelle bati",
+    "Nombre pieces principales",
+    "Surface terrain",
+    "Type de voie",
+    "Voie",
+    "No voie"
+]
+
+# colonnes à faible cardinalité lues directement en catégoriel
+COLUMNS_CATEGORY = ["Nature mutation", "Type local", "Code departement", "Type de voie"]
+
+
+def load_and_prefilter_dvf(filepath, chunksize=200_000):
+    """
+    Charge DVF par chunks, filtre les ventes, 
+    supprime les lignes vides et conserve uniquement les colonnes essentielles.
+    """
+    filtered_chunks = []
+
+    for chunk in pd.read_csv(filepath, sep="|", dtype=str, chunksize=chunksize):
+        # Garder uniquement les ventes
+        chunk = chunk[chunk["Nature mutation"] == "Vente"]
+
+        # Supprimer les lignes sans valeur foncière
+        chunk = chunk.dropna(subset=["Valeur fonciere"])
+
+        # Garder uniquement les colonnes essentielles
+        chunk = chunk[COLUMNS_TO_KEEP]
+
+        # Ajouter le chunk filtré à la liste
+        filtered_chunks.append(chunk)
+
+    # Concaténer tous les chunks filtrés
+    df_filtered = pd.concat(filtered_chunks, ignore_index=True)
+
+    return df_filtered
+
+
+def _split_byte_ranges(filepath, range_size):
+    """Découpe le fichier en plages d'octets alignées sur les fins de ligne (en-tête exclu)."""
+    file_size = os.path.getsize(filepath)
+
+    with open(filepath, "rb") as f:
+        header = f.readline()
+        start = f.tell()
+        ranges = []
+
+        while start < file_size:
+            f.seek(min(start + range_size, file_size))
+            f.readline()  # avance jusqu'à la fin de la ligne courante
+            end = min(f.tell(), file_size)
+            ranges.append((start, end))
+            start = end
+
+    columns = header.decode("utf-8").rstrip("\r\n").split("|")
+    return columns, ranges
+
+
+def _read_byte_range(filepath, columns, start, end):
+    """Lit une plage d'octets : projection usecols, types légers et filtres Vente / non nul."""
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        raw = f.read(end - start)
+
+    dtypes = {
+        col: ("category" if col in COLUMNS_CATEGORY else "string[pyarrow]")
+        for col in COLUMNS_TO_KEEP
+    }
+
+    chunk = pd.read_csv(
+        BytesIO(raw),
+        sep="|",
+        header=None,
+        names=columns,
+        usecols=COLUMNS_TO_KEEP,
+        dtype=dtypes,
+    )
+
+    keep = (chunk["Nature mutation"] == "Vente") & chunk["Valeur fonciere"].notna()
+    return chunk.loc[keep.to_numpy(), COLUMNS_TO_KEEP]
+
+
+def load_and_prefilter_dvf_parallel(filepath, n_workers=N_WORKERS, range_size=TAILLE_PLAGE):
+    """
+    Charge DVF en parallèle par plages d'octets : seules les colonnes utiles
+    sont parsées et les filtres sont appliqués dès la lecture de chaque plage.
+    Le résultat est identique à load_and_prefilter_dvf (mêmes lignes, même ordre, colonnes str).
+    """
+    columns, ranges = _split_byte_ranges(filepath, range_size)
+    missing = [c for c in COLUMNS_TO_KEEP if c not in columns]
+    if missing:
+        raise ValueError(f"Colonnes absentes du fichier DVF : {missing}")
+
+    if n_workers > 1 and len(ranges) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(_read_byte_range, filepath, columns, start, end)
+                for start, end in ranges
+            ]
+            filtered_chunks = [fut.result() for fut in futures]
+    else:
+        filtered_chunks = [
+            _read_byte_range(filepath, columns, start, end) for start, end in ranges
+        ]
+
+    df_filtered = pd.concat(filtered_chunks, ignore_index=True)
+
+    # même schéma que le mode historique : colonnes objet, valeurs manquantes en NaN
+    for col in COLUMNS_TO_KEEP:
+        df_filtered[col] = df_filtered[col].to_numpy(dtype=object, na_value=np.nan)
+
+    return df_filtered
+
+def main():
+    print(f"Années déjà présentes : {list_annees(CLEAN_PATH)}")
+
+    annees = ANNEES
+    if annees is None:
+        raw_dir = os.path.dirname(RAW_PATH)
+        annees = sorted(
+            int(name[len("ValeursFoncieres-"):-len(".txt")])
+            for name in os.listdir(raw_dir)
+            if name.startswith("ValeursFoncieres-") and name.endswith(".txt")
+        )
+
+    # une année = un fichier brut = ses seules partitions réécrites
+    for annee in annees:
+        raw_path = RAW_PATH.format(annee=annee)
+        print(f"Chargement DVF {annee} en cours...")
+        if MODE_INGESTION == "parallele":
+            df = load_and_prefilter_dvf_parallel(raw_path)
+        else:
+            df = load_and_prefilter_dvf(raw_path)
+
+        print(f"Nombre de lignes après pré-filtrage : {len(df):,}")
+
+        # Sauvegarde en parquet partitionné (plus compact et plus rapide)
+        write_dvf_dataset(df, CLEAN_PATH, annee=annee)
+        print(f"Année {annee} pré-filtrée sauvegardée dans : {CLEAN_PATH}")
+
+
+if __name__ == "__main__":
+    main()
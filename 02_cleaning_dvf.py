@@ -1,65 +1,117 @@
-import pandas as pd
-import os
-
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-INPUT_PATH = os.path.join(BASE_DIR, "data", "clean", "dvf_2024_prefiltre.parquet")
-OUTPUT_PATH = os.path.join(BASE_DIR, "data", "clean", "dvf_2024_clean.parquet")
-
-def clean_dvf(df):
-    """
-    Effectue les étapes de nettoyage nécessaires :
-    Conversion des types (prix, surfaces)
-    Filtrage maisons / appartements
-    Suppression des ventes multi lots
-    Suppression des valeurs aberrantes
-    """
-    # conversion des types:
-    print("conversion des colonnes numeriques")
-
-    df["Valeur fonciere"] = (
-        df["Valeur fonciere"].str.replace(",",".", regex=False).astype(float)
-    )
-
-    df["Surface reelle bati"] = pd.to_numeric(df["Surface reelle bati"], errors="coerce")
-    df["Nombre pieces principales"] = pd.to_numeric(df["Nombre pieces principales"], errors="coerce")
-    df["Surface terrain"] = pd.to_numeric(df["Surface terrain"], errors="coerce")
-
-    # maison et appartement :
-    print("On filtre les biens résidentiels ( maisons et appartements)")
-    df = df[df["Type local"].isin(["Maison","Appartement"])]
-
-    # suppr ventes multi lots
-    # elle est définie par plusieurs lignes dans le DVF donc on concervera les lignes ou le nombre de lots est 1
-
-    if "Nombre de lots" in df.columns:
-        df["Nombre de lots"] = pd.to_numeric(df["Nombre de lots"], errors="coerce")
-        df = df[df["Nombre de lots"] == 1]
-
-    # valeurs aberrantes
-    print("Suppression des valeurs aberrantes")
-    # si le prix est trop faible pour etre réaliste 
-    df = df[df["Valeur fonciere"] > 5000]
-    # si la surface habitable minimable raisonnable 
-    df = df[df["Surface reelle bati"] >= 10]
-    # prix  metre carré 
-    df["prix_m2"] = df["Valeur fonciere"] / df["Surface reelle bati"]
-    # filtre metre carré aberrants
-    df = df[(df["prix_m2"] > 300) & (df["prix_m2"] < 20000)]
-    # suppr la col m^2
-    df = df.drop(columns=["prix_m2"])
-
-    print("Nettoyage terminé")
-    return df
-
-
-def main():
-    print("Chargement du fichier pré filtré")
-    df = pd.read_parquet(INPUT_PATH)
-    print(f"Lignes avant nettoyage : {len(df):,}")
-    df_clean = clean_dvf(df)
-    print(f"Lignes après nettoyage : {len(df_clean):,}")
-    df_clean.to_parquet(OUTPUT_PATH, index=False)
-    print(f"Fichier nettoyé sauvegardé : {OUTPUT_PATH}")
-
-if __name__ == "__main__":
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import os
+
+from dvf_dataset import ANNEES, DEPARTEMENTS, read_dvf_dataset, write_dvf_dataset, list_annees
+from dvf_schema import TYPES_LOCAUX as SCHEMA_TYPES_LOCAUX, type_local_codes
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_PATH = os.path.join(BASE_DIR, "data", "clean", "dvf_prefiltre")
+OUTPUT_PATH = os.path.join(BASE_DIR, "data", "clean", "dvf_clean")
+
+# seuils de nettoyage
+TYPES_LOCAUX = ["Maison", "Appartement"]
+VALEUR_MIN = 5000
+SURFACE_MIN = 10
+PRIX_M2_MIN = 300
+PRIX_M2_MAX = 20000
+
+
+def parse_decimal_fr(col):
+    """Convertit une colonne texte à virgule décimale ("123000,50") en float64, dans Arrow."""
+    arr = pa.array(col, type=pa.string(), from_pandas=True)
+    arr = pc.replace_substring(arr, ",", ".")
+    return pc.cast(arr, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def build_clean_mask(df, valeur, surface):
+    """
+    Calcule en une passe le masque combiné des règles de nettoyage.
+    Renvoie le masque et le nombre de lignes rejetées par chaque règle
+    (dans l'ordre d'application, une ligne n'est comptée que pour sa première règle en échec).
+    """
+    # filtre sur les codes fixes du schéma (pas de comparaison de chaînes)
+    codes_gardes = [SCHEMA_TYPES_LOCAUX.index(t) for t in TYPES_LOCAUX]
+    rules = {"type_local": np.isin(type_local_codes(df["Type local"]), codes_gardes)}
+
+    # suppr ventes multi lots
+    # elle est définie par plusieurs lignes dans le DVF donc on concervera les lignes ou le nombre de lots est 1
+    if "Nombre de lots" in df.columns:
+        lots = pd.to_numeric(df["Nombre de lots"], errors="coerce").to_numpy(dtype=float)
+        rules["multi_lots"] = lots == 1
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # si le prix est trop faible pour etre réaliste
+        rules["valeur_min"] = valeur > VALEUR_MIN
+        # si la surface habitable minimable raisonnable
+        rules["surface_min"] = surface >= SURFACE_MIN
+        # prix metre carré aberrants (calculé à la volée, sans colonne temporaire)
+        prix_m2 = valeur / surface
+        rules["prix_m2_bornes"] = (prix_m2 > PRIX_M2_MIN) & (prix_m2 < PRIX_M2_MAX)
+
+    mask = np.ones(len(df), dtype=bool)
+    rejets = {}
+    for name, rule in rules.items():
+        n_before = np.count_nonzero(mask)
+        mask &= rule
+        rejets[name] = int(n_before - np.count_nonzero(mask))
+
+    return mask, rejets
+
+
+def clean_dvf(df, return_rejets=False, verbose=True):
+    """
+    Effectue les étapes de nettoyage nécessaires :
+    Conversion des types (prix, surfaces)
+    Filtrage maisons / appartements
+    Suppression des ventes multi lots
+    Suppression des valeurs aberrantes
+    Toutes les règles sont combinées en un seul masque, appliqué en une seule sélection.
+    verbose=False : aucun affichage (nettoyage de petits lots en continu, cf. dvf_scoring).
+    """
+    log = print if verbose else (lambda *args: None)
+
+    # conversion des types:
+    log("conversion des colonnes numeriques")
+    valeur = parse_decimal_fr(df["Valeur fonciere"])
+    surface_col = pd.to_numeric(df["Surface reelle bati"], errors="coerce").to_numpy()
+    surface = surface_col.astype(float, copy=False)
+
+    log("Filtrage biens résidentiels et suppression des valeurs aberrantes")
+    mask, rejets = build_clean_mask(df, valeur, surface)
+    for name, n in rejets.items():
+        log(f"  rejet {name:<15}: {n:,}")
+
+    # une seule sélection des lignes retenues, les colonnes numériques sont ensuite remplacées
+    kept = np.flatnonzero(mask)
+    out = df.take(kept)
+    out["Valeur fonciere"] = valeur[kept]
+    out["Surface reelle bati"] = surface_col[kept]
+    out["Nombre pieces principales"] = pd.to_numeric(out["Nombre pieces principales"], errors="coerce")
+    out["Surface terrain"] = pd.to_numeric(out["Surface terrain"], errors="coerce")
+    if "Nombre de lots" in out.columns:
+        out["Nombre de lots"] = pd.to_numeric(out["Nombre de lots"], errors="coerce")
+
+    log("Nettoyage terminé")
+    if return_rejets:
+        return out, rejets
+    return out
+
+
+def main():
+    annees = ANNEES if ANNEES is not None else list_annees(INPUT_PATH)
+
+    # nettoyage année par année : seules les partitions concernées sont lues et réécrites
+    for annee in annees:
+        print(f"Chargement des partitions pré filtrées ({annee})")
+        df = read_dvf_dataset(INPUT_PATH, annees=[annee], departements=DEPARTEMENTS)
+        print(f"Lignes avant nettoyage : {len(df):,}")
+        df_clean = clean_dvf(df)
+        print(f"Lignes après nettoyage : {len(df_clean):,}")
+        write_dvf_dataset(df_clean, OUTPUT_PATH, departements=DEPARTEMENTS)
+        print(f"Partitions nettoyées sauvegardées : {OUTPUT_PATH}")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
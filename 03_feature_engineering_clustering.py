@@ -1,142 +1,404 @@
-import pandas as pd
-import numpy as np
-import os
-
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-INPUT_PATH = os.path.join(BASE_DIR, "data", "clean", "dvf_2024_clean.parquet")
-OUTPUT_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_2024_features.parquet")
-
-
-def add_basic_features(df):
-    """Ajoute les variables individuelles principales."""
-    df["prix_m2"] = df["Valeur fonciere"] / df["Surface reelle bati"]
-    df["log_prix_m2"] = np.log1p(df["prix_m2"])
-    df["ratio_surface_terrain"] = df["Surface terrain"] / df["Surface reelle bati"]
-    df["ratio_surface_terrain"] = df["ratio_surface_terrain"].fillna(0)
-
-    df["type_local_encoded"] = df["Type local"].map({"Maison": 0, "Appartement": 1})
-    return df
-
-
-def add_temporal_features(df):
-    """Extrait les informations temporelles : mois, trimestre."""
-    df["Date mutation"] = pd.to_datetime(df["Date mutation"], errors="coerce")
-    df["mois"] = df["Date mutation"].dt.month
-    df["trimestre"] = df["Date mutation"].dt.quarter
-    return df
-
-
-def add_commune_features(df):
-    """Ajoute les statistiques locales par commune."""
-    grouped = df.groupby("Commune")
-
-    df["prix_median_commune"] = grouped["prix_m2"].transform("median")
-    df["prix_m2_median_commune"] = grouped["prix_m2"].transform("median")
-    df["surface_median_commune"] = grouped["Surface reelle bati"].transform("median")
-    df["dynamique_volume_commune"] = grouped["Valeur fonciere"].transform("count")
-    df["part_maisons_commune"] = grouped["type_local_encoded"].transform("mean")
-
-    return df
-
-
-def add_code_postal_features(df):
-    """Target encoding du code postal."""
-    grouped = df.groupby("Code postal")
-    df["prix_median_cp"] = grouped["prix_m2"].transform("median")
-    return df
-
-
-def add_departement_features(df):
-    """Target encoding du département."""
-    grouped = df.groupby("Code departement")
-    df["prix_median_departement"] = grouped["prix_m2"].transform("median")
-    return df
-
-
-def add_type_voie_features(df):
-    """Frequency encoding du type de voie."""
-    freq = df["Type de voie"].value_counts(normalize=True)
-    df["freq_type_voie"] = df["Type de voie"].map(freq)
-    df["freq_type_voie"] = df["freq_type_voie"].fillna(0)
-    return df
-
-
-def add_voie_target_encoding(df):
-    """Target encoding du nom de voie (Voie)."""
-    grouped = df.groupby("Voie")
-    df["prix_median_voie"] = grouped["prix_m2"].transform("median")
-    df["prix_median_voie"] = df["prix_median_voie"].fillna(df["prix_m2"].median())
-    return df
-
-
-def main():
-    print("Chargement des données nettoyées")
-    df = pd.read_parquet(INPUT_PATH)
-    print(f"Lignes : {len(df):,}")
-
-    print("Ajout des variables individuelles")
-    df = add_basic_features(df)
-
-    print("Ajout des variables temporelles")
-    df = add_temporal_features(df)
-
-    print("Ajout des features communes")
-    df = add_commune_features(df)
-
-    print("Encodage code postal")
-    df = add_code_postal_features(df)
-
-    print("Encodage département")
-    df = add_departement_features(df)
-
-    print("Encodage type de voie (frequency)")
-    df = add_type_voie_features(df)
-
-    print("Encodage voie (target)")
-    df = add_voie_target_encoding(df)
-
-    print("Suppression des NaN restants")
-    df = df.fillna(0)
-
-    # Normalisation des colonnes d'identifiants en string pour éviter les erreurs Parquet
-    cols_str = [
-        "Code postal", "Code commune", "Code departement",
-        "Commune", "Voie", "Type de voie", "No voie"
-    ]
-
-    for col in cols_str:
-        if col in df.columns:
-            df[col] = df[col].astype("string")
-
-        
-    # Type de voie : frequency encoding
-    if "Type de voie" in df.columns:
-        freq_type = df["Type de voie"].value_counts(normalize=True)
-        df["freq_type_voie"] = df["Type de voie"].map(freq_type)
-    else:
-        df["freq_type_voie"] = 0
-
-    # Voie : target encoding (prix médian par voie)
-    if "Voie" in df.columns:
-        prix_voies = df.groupby("Voie")["prix_m2"].median()
-        df["prix_median_voie"] = df["Voie"].map(prix_voies)
-    else:
-        df["prix_median_voie"] = df["prix_m2"].median()
-
-    # 5. Suppression des colonnes inutiles
-    cols_to_drop = [
-        "Nature mutation",       # toujours 'Vente'
-        "No voie",               # bruit pur, inutilisable
-    ]
-
-    df = df.drop(columns=[c for c in cols_to_drop if c in df.columns])
-
-    # Sauvegarde
-    df.to_parquet(OUTPUT_PATH, index=False)
-    print(f"Fichier final sauvegardé : {OUTPUT_PATH}")
-    print(f"Nombre de colonnes finales : {len(df.columns)}")
-    print("Feature engineering terminé.")
-
-
-if __name__ == "__main__":
-    main()
+import pandas as pd
+import numpy as np
+import os
+import json
+
+from dvf_dataset import ANNEES, DEPARTEMENTS, read_dvf_dataset, write_dvf_dataset, iter_dvf_batches, list_annees
+from dvf_groupby import factorize_key, group_aggregates, group_median, value_order, broadcast
+from dvf_encoders import build_lookup_table, save_encoders
+from dvf_geo import COMMUNES_CENTROIDS_PATH, CommuneIndex, add_geo_features
+from dvf_shrinkage import hierarchical_encode
+from dvf_schema import apply_schema, type_local_codes
+from dvf_sketch import ALPHA, QuantileSketch, label_keys, sketch_group_values, relative_error
+from dvf_telemetry import traced
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_PATH = os.path.join(BASE_DIR, "data", "clean", "dvf_clean")
+OUTPUT_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_features")
+FORMAT_DATE = "%d/%m/%Y"  # dates des fichiers DVF (jj/mm/aaaa)
+# tables d'encodage persistées pour enrichir de nouvelles transactions (dvf_encoders.transform_encoders)
+ENCODERS_DIR = os.path.join(BASE_DIR, "data", "models", "encoders")
+# sketches de quantiles par année (fusionnables avec ceux d'une année ou d'un mois ajouté) :
+# une année dont les partitions n'ont pas changé est relue ici au lieu d'être reparcourue
+SKETCH_DIR = os.path.join(BASE_DIR, "data", "models", "sketches")
+SKETCH_SOURCE_FILE = "source.json"  # signature des partitions d'où proviennent les sketches d'une année
+
+# prix lissés sur les communes voisines (k plus proches, rayon) : nécessite la table locale
+# des centroïdes des communes (dvf_geo.COMMUNES_CENTROIDS_PATH)
+FEATURES_GEO = False
+
+# encodage du prix au m² par département / commune / voie (colonnes prix_median_*) :
+# "hierarchique" : moyenne géométrique rétrécie vers le niveau parent, hors fold (dvf_shrinkage) ;
+#                  tables par (groupe, fold) : dvf_scoring réencode une vente connue à l'identique
+# "mediane"      : médiane brute de chaque groupe (clé = libellé seul), vente de la ligne comprise
+ENCODAGE_PRIX = "hierarchique"
+
+# médianes par groupe (commune, code postal, département, voie) :
+# "exact"  : tri de toutes les valeurs en mémoire
+# "sketch" : sketches de quantiles (dvf_sketch) construits en flux sur les partitions de chaque
+#            année puis fusionnés ; erreur relative bornée par dvf_sketch.ALPHA
+MODE_QUANTILES = "exact"
+# en mode sketch : calcule aussi les médianes exactes et affiche l'erreur mesurée
+VALIDATION_SKETCH = False
+
+# (clé, variable) des médianes servies par les sketches ; les voies manquantes forment leur propre groupe
+SKETCH_SPECS = [
+    ("Commune", "prix_m2"),
+    ("Commune", "Surface reelle bati"),
+    ("Code postal", "prix_m2"),
+    ("Code departement", "prix_m2"),
+    ("Voie", "prix_m2"),
+]
+SKETCH_KEYS_WITH_NA = {"Voie"}
+# encodage hiérarchique : seule cette médiane reste calculée par groupe
+SKETCH_SPECS_HIERARCHIQUE = [("Commune", "Surface reelle bati")]
+
+# encodage hiérarchique : variable produite à chaque niveau (dvf_shrinkage.LEVELS)
+PRIX_HIERARCHIQUE = {
+    "departement": "prix_median_departement",
+    "commune": "prix_median_commune",
+    "voie": "prix_median_voie",
+    "code_postal": "prix_median_cp",
+}
+
+# sketches fusionnés utilisés par key_median (remplis par build_median_sketches en mode sketch)
+_SKETCHES = {}
+
+
+@traced
+def add_basic_features(df):
+    """Ajoute les variables individuelles principales."""
+    df["prix_m2"] = df["Valeur fonciere"] / df["Surface reelle bati"]
+    df["log_prix_m2"] = np.log1p(df["prix_m2"])
+    df["ratio_surface_terrain"] = df["Surface terrain"] / df["Surface reelle bati"]
+    df["ratio_surface_terrain"] = df["ratio_surface_terrain"].fillna(0)
+
+    # codes fixes du schéma : Maison = 0, Appartement = 1
+    df["type_local_encoded"] = type_local_codes(df["Type local"])
+    return df
+
+
+@traced
+def add_temporal_features(df):
+    """Extrait les informations temporelles : mois, trimestre."""
+    # format explicite des fichiers DVF : pas d'inférence (ni d'avertissement) à chaque lot
+    df["Date mutation"] = pd.to_datetime(df["Date mutation"], format=FORMAT_DATE, errors="coerce")
+    df["mois"] = df["Date mutation"].dt.month
+    df["trimestre"] = df["Date mutation"].dt.quarter
+    return df
+
+
+def _sketch_source(path, annee, departements=DEPARTEMENTS):
+    """Signature des fichiers d'une année (chemin, taille, date de modification) : détecte une année réécrite."""
+    root = os.path.join(path, f"annee={annee}")
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            stat = os.stat(full)
+            files.append([os.path.relpath(full, root).replace(os.sep, "/"), stat.st_size, stat.st_mtime_ns])
+    deps = None if departements is None else sorted(str(d) for d in departements)
+    return {"departements": deps, "fichiers": sorted(files)}
+
+
+def _load_year_sketches(out_dir, annee, specs, source):
+    """Sketches sauvegardés d'une année, ou None s'ils manquent ou ne correspondent plus aux partitions."""
+    year_dir = os.path.join(out_dir, f"annee={annee}")
+    paths = {spec: os.path.join(year_dir, f"{spec[0]}__{spec[1]}.npz") for spec in specs}
+    source_path = os.path.join(year_dir, SKETCH_SOURCE_FILE)
+    if not os.path.exists(source_path) or not all(os.path.exists(p) for p in paths.values()):
+        return None
+    with open(source_path, encoding="utf-8") as f:
+        if json.load(f) != source:
+            return None
+    return {spec: QuantileSketch.load(p) for spec, p in paths.items()}
+
+
+@traced
+def build_median_sketches(path, annees=ANNEES, departements=DEPARTEMENTS, specs=SKETCH_SPECS, out_dir=None):
+    """
+    Sketches de quantiles de chaque (clé, variable), un par année puis fusionnés.
+    out_dir : les années déjà traitées (partitions inchangées) sont relues depuis les sketches
+    sauvegardés ; seules les autres sont parcourues lot par lot, puis sauvegardées.
+    """
+    annees = list_annees(path) if annees is None else [int(a) for a in annees]
+    by_year, sources, to_stream = {}, {}, []
+    for annee in annees:
+        sources[annee] = _sketch_source(path, annee, departements)
+        cached = None if out_dir is None else _load_year_sketches(out_dir, annee, specs, sources[annee])
+        if cached is None:
+            to_stream.append(annee)
+        else:
+            by_year[annee] = cached
+    print(f"  années relues : {sorted(by_year) or '-'}, parcourues : {to_stream or '-'}")
+
+    keys = sorted({key for key, _ in specs})
+    columns = ["annee"] + keys + ["Valeur fonciere", "Surface reelle bati"]
+    streamed = {}
+    batches = iter_dvf_batches(path, to_stream, departements, columns=columns) if to_stream else []
+    for batch in batches:
+        b = batch.to_pandas()
+        surface = b["Surface reelle bati"].to_numpy(dtype=float)
+        values = {"Surface reelle bati": surface, "prix_m2": b["Valeur fonciere"].to_numpy(dtype=float) / surface}
+        # un lot provient d'un seul fichier, donc d'une seule partition annee=
+        year = streamed.setdefault(int(b["annee"].iloc[0]), {spec: QuantileSketch() for spec in specs})
+        for key in keys:
+            h, keep = label_keys(b[key], dropna=key not in SKETCH_KEYS_WITH_NA)
+            for (spec_key, value_col), sketch in year.items():
+                if spec_key == key:
+                    sketch.update(h[keep], values[value_col][keep])
+
+    for annee in to_stream:
+        sketches = streamed.get(annee, {spec: QuantileSketch() for spec in specs})
+        if out_dir is not None:
+            year_dir = os.path.join(out_dir, f"annee={annee}")
+            for (key, value_col), sketch in sketches.items():
+                sketch.save(os.path.join(year_dir, f"{key}__{value_col}.npz"))
+            # signature écrite en dernier : une sauvegarde interrompue n'est pas relue
+            with open(os.path.join(year_dir, SKETCH_SOURCE_FILE), "w", encoding="utf-8") as f:
+                json.dump(sources[annee], f)
+        by_year[annee] = sketches
+
+    merged = {spec: QuantileSketch() for spec in specs}
+    for annee, sketches in sorted(by_year.items()):
+        for spec, sketch in sketches.items():
+            merged[spec].merge(sketch)
+    return merged
+
+
+def key_median(df, key, value_col, codes, n_groups, order=None):
+    """
+    Médiane de value_col par groupe de key : tri exact, ou lecture du sketch fusionné
+    en mode sketch (VALIDATION_SKETCH : erreur relative mesurée contre la médiane exacte).
+    """
+    sketch = _SKETCHES.get((key, value_col)) if MODE_QUANTILES == "sketch" else None
+    if sketch is None:
+        return group_median(codes, n_groups, df[value_col], order)
+
+    medians = sketch_group_values(sketch, df[key], codes, n_groups, 0.5,
+                                  dropna=key not in SKETCH_KEYS_WITH_NA)
+    if VALIDATION_SKETCH:
+        err = relative_error(medians, group_median(codes, n_groups, df[value_col], order))
+        print(f"  sketch {key} / {value_col} : erreur relative max {err['max']:.3%}, "
+              f"p99 {err['p99']:.3%}, médiane {err['median']:.3%} (borne {ALPHA:.1%})")
+    return medians
+
+
+@traced
+def add_commune_features(df, prix_order=None, tables=None, prix=True):
+    """
+    Ajoute les statistiques locales par commune (table d'encodage ajoutée à tables si fourni).
+    prix=False : la médiane du prix n'est pas calculée (encodage hiérarchique).
+    """
+    codes, n_groups = factorize_key(df["Commune"])
+
+    aggs = {}
+    if prix:
+        aggs["prix_median_commune"] = key_median(df, "Commune", "prix_m2", codes, n_groups, prix_order)
+    aggs["surface_median_commune"] = key_median(df, "Commune", "Surface reelle bati", codes, n_groups)
+    aggs.update(group_aggregates(codes, n_groups, {
+        "dynamique_volume_commune": (df["Valeur fonciere"], "count"),
+        "part_maisons_commune": (df["type_local_encoded"], "mean"),
+    }))
+
+    if prix:
+        df["prix_median_commune"] = broadcast(aggs["prix_median_commune"], codes)
+        # même médiane que prix_median_commune : pas de second calcul
+        df["prix_m2_median_commune"] = df["prix_median_commune"]
+    df["surface_median_commune"] = broadcast(aggs["surface_median_commune"], codes)
+    df["dynamique_volume_commune"] = broadcast(aggs["dynamique_volume_commune"], codes)
+    df["part_maisons_commune"] = broadcast(aggs["part_maisons_commune"], codes)
+
+    if tables is not None:
+        if prix:
+            aggs["prix_m2_median_commune"] = aggs["prix_median_commune"]
+        tables["commune"] = build_lookup_table("Commune", df["Commune"], codes, n_groups, aggs)
+    return df
+
+
+@traced
+def add_code_postal_features(df, prix_order=None, tables=None):
+    """Target encoding du code postal."""
+    codes, n_groups = factorize_key(df["Code postal"])
+    medians = key_median(df, "Code postal", "prix_m2", codes, n_groups, prix_order)
+    df["prix_median_cp"] = broadcast(medians, codes)
+
+    if tables is not None:
+        tables["code_postal"] = build_lookup_table(
+            "Code postal", df["Code postal"], codes, n_groups, {"prix_median_cp": medians}
+        )
+    return df
+
+
+@traced
+def add_departement_features(df, prix_order=None, tables=None):
+    """Target encoding du département."""
+    codes, n_groups = factorize_key(df["Code departement"])
+    medians = key_median(df, "Code departement", "prix_m2", codes, n_groups, prix_order)
+    df["prix_median_departement"] = broadcast(medians, codes)
+
+    if tables is not None:
+        tables["departement"] = build_lookup_table(
+            "Code departement", df["Code departement"], codes, n_groups,
+            {"prix_median_departement": medians}
+        )
+    return df
+
+
+@traced
+def add_type_voie_features(df, tables=None):
+    """Frequency encoding du type de voie (les types manquants forment leur propre modalité)."""
+    codes, n_groups = factorize_key(df["Type de voie"], dropna=False)
+    freq = group_aggregates(codes, n_groups, {"freq_type_voie": (None, "freq")})["freq_type_voie"]
+    df["freq_type_voie"] = broadcast(freq, codes)
+
+    if tables is not None:
+        # type de voie jamais vu : fréquence nulle
+        tables["type_voie"] = build_lookup_table(
+            "Type de voie", df["Type de voie"], codes, n_groups, {"freq_type_voie": freq},
+            fallback={"freq_type_voie": 0.0}
+        )
+    return df
+
+
+@traced
+def add_voie_target_encoding(df, prix_order=None, tables=None):
+    """Target encoding du nom de voie (Voie), les voies manquantes forment leur propre groupe."""
+    codes, n_groups = factorize_key(df["Voie"], dropna=False)
+    medians = key_median(df, "Voie", "prix_m2", codes, n_groups, prix_order)
+    prix_global = df["prix_m2"].median()
+    df["prix_median_voie"] = broadcast(medians, codes)
+    df["prix_median_voie"] = df["prix_median_voie"].fillna(prix_global)
+
+    if tables is not None:
+        # voie jamais vue : médiane globale
+        tables["voie"] = build_lookup_table(
+            "Voie", df["Voie"], codes, n_groups, {"prix_median_voie": medians},
+            fallback={"prix_median_voie": float(prix_global)}
+        )
+    return df
+
+
+@traced
+def add_hierarchical_price_features(df, tables=None):
+    """
+    Prix au m² département -> commune -> voie (et département -> code postal) par rétrécissement
+    hiérarchique, hors fold. Remplit les colonnes des médianes correspondantes (mêmes noms).
+    """
+    encoded = hierarchical_encode(df, df["log_prix_m2"], PRIX_HIERARCHIQUE, tables=tables)
+
+    for name, values in encoded.items():
+        df[name] = values
+    df["prix_m2_median_commune"] = df["prix_median_commune"]
+
+    if tables is not None:
+        alias_commune_price(tables)
+    return df
+
+
+def alias_commune_price(tables):
+    """prix_m2_median_commune suit prix_median_commune dans la table hiérarchique (clé inconnue comprise)."""
+    tables["hier_commune"].values["prix_m2_median_commune"] = tables["hier_commune"].values["prix_median_commune"]
+    tables["hier_commune"].fallback["prix_m2_median_commune"] = "prix_median_departement"
+
+
+@traced
+def add_group_features(df, tables=None):
+    """
+    Moteur d'encodages groupés : le tri de prix_m2 est calculé une fois
+    et partagé par toutes les médianes (commune, code postal, département, voie).
+    Si tables est un dict, il reçoit les tables d'encodage (fit) de chaque clé.
+    """
+    if ENCODAGE_PRIX == "hierarchique":
+        # aucune médiane de prix : pas de tri des prix
+        print("Encodage hiérarchique du prix (département -> commune -> voie, code postal)")
+        df = add_hierarchical_price_features(df, tables)
+
+        print("Ajout des features communes")
+        df = add_commune_features(df, None, tables, prix=False)
+
+        print("Encodage type de voie (frequency)")
+        df = add_type_voie_features(df, tables)
+        return df
+
+    # en mode sketch, les médianes sont lues dans les sketches : pas de tri des prix
+    need_order = MODE_QUANTILES == "exact" or VALIDATION_SKETCH
+    prix_order = value_order(df["prix_m2"]) if need_order else None
+
+    print("Ajout des features communes")
+    df = add_commune_features(df, prix_order, tables)
+
+    print("Encodage code postal")
+    df = add_code_postal_features(df, prix_order, tables)
+
+    print("Encodage département")
+    df = add_departement_features(df, prix_order, tables)
+
+    print("Encodage type de voie (frequency)")
+    df = add_type_voie_features(df, tables)
+
+    print("Encodage voie (target)")
+    df = add_voie_target_encoding(df, prix_order, tables)
+    return df
+
+
+def fit_encoders(df):
+    """Fit : calcule les encodages sur df et renvoie les tables (à appliquer avec transform_encoders)."""
+    tables = {}
+    add_group_features(df, tables)
+    return tables
+
+
+def main():
+    print("Chargement des données nettoyées")
+    df = read_dvf_dataset(INPUT_PATH, annees=ANNEES, departements=DEPARTEMENTS)
+    print(f"Lignes : {len(df):,}")
+
+    print("Ajout des variables individuelles")
+    df = add_basic_features(df)
+
+    print("Ajout des variables temporelles")
+    df = add_temporal_features(df)
+
+    if MODE_QUANTILES == "sketch":
+        print(f"Sketches de quantiles (précision relative {ALPHA:.1%}) : années sauvegardées relues, nouvelles parcourues en flux")
+        specs = SKETCH_SPECS_HIERARCHIQUE if ENCODAGE_PRIX == "hierarchique" else SKETCH_SPECS
+        _SKETCHES.update(build_median_sketches(INPUT_PATH, ANNEES, DEPARTEMENTS, specs, out_dir=SKETCH_DIR))
+
+    tables = {}
+    df = add_group_features(df, tables)
+
+    if FEATURES_GEO:
+        if os.path.exists(COMMUNES_CENTROIDS_PATH):
+            print("Prix lissés sur les communes voisines")
+            df = add_geo_features(df, CommuneIndex.from_csv(COMMUNES_CENTROIDS_PATH), tables)
+        else:
+            print(f"Centroïdes des communes introuvables ({COMMUNES_CENTROIDS_PATH}) : variables géographiques ignorées")
+
+    save_encoders(tables, ENCODERS_DIR)
+    print(f"Tables d'encodage sauvegardées : {ENCODERS_DIR}")
+
+    print("Suppression des NaN restants")
+    num_cols = df.select_dtypes("number").columns
+    df[num_cols] = df[num_cols].fillna(0)
+
+    # identifiants en catégoriel, numériques en float32 (schéma commun, cf. dvf_schema)
+    df = apply_schema(df)
+
+    # 5. Suppression des colonnes inutiles
+    cols_to_drop = [
+        "Nature mutation",       # toujours 'Vente'
+        "No voie",               # bruit pur, inutilisable
+    ]
+
+    df = df.drop(columns=[c for c in cols_to_drop if c in df.columns])
+
+    # Sauvegarde
+    write_dvf_dataset(df, OUTPUT_PATH, departements=DEPARTEMENTS)
+    print(f"Fichier final sauvegardé : {OUTPUT_PATH}")
+    print(f"Nombre de colonnes finales : {len(df.columns)}")
+    print("Feature engineering terminé.")
+
+
+if __name__ == "__main__":
+    main()
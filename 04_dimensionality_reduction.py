@@ -1,87 +1,283 @@
-import pandas as pd
-import numpy as np
-import os
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
-
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-INPUT_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_2024_features.parquet")
-OUTPUT_PCA20 = os.path.join(BASE_DIR, "data", "processed", "dvf_2024_pca20.parquet")
-OUTPUT_PCA2 = os.path.join(BASE_DIR, "data", "processed", "dvf_2024_pca2.parquet")
-
-def select_features(df):
-    """Sélectionne les colonnes numériques utiles pour PCA."""
-    numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-    # on retire les colonnes trop influentes ou les  identifiants inutiles
-    cols_to_remove = ["Valeur fonciere", "Surface terrain"]
-    numeric_cols = [c for c in numeric_cols if c not in cols_to_remove]
-    return df[numeric_cols], numeric_cols
-
-
-def apply_standard_scaling(df):
-    """Applique une standardisation."""
-    scaler = StandardScaler()
-    scaled = scaler.fit_transform(df)
-    return scaled, scaler
-
-
-def apply_pca(scaled_data, n_components):
-    """Applique la PCA avec n composantes."""
-    pca = PCA(n_components=n_components, random_state=42)
-    reduced = pca.fit_transform(scaled_data)
-    return reduced, pca
-
-def main():
-    print("Chargement des données enrichies")
-    df = pd.read_parquet(INPUT_PATH)
-    print(f"Lignes chargées : {len(df):,}")
-    
-    # sélection des variables
-    df_features, feature_cols = select_features(df)
-    print(f"Nombre de variables utilisées pour PCA : {len(feature_cols)}")
-
-    # standardisation
-    print("Standardisation des variables")
-    scaled_data, scaler = apply_standard_scaling(df_features)
-
-    # PCA 20 composantes
-    n_features = scaled_data.shape[1]
-    n_components = min(20, n_features)
-    print(f"Application de la PCA avec {n_components} composantes (max possible)")
-    pca20_data, pca20 = apply_pca(scaled_data, n_components=n_components)
-
-    # ajout au dataframe
-    df_pca20 = pd.DataFrame(
-        pca20_data,
-        columns=[f"PC{i+1}" for i in range(n_components)]
-    )
-    df_pca20["Type local"] = df["Type local"].values
-
-    # sauvegarde
-    df_pca20.to_parquet(OUTPUT_PCA20, index=False)
-    print(f"PCA20 sauvegardée : {OUTPUT_PCA20}")
-
-    # variance expliquée
-    explained_var = np.sum(pca20.explained_variance_ratio_)
-    print(f"Variance expliquée par {n_components} composantes : {explained_var:.4f}")
-    
-    # PCA 2 composantes pour visualiser
-    print("Application de la PCA (visu)")
-    pca2_data, pca2 = apply_pca(scaled_data, n_components=2)
-    df_pca2 = pd.DataFrame(
-    pca2_data,
-    columns=["PC1", "PC2"]
-    )
-    df_pca2["type_local_encoded"] = df["type_local_encoded"].values
-    df_pca2["Type local"] = df["Type local"].values
-
-    df_pca2.to_parquet(OUTPUT_PCA2, index=False)
-    print(f"PCA2 sauvegardée : {OUTPUT_PCA2}")
-    print(f"Variance expliquée par les 2 premières composantes : "
-          f"{np.sum(pca2.explained_variance_ratio_):.4f}")
-
-    print("Réduction de dimension terminée.")
-
-
-if __name__ == "__main__":
+import pandas as pd
+import numpy as np
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import joblib
+from sklearn.preprocessing import StandardScaler
+from sklearn.decomposition import PCA
+
+from dvf_dataset import ANNEES, DEPARTEMENTS, read_dvf_dataset, open_dvf_dataset, iter_dvf_batches, count_dvf_rows
+from dvf_schema import TYPES_LOCAUX, write_parquet, type_local_codes
+from dvf_store import FeatureStore
+from dvf_telemetry import traced
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_features")
+OUTPUT_PCA20 = os.path.join(BASE_DIR, "data", "processed", "dvf_2024_pca20.parquet")
+OUTPUT_PCA2 = os.path.join(BASE_DIR, "data", "processed", "dvf_2024_pca2.parquet")
+# standardisation + PCA persistées pour projeter de nouvelles transactions (dvf_scoring)
+MODEL_PATH = os.path.join(BASE_DIR, "data", "models", "pca.joblib")
+# magasin de variables en memory-map partagé par 04bis, 05, 06 et 07 (dvf_store)
+STORE_DIR = os.path.join(BASE_DIR, "data", "processed", "feature_store")
+
+# "memoire" : tout le jeu en RAM (sklearn) ; "streaming" : lecture par lots,
+# mémoire bornée quel que soit le nombre d'années chargées
+MODE_PCA = "memoire"
+BATCH_ROWS = 200_000
+N_COMPONENTS = 20
+
+# on retire les colonnes trop influentes ou les  identifiants inutiles
+COLS_TO_REMOVE = ["Valeur fonciere", "Surface terrain", "annee"]
+
+def select_features(df):
+    """Sélectionne les colonnes numériques utiles pour PCA."""
+    numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+    numeric_cols = [c for c in numeric_cols if c not in COLS_TO_REMOVE]
+    return df[numeric_cols], numeric_cols
+
+
+def select_feature_columns(schema, remove=COLS_TO_REMOVE):
+    """Même sélection que select_features, à partir du schéma Arrow (sans charger les données)."""
+    return [
+        field.name for field in schema
+        if (pa.types.is_integer(field.type) or pa.types.is_floating(field.type))
+        and field.name not in remove
+    ]
+
+
+@traced
+def apply_standard_scaling(df):
+    """Applique une standardisation."""
+    scaler = StandardScaler()
+    scaled = scaler.fit_transform(df)
+    return scaled, scaler
+
+
+@traced
+def apply_pca(scaled_data, n_components):
+    """Applique la PCA avec n composantes."""
+    pca = PCA(n_components=n_components, random_state=42)
+    reduced = pca.fit_transform(scaled_data)
+    return reduced, pca
+
+
+def save_pca_model(feature_cols, scaler, pca, path=MODEL_PATH):
+    """Sauvegarde les colonnes d'entrée, le StandardScaler et la PCA ajustés."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump({"feature_cols": list(feature_cols), "scaler": scaler, "pca": pca}, path)
+
+
+def _flip_signs(components):
+    """Convention de signe de sklearn : la plus grande charge (en valeur absolue) de chaque axe est positive."""
+    max_abs = np.argmax(np.abs(components), axis=1)
+    signs = np.sign(components[np.arange(len(components)), max_abs])
+    signs[signs == 0] = 1
+    return components * signs[:, None]
+
+
+@traced
+def fit_streaming_moments(path, feature_cols, batch_rows=BATCH_ROWS):
+    """
+    Une passe sur les lots : accumule effectif, somme et produits croisés (float64, données
+    recentrées sur le premier lot pour limiter les erreurs d'arrondi).
+    Renvoie la moyenne, la variance (ddof=0) et la covariance (ddof=1) des variables.
+    """
+    n = 0
+    shift = None
+    sums = None
+    cross = None
+
+    for batch in iter_dvf_batches(path, ANNEES, DEPARTEMENTS, columns=feature_cols, batch_size=batch_rows):
+        X = np.column_stack([batch.column(c).to_numpy(zero_copy_only=False) for c in feature_cols]).astype(np.float64)
+        if shift is None:
+            shift = X.mean(axis=0)
+            sums = np.zeros(X.shape[1])
+            cross = np.zeros((X.shape[1], X.shape[1]))
+        X -= shift
+        n += len(X)
+        sums += X.sum(axis=0)
+        cross += X.T @ X
+
+    mean_c = sums / n
+    cov0 = cross / n - np.outer(mean_c, mean_c)
+    var = np.diag(cov0).copy()
+    cov1 = cov0 * n / (n - 1)
+    return n, mean_c + shift, var, cov1
+
+
+@traced
+def fit_streaming_pca(n, mean, var, cov, n_components):
+    """
+    Standardisation et PCA déduites des moments : la PCA des données standardisées est la
+    décomposition propre de leur matrice de covariance. Renvoie un StandardScaler et une PCA
+    ajustés (utilisables avec transform) sans avoir matérialisé la matrice standardisée.
+    """
+    scale = np.sqrt(var)
+    scale[scale == 0] = 1.0  # comme StandardScaler pour les variables constantes
+
+    scaler = StandardScaler()
+    scaler.mean_, scaler.var_, scaler.scale_ = mean, var, scale
+    scaler.n_samples_seen_ = n
+    scaler.n_features_in_ = len(mean)
+
+    cov_scaled = cov / np.outer(scale, scale)
+    eigvals, eigvecs = np.linalg.eigh(cov_scaled)
+    order = np.argsort(eigvals)[::-1]
+    eigvals = np.clip(eigvals[order], 0, None)
+    components = _flip_signs(eigvecs[:, order].T)
+
+    pca = PCA(n_components=n_components, random_state=42)
+    pca.n_components_ = n_components
+    pca.n_features_in_ = len(mean)
+    pca.n_samples_ = n
+    pca.mean_ = np.zeros(len(mean))
+    pca.components_ = components[:n_components]
+    pca.explained_variance_ = eigvals[:n_components]
+    pca.explained_variance_ratio_ = eigvals[:n_components] / eigvals.sum()
+    pca.singular_values_ = np.sqrt(eigvals[:n_components] * (n - 1))
+    pca.noise_variance_ = eigvals[n_components:].mean() if len(eigvals) > n_components else 0.0
+    return scaler, pca
+
+
+@traced
+def write_streaming_scores(path, feature_cols, scaler, pca, store, batch_rows=BATCH_ROWS):
+    """
+    Seconde passe : projette chaque lot et écrit les scores PC en float32, lot par lot,
+    dans les Parquet et dans le magasin de variables (variables numériques + scores).
+    """
+    n_components = pca.n_components_
+    pc_cols = [f"PC{i+1}" for i in range(n_components)]
+    writer20 = None
+    writer2 = None
+
+    numeric_cols = select_feature_columns(open_dvf_dataset(path).schema, remove=[])
+    n_rows = count_dvf_rows(path, ANNEES, DEPARTEMENTS)
+    store_features = store.create_matrix("features", n_rows, numeric_cols)
+    store_pca = store.create_matrix("pca", n_rows, pc_cols)
+    type_codes = np.empty(n_rows, dtype=np.int8)
+    start = 0
+
+    columns = numeric_cols + ["Type local"]
+    for batch in iter_dvf_batches(path, ANNEES, DEPARTEMENTS, columns=columns, batch_size=batch_rows):
+        stop = start + batch.num_rows
+        for j, c in enumerate(numeric_cols):
+            store_features[start:stop, j] = batch.column(c).to_numpy(zero_copy_only=False)
+        type_codes[start:stop] = type_local_codes(batch.column("Type local").to_pandas())
+
+        X = np.column_stack([batch.column(c).to_numpy(zero_copy_only=False) for c in feature_cols]).astype(np.float64)
+        scores = (((X - scaler.mean_) / scaler.scale_) @ pca.components_.T).astype(np.float32)
+        store_pca[start:stop] = scores
+        start = stop
+
+        arrays20 = [pa.array(scores[:, i]) for i in range(n_components)] + [batch.column("Type local")]
+        table20 = pa.Table.from_arrays(arrays20, names=pc_cols + ["Type local"])
+        table2 = pa.Table.from_arrays(
+            [pa.array(scores[:, 0]), pa.array(scores[:, 1]),
+             batch.column("type_local_encoded"), batch.column("Type local")],
+            names=["PC1", "PC2", "type_local_encoded", "Type local"],
+        )
+
+        if writer20 is None:
+            writer20 = pq.ParquetWriter(OUTPUT_PCA20, table20.schema)
+            writer2 = pq.ParquetWriter(OUTPUT_PCA2, table2.schema)
+        writer20.write_table(table20)
+        writer2.write_table(table2)
+
+    if writer20 is not None:
+        writer20.close()
+        writer2.close()
+    store_features.flush()
+    store_pca.flush()
+    store.write_groups("type_local", type_codes, TYPES_LOCAUX)
+
+
+def main_streaming():
+    """PCA en flux : moments accumulés en une passe, scores écrits lot par lot."""
+    feature_cols = select_feature_columns(open_dvf_dataset(INPUT_PATH).schema)
+    print(f"Nombre de variables utilisées pour PCA : {len(feature_cols)}")
+
+    print("Passe 1 : moments (standardisation + covariance)")
+    n, mean, var, cov = fit_streaming_moments(INPUT_PATH, feature_cols)
+    print(f"Lignes lues : {n:,}")
+
+    n_components = min(N_COMPONENTS, len(feature_cols))
+    scaler, pca20 = fit_streaming_pca(n, mean, var, cov, n_components)
+    print(f"Variance expliquée par {n_components} composantes : {np.sum(pca20.explained_variance_ratio_):.4f}")
+    print(f"Variance expliquée par les 2 premières composantes : "
+          f"{np.sum(pca20.explained_variance_ratio_[:2]):.4f}")
+
+    save_pca_model(feature_cols, scaler, pca20)
+    print(f"Modèle PCA sauvegardé : {MODEL_PATH}")
+
+    print("Passe 2 : projection et écriture des scores (float32)")
+    write_streaming_scores(INPUT_PATH, feature_cols, scaler, pca20, FeatureStore(STORE_DIR))
+    print(f"PCA20 sauvegardée : {OUTPUT_PCA20}")
+    print(f"Magasin de variables : {STORE_DIR}")
+    print(f"PCA2 sauvegardée : {OUTPUT_PCA2}")
+    print("Réduction de dimension terminée.")
+
+
+def main():
+    if MODE_PCA == "streaming":
+        main_streaming()
+        return
+
+    print("Chargement des données enrichies")
+    df = read_dvf_dataset(INPUT_PATH, annees=ANNEES, departements=DEPARTEMENTS)
+    print(f"Lignes chargées : {len(df):,}")
+    
+    # magasin de variables : toutes les variables numériques, écrites une fois en float32
+    store = FeatureStore(STORE_DIR)
+    store.write_matrix("features", df.select_dtypes(include=[np.number]))
+    store.write_groups("type_local", type_local_codes(df["Type local"]), TYPES_LOCAUX)
+
+    # sélection des variables
+    df_features, feature_cols = select_features(df)
+    print(f"Nombre de variables utilisées pour PCA : {len(feature_cols)}")
+
+    # standardisation
+    print("Standardisation des variables")
+    scaled_data, scaler = apply_standard_scaling(df_features)
+
+    # PCA 20 composantes
+    n_features = scaled_data.shape[1]
+    n_components = min(N_COMPONENTS, n_features)
+    print(f"Application de la PCA avec {n_components} composantes (max possible)")
+    pca20_data, pca20 = apply_pca(scaled_data, n_components=n_components)
+    save_pca_model(feature_cols, scaler, pca20)
+    print(f"Modèle PCA sauvegardé : {MODEL_PATH}")
+
+    # ajout au dataframe
+    df_pca20 = pd.DataFrame(
+        pca20_data,
+        columns=[f"PC{i+1}" for i in range(n_components)]
+    )
+    store.write_matrix("pca", df_pca20)
+    print(f"Magasin de variables : {STORE_DIR}")
+    df_pca20["Type local"] = df["Type local"].values
+
+    # sauvegarde
+    write_parquet(df_pca20, OUTPUT_PCA20)
+    print(f"PCA20 sauvegardée : {OUTPUT_PCA20}")
+
+    # variance expliquée
+    explained_var = np.sum(pca20.explained_variance_ratio_)
+    print(f"Variance expliquée par {n_components} composantes : {explained_var:.4f}")
+    
+    # PCA 2 composantes pour visualiser : ce sont les 2 premiers axes de la PCA20, pas de nouvel ajustement
+    print("Projection sur les 2 premières composantes (visu)")
+    df_pca2 = df_pca20[["PC1", "PC2"]].copy()
+    df_pca2["type_local_encoded"] = df["type_local_encoded"].values
+    df_pca2["Type local"] = df["Type local"].values
+
+    write_parquet(df_pca2, OUTPUT_PCA2)
+    print(f"PCA2 sauvegardée : {OUTPUT_PCA2}")
+    print(f"Variance expliquée par les 2 premières composantes : "
+          f"{np.sum(pca20.explained_variance_ratio_[:2]):.4f}")
+
+    print("Réduction de dimension terminée.")
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,167 +1,401 @@
-import pandas as pd
-import numpy as np
-import os
-
-from sklearn.cluster import MiniBatchKMeans
-from sklearn.metrics import silhouette_score
-import hdbscan
-
-RANDOM_STATE = 42
-BATCH_SIZE = 10_000
-N_PCA_CLUSTER = 3
-SIL_SAMPLE_SIZE = 20_000
-
-# K-means
-N_CLUSTERS_GLOBAL = 6
-N_CLUSTERS_APPART = 5
-N_CLUSTERS_MAISON = 5
-
-# HDBSCAN
-HDBSCAN_SAMPLE_SIZE = 30_000
-MIN_CLUSTER_SIZE = 100
-MIN_SAMPLES = 5
-
-
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-PCA_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_2024_pca20.parquet")
-
-OUT_KMEANS_GLOBAL = os.path.join(BASE_DIR, "data", "processed", "dvf_kmeans_global.parquet")
-OUT_KMEANS_APPART = os.path.join(BASE_DIR, "data", "processed", "dvf_kmeans_appart.parquet")
-OUT_KMEANS_MAISON = os.path.join(BASE_DIR, "data", "processed", "dvf_kmeans_maison.parquet")
-OUT_HDBSCAN = os.path.join(BASE_DIR, "data", "processed", "dvf_hdbscan_sample.parquet")
-
-def run_kmeans(X, n_clusters, label, name):
-    print(f"K-Means ({name})")
-
-    km = MiniBatchKMeans(
-        n_clusters=n_clusters,
-        batch_size=BATCH_SIZE,
-        random_state=RANDOM_STATE,
-        n_init="auto"
-    )
-
-    labels = km.fit_predict(X)
-
-    sil = silhouette_score(
-        X,
-        labels,
-        sample_size=min(SIL_SAMPLE_SIZE, len(X)),
-        random_state=RANDOM_STATE
-    )
-
-    print(f"Silhouette ({name}) : {sil:.3f}")
-    return labels, sil
-
-
-# MAIN
-def main():
-
-    print("Chargement PCA")
-    df = pd.read_parquet(PCA_PATH)
-
-    pca_cols = [c for c in df.columns if c.startswith("PC")][:N_PCA_CLUSTER]
-
-    # K-MEANS GLOBAL
-    X_global = df[pca_cols].values
-    labels_global, _ = run_kmeans(X_global, N_CLUSTERS_GLOBAL, df.index, "global")
-
-    df_global = df.copy()
-    df_global["cluster_kmeans"] = labels_global
-    df_global.to_parquet(OUT_KMEANS_GLOBAL, index=False)
-
-
-    pca_cols_subset = [c for c in df.columns if c.startswith("PC")][:5] # On prend 5 PCs au lieu de 3
-    
-    # OPTIMISATION APPARTEMENTS 
-    print("\nOptimisation K-Means (Appartements) ")
-    df_app = df[df["Type local"] == "Appartement"].copy()
-    X_app = df_app[pca_cols_subset].values
-
-    best_sil_app = -1
-    best_labels_app = None
-    best_k_app = 3
-
-    for k in range(3, 7):
-        labels, sil = run_kmeans(X_app, k, df_app.index, f"appart k={k}")
-        if sil > best_sil_app:
-            best_sil_app = sil
-            best_labels_app = labels
-            best_k_app = k
-    
-    print(f"RETENU (Appartements) : k={best_k_app} avec Silhouette={best_sil_app:.3f}")
-    df_app["cluster_kmeans"] = best_labels_app
-    df_app.to_parquet(OUT_KMEANS_APPART, index=False)
-
-    # OPTIMISATION MAISONS 
-    print("\nOptimisation K-Means (Maisons)")
-    df_mai = df[df["Type local"] == "Maison"].copy()
-    X_mai = df_mai[pca_cols_subset].values
-
-    best_sil_mai = -1
-    best_labels_mai = None
-    best_k_mai = 3
-
-    for k in range(3, 7):
-        labels, sil = run_kmeans(X_mai, k, df_mai.index, f"maison k={k}")
-        if sil > best_sil_mai:
-            best_sil_mai = sil
-            best_labels_mai = labels
-            best_k_mai = k
-
-    print(f"RETENU (Maisons) : k={best_k_mai} avec Silhouette={best_sil_mai:.3f}")
-    df_mai["cluster_kmeans"] = best_labels_mai
-    df_mai.to_parquet(OUT_KMEANS_MAISON, index=False)
-    
-    # HDBSCAN (ÉCHANTILLON CONTRÔLÉ)
-    print("HDBSCAN (échantillon contrôlé)")
-
-    HDBSCAN_SAMPLE_SIZE = 30_000
-
-    rng = np.random.RandomState(RANDOM_STATE)
-    sample_idx = rng.choice(df.index, HDBSCAN_SAMPLE_SIZE, replace=False)
-
-    X_sample = df.loc[sample_idx, pca_cols].values
-
-    hdb = hdbscan.HDBSCAN(
-        min_cluster_size=100,
-        min_samples=5,
-        metric="euclidean"
-    )
-
-    labels_hdb = hdb.fit_predict(X_sample)
-
-    # Nombre de clusters (hors bruit)
-    clusters_hdb = np.unique(labels_hdb)
-    clusters_hdb = clusters_hdb[clusters_hdb != -1]
-
-    n_clusters_hdb = len(clusters_hdb)
-    n_noise = np.sum(labels_hdb == -1)
-
-    print(f"Clusters HDBSCAN détectés : {n_clusters_hdb}")
-    print(f"Points considérés comme bruit : {n_noise} ({n_noise / len(labels_hdb):.1%})")
-
-    # Silhouette HDBSCAN (hors bruit)
-    mask = labels_hdb != -1
-
-    if mask.sum() > 1 and len(np.unique(labels_hdb[mask])) > 1:
-        sil_hdb = silhouette_score(
-            X_sample[mask],
-            labels_hdb[mask],
-            sample_size=min(20_000, mask.sum()),
-            random_state=RANDOM_STATE
-        )
-        print(f"Silhouette score HDBSCAN (hors bruit) : {sil_hdb:.3f}")
-    else:
-        print("Silhouette HDBSCAN non calculable")
-
-    # Sauvegarde
-    df_hdb = df.loc[sample_idx].copy()
-    df_hdb["cluster_hdbscan"] = labels_hdb
-    df_hdb.to_parquet(OUT_HDBSCAN, index=False)
-
-
-    print("Clustering terminé.")
-
-
-if __name__ == "__main__":
-    main()
+import pandas as pd
+import numpy as np
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score, adjusted_rand_score
+from threadpoolctl import threadpool_limits
+import hdbscan
+
+from dvf_silhouette import MODE_LABELS, distance_matrix, resolve_mode, silhouette, silhouette_precomputed
+from dvf_schema import TYPES_LOCAUX, write_parquet
+from dvf_store import FeatureStore
+from dvf_telemetry import span, traced
+
+RANDOM_STATE = 42
+BATCH_SIZE = 10_000
+N_PCA_CLUSTER = 3
+N_PCA_TYPE = 5  # composantes du K-Means par type de bien (Appartements, Maisons)
+SIL_SAMPLE_SIZE = 20_000  # taille des sous-échantillons en mode bootstrap
+# "auto" (exacte si n <= 50k, sinon simplifiée sur toutes les lignes), "exact", "simplified", "bootstrap"
+SIL_MODE = "auto"
+
+# K-means
+N_CLUSTERS_GLOBAL = 6
+N_CLUSTERS_APPART = 5
+N_CLUSTERS_MAISON = 5
+
+# Sélection de k par type de bien (grille (type, k) évaluée en parallèle)
+K_MIN = 3
+K_MAX = 6
+WARM_START = True          # k initialisé depuis les centroïdes de k-1
+# silhouette de la grille : "auto" = un sous-échantillon par type, tiré une fois, dont les
+# distances sont calculées une fois et partagées par tous les k (exact si le type tient dans
+# l'échantillon) ; "exact" = toutes les lignes ; "bootstrap" = moyenne et IC95 (≈ SWEEP_SIL_BOOT fois plus cher)
+SWEEP_SIL_MODE = "auto"
+SWEEP_SIL_SAMPLE = 20_000  # taille du sous-échantillon (20k comme SIL_SAMPLE_SIZE, matrice de 1,6 Go en float32)
+SWEEP_SIL_BOOT = 10        # nombre de sous-échantillons du mode bootstrap
+SWEEP_INIT_SAMPLE = 5_000  # lignes où est tiré le centroïde ajouté en warm start
+N_WORKERS = min(4, os.cpu_count() or 1)
+
+# HDBSCAN
+HDBSCAN_SAMPLE_SIZE = 30_000
+MIN_CLUSTER_SIZE = 100
+MIN_SAMPLES = 5
+# Étiquetage de toute la population : ajustement sur l'échantillon puis approximate_predict par lots
+HDBSCAN_FULL = True
+HDBSCAN_PREDICT_BATCH = 50_000
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# scores PC écrits par l'étape 04 dans le magasin de variables (memory-map, cf. dvf_store)
+STORE_DIR = os.path.join(BASE_DIR, "data", "processed", "feature_store")
+# labels K-Means global et index de lignes par cluster (magasin séparé, relu par 06 et 07)
+CLUSTER_STORE_DIR = os.path.join(BASE_DIR, "data", "processed", "feature_store_clusters")
+
+OUT_KMEANS_GLOBAL = os.path.join(BASE_DIR, "data", "processed", "dvf_kmeans_global.parquet")
+OUT_KMEANS_APPART = os.path.join(BASE_DIR, "data", "processed", "dvf_kmeans_appart.parquet")
+OUT_KMEANS_MAISON = os.path.join(BASE_DIR, "data", "processed", "dvf_kmeans_maison.parquet")
+OUT_HDBSCAN = os.path.join(BASE_DIR, "data", "processed", "dvf_hdbscan_sample.parquet")
+OUT_HDBSCAN_FULL = os.path.join(BASE_DIR, "data", "processed", "dvf_hdbscan_full.parquet")
+OUT_K_SELECTION = os.path.join(BASE_DIR, "data", "processed", "k_selection.csv")
+# centroïdes des K-Means (global : N_PCA_CLUSTER premières composantes, par type : N_PCA_TYPE),
+# pour affecter de nouvelles transactions sans réajustement (dvf_assign, dvf_scoring)
+OUT_CENTROIDS_GLOBAL = os.path.join(BASE_DIR, "data", "models", "kmeans_global_centroids.npy")
+OUT_CENTROIDS_APPART = os.path.join(BASE_DIR, "data", "models", "kmeans_appart_centroids.npy")
+OUT_CENTROIDS_MAISON = os.path.join(BASE_DIR, "data", "models", "kmeans_maison_centroids.npy")
+
+@traced
+def run_kmeans(X, n_clusters, label, name):
+    print(f"K-Means ({name})")
+
+    km = MiniBatchKMeans(
+        n_clusters=n_clusters,
+        batch_size=BATCH_SIZE,
+        random_state=RANDOM_STATE,
+        n_init="auto"
+    )
+
+    labels = km.fit_predict(X)
+
+    sil, interval = silhouette(
+        X, labels, mode=SIL_MODE, centers=km.cluster_centers_,
+        sample_size=SIL_SAMPLE_SIZE, random_state=RANDOM_STATE
+    )
+
+    label = MODE_LABELS[resolve_mode(SIL_MODE, len(X))]
+    if interval is not None:
+        print(f"{label} ({name}) : {sil:.3f} (IC95 [{interval[0]:.3f}, {interval[1]:.3f}])")
+    else:
+        print(f"{label} ({name}) : {sil:.3f}")
+    return labels, sil, km.cluster_centers_
+
+
+# SÉLECTION DE K (GRILLE PARALLÈLE)
+
+# données partagées avec les processus de la grille :
+# {type: (X, indices de l'échantillon d'init, indices du sous-échantillon de silhouette, ses distances)}
+_SWEEP_DATA = {}
+
+
+def _init_sweep_worker(shared, n_threads):
+    _SWEEP_DATA.update(shared)
+    threadpool_limits(limits=n_threads)
+
+
+def _next_centroid(X_sample, centroids, rng):
+    """Ajoute un centroïde à la manière de k-means++ (tirage proportionnel à la distance²)."""
+    d2 = ((X_sample[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+    probs = d2 / d2.sum() if d2.sum() > 0 else None
+    return X_sample[rng.choice(len(X_sample), p=probs)]
+
+
+def _sweep_silhouette(name, labels):
+    """Silhouette d'un candidat de la grille : (score, intervalle ou None)."""
+    X, _, sil_idx, sil_dist = _SWEEP_DATA[name]
+    if len(np.unique(labels)) < 2:
+        return np.nan, None
+    if SWEEP_SIL_MODE == "auto":
+        # mêmes lignes et mêmes distances pour tous les k : seul le produit par les labels est refait
+        sample_labels = labels[sil_idx]
+        if len(np.unique(sample_labels)) < 2:
+            return np.nan, None
+        return silhouette_precomputed(sil_dist, sample_labels), None
+    # random_state fixe : mêmes sous-échantillons pour tous les k (comparaison appariée)
+    return silhouette(X, labels, mode=SWEEP_SIL_MODE, sample_size=SWEEP_SIL_SAMPLE,
+                      n_boot=SWEEP_SIL_BOOT, random_state=RANDOM_STATE)
+
+
+def _evaluate_k(name, k, init=None):
+    """Ajuste K-Means pour un k donné et calcule les 4 indicateurs de qualité."""
+    X = _SWEEP_DATA[name][0]
+
+    km = MiniBatchKMeans(
+        n_clusters=k,
+        batch_size=BATCH_SIZE,
+        random_state=RANDOM_STATE,
+        init="k-means++" if init is None else init,
+        n_init="auto" if init is None else 1
+    )
+    labels = km.fit_predict(X)
+    sil, interval = _sweep_silhouette(name, labels)
+
+    metrics = {
+        "type": name,
+        "k": k,
+        "inertia": km.inertia_,
+        "silhouette": sil,
+        "silhouette_bas": np.nan if interval is None else interval[0],
+        "silhouette_haut": np.nan if interval is None else interval[1],
+        "calinski_harabasz": calinski_harabasz_score(X, labels),
+        "davies_bouldin": davies_bouldin_score(X, labels),
+    }
+    return metrics, labels.astype(np.int32), km.cluster_centers_
+
+
+def _sweep_chain(name, k_values):
+    """Évalue les k dans l'ordre, chaque k étant initialisé depuis les centroïdes du précédent."""
+    X, sample_idx = _SWEEP_DATA[name][:2]
+    rng = np.random.RandomState(RANDOM_STATE)
+    results = []
+    centroids = None
+    for k in k_values:
+        init = None
+        if centroids is not None and len(centroids) == k - 1:
+            init = np.vstack([centroids, _next_centroid(X[sample_idx], centroids, rng)])
+        metrics, labels, centroids = _evaluate_k(name, k, init)
+        results.append((metrics, labels, centroids))
+    return results
+
+
+def _sweep_single(name, k):
+    return [_evaluate_k(name, k)]
+
+
+@traced
+def run_k_sweep(datasets, k_values, warm_start=WARM_START, n_workers=N_WORKERS):
+    """
+    Évalue la grille (type, k) dans un pool de processus.
+    datasets : {type: matrice X}. Renvoie la table des indicateurs et, par type,
+    le k retenu (meilleure silhouette) avec ses labels et ses centroïdes.
+    """
+    rng = np.random.RandomState(RANDOM_STATE)
+    shared = {}
+    for name, X in datasets.items():
+        init_idx = rng.choice(len(X), min(SWEEP_INIT_SAMPLE, len(X)), replace=False)
+        sil_idx, sil_dist = None, None
+        if SWEEP_SIL_MODE == "auto":
+            # sous-échantillon tiré une fois par type ; ses distances, calculées ici une seule fois,
+            # sont héritées par les processus (fork) et servent à tous les k
+            sil_idx = np.sort(rng.choice(len(X), min(SWEEP_SIL_SAMPLE, len(X)), replace=False))
+            sil_dist = distance_matrix(X[sil_idx])
+        shared[name] = (X, init_idx, sil_idx, sil_dist)
+
+    # warm start : chaque type est découpé en segments de k consécutifs, au moins autant de
+    # chaînes que de processus (seul le premier k d'un segment part de k-means++) ;
+    # sinon une tâche par couple (type, k)
+    if warm_start:
+        n_segments = min(len(k_values), -(-n_workers // len(datasets)))
+        tasks = [
+            (_sweep_chain, name, [int(k) for k in segment])
+            for name in datasets
+            for segment in np.array_split(np.asarray(k_values), n_segments)
+        ]
+    else:
+        tasks = [(_sweep_single, name, k) for name in datasets for k in k_values]
+
+    n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=context,
+        initializer=_init_sweep_worker, initargs=(shared, n_threads)
+    ) as executor:
+        futures = [executor.submit(func, name, arg) for func, name, arg in tasks]
+        outputs = [res for fut in futures for res in fut.result()]
+
+    table = pd.DataFrame([metrics for metrics, _, _ in outputs])
+    best = {}
+    for name in datasets:
+        candidates = [c for c in outputs if c[0]["type"] == name]
+        metrics, labels, centroids = max(candidates, key=lambda c: np.nan_to_num(c[0]["silhouette"], nan=-1))
+        best[name] = (metrics["k"], metrics["silhouette"], labels, centroids)
+
+    table["retenu"] = [best[m["type"]][0] == m["k"] for m, _, _ in outputs]
+    return table.sort_values(["type", "k"]).reset_index(drop=True), best
+
+
+# HDBSCAN : PROPAGATION À TOUTE LA POPULATION
+
+# modèle HDBSCAN partagé avec les processus de prédiction
+_HDB_MODEL = {}
+
+
+def _init_predict_worker(clusterer, n_threads):
+    _HDB_MODEL["clusterer"] = clusterer
+    threadpool_limits(limits=n_threads)
+
+
+def _predict_batch(X_batch):
+    labels, strengths = hdbscan.approximate_predict(_HDB_MODEL["clusterer"], X_batch)
+    return labels.astype(np.int32), strengths.astype(np.float32)
+
+
+@traced
+def propagate_hdbscan(clusterer, X, batch_size=HDBSCAN_PREDICT_BATCH, n_workers=N_WORKERS):
+    """
+    Attribue un label et une force d'appartenance à chaque ligne de X à partir d'un
+    HDBSCAN ajusté avec prediction_data=True (lots traités en parallèle).
+    """
+    labels = np.empty(len(X), dtype=np.int32)
+    strengths = np.empty(len(X), dtype=np.float32)
+    bounds = [(start, min(start + batch_size, len(X))) for start in range(0, len(X), batch_size)]
+
+    n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=context,
+        initializer=_init_predict_worker, initargs=(clusterer, n_threads)
+    ) as executor:
+        futures = [executor.submit(_predict_batch, X[start:end]) for start, end in bounds]
+        for (start, end), fut in zip(bounds, futures):
+            labels[start:end], strengths[start:end] = fut.result()
+
+    return labels, strengths
+
+
+# MAIN
+def main():
+
+    print("Chargement PCA (magasin de variables, memory-map)")
+    store = FeatureStore(STORE_DIR)
+    pcs = store.matrix("pca")
+    # vue sans copie sur le memory-map, utilisée pour les sorties Parquet
+    df = store.frame("pca")
+    df["Type local"] = pd.Categorical.from_codes(store.array("type_local"), categories=TYPES_LOCAUX)
+
+    # K-MEANS GLOBAL
+    X_global = pcs[:, :N_PCA_CLUSTER]
+    labels_global, _, centers_global = run_kmeans(X_global, N_CLUSTERS_GLOBAL, df.index, "global")
+    os.makedirs(os.path.dirname(OUT_CENTROIDS_GLOBAL), exist_ok=True)
+    np.save(OUT_CENTROIDS_GLOBAL, centers_global)
+
+    FeatureStore(CLUSTER_STORE_DIR).write_groups("cluster_kmeans", labels_global, range(N_CLUSTERS_GLOBAL))
+    df_global = df.assign(cluster_kmeans=labels_global)
+    write_parquet(df_global, OUT_KMEANS_GLOBAL)
+
+
+    # OPTIMISATION APPARTEMENTS / MAISONS : grille (type, k) en parallèle
+    # index de lignes persistés par 04 : seules les lignes de chaque type sont copiées
+    rows_app = store.rows("type_local", "Appartement")
+    rows_mai = store.rows("type_local", "Maison")
+    k_values = range(K_MIN, K_MAX + 1)
+
+    print(f"\nOptimisation K-Means (Appartements, Maisons) : k de {K_MIN} à {K_MAX}")
+    table, best = run_k_sweep(
+        {
+            "Appartement": pcs[rows_app, :N_PCA_TYPE],
+            "Maison": pcs[rows_mai, :N_PCA_TYPE],
+        },
+        k_values
+    )
+    print(table.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    table.to_csv(OUT_K_SELECTION, index=False)
+
+    best_k_app, best_sil_app, best_labels_app, centers_app = best["Appartement"]
+    print(f"RETENU (Appartements) : k={best_k_app} avec Silhouette={best_sil_app:.3f}")
+    np.save(OUT_CENTROIDS_APPART, centers_app)
+    df_app = df.iloc[rows_app].assign(cluster_kmeans=best_labels_app)
+    write_parquet(df_app, OUT_KMEANS_APPART)
+
+    best_k_mai, best_sil_mai, best_labels_mai, centers_mai = best["Maison"]
+    print(f"RETENU (Maisons) : k={best_k_mai} avec Silhouette={best_sil_mai:.3f}")
+    np.save(OUT_CENTROIDS_MAISON, centers_mai)
+    df_mai = df.iloc[rows_mai].assign(cluster_kmeans=best_labels_mai)
+    write_parquet(df_mai, OUT_KMEANS_MAISON)
+    
+    # HDBSCAN (ÉCHANTILLON CONTRÔLÉ)
+    print("HDBSCAN (échantillon contrôlé)")
+
+    rng = np.random.RandomState(RANDOM_STATE)
+    sample_idx = rng.choice(df.index, min(HDBSCAN_SAMPLE_SIZE, len(df)), replace=False)
+
+    X_sample = pcs[sample_idx, :N_PCA_CLUSTER]
+
+    hdb = hdbscan.HDBSCAN(
+        min_cluster_size=MIN_CLUSTER_SIZE,
+        min_samples=MIN_SAMPLES,
+        metric="euclidean",
+        prediction_data=HDBSCAN_FULL
+    )
+
+    with span("hdbscan_fit", lignes=len(X_sample)):
+        labels_hdb = hdb.fit_predict(X_sample)
+
+    # Nombre de clusters (hors bruit)
+    clusters_hdb = np.unique(labels_hdb)
+    clusters_hdb = clusters_hdb[clusters_hdb != -1]
+
+    n_clusters_hdb = len(clusters_hdb)
+    n_noise = np.sum(labels_hdb == -1)
+
+    print(f"Clusters HDBSCAN détectés : {n_clusters_hdb}")
+    print(f"Points considérés comme bruit : {n_noise} ({n_noise / len(labels_hdb):.1%})")
+
+    # Silhouette HDBSCAN (hors bruit)
+    mask = labels_hdb != -1
+
+    if mask.sum() > 1 and len(np.unique(labels_hdb[mask])) > 1:
+        sil_hdb, interval = silhouette(
+            X_sample[mask], labels_hdb[mask], mode=SIL_MODE,
+            sample_size=SIL_SAMPLE_SIZE, random_state=RANDOM_STATE
+        )
+        label = MODE_LABELS[resolve_mode(SIL_MODE, int(mask.sum()))]
+        if interval is not None:
+            print(f"{label} HDBSCAN (hors bruit) : {sil_hdb:.3f} "
+                  f"(IC95 [{interval[0]:.3f}, {interval[1]:.3f}])")
+        else:
+            print(f"{label} HDBSCAN (hors bruit) : {sil_hdb:.3f}")
+    else:
+        print("Silhouette HDBSCAN non calculable")
+
+    # Sauvegarde
+    df_hdb = df.iloc[sample_idx].assign(cluster_hdbscan=labels_hdb)
+    write_parquet(df_hdb, OUT_HDBSCAN)
+
+    # HDBSCAN (POPULATION COMPLÈTE)
+    if HDBSCAN_FULL:
+        print("HDBSCAN : propagation des labels à toute la population")
+        labels_full, strengths_full = propagate_hdbscan(hdb, X_global)
+
+        # les lignes de l'échantillon gardent le label et la force issus de l'ajustement
+        labels_full[sample_idx] = labels_hdb
+        strengths_full[sample_idx] = hdb.probabilities_
+
+        n_noise_full = np.sum(labels_full == -1)
+        print(f"Points considérés comme bruit (population) : {n_noise_full:,} ({n_noise_full / len(df):.1%})")
+
+        # comparaison avec la segmentation K-Means globale (hors bruit)
+        dense = labels_full != -1
+        if dense.any():
+            ari = adjusted_rand_score(labels_global[dense], labels_full[dense])
+            print(f"Accord HDBSCAN / K-Means global (ARI, hors bruit) : {ari:.3f}")
+            print(pd.crosstab(labels_global, labels_full, rownames=["kmeans"], colnames=["hdbscan"]))
+
+        in_sample = np.zeros(len(df), dtype=bool)
+        in_sample[sample_idx] = True
+        df_hdb_full = df.assign(
+            cluster_kmeans=labels_global,
+            cluster_hdbscan=labels_full,
+            hdbscan_strength=strengths_full,
+            hdbscan_in_sample=in_sample,
+        )
+        write_parquet(df_hdb_full, OUT_HDBSCAN_FULL)
+        print(f"Labels HDBSCAN complets sauvegardés : {OUT_HDBSCAN_FULL}")
+
+    print("Clustering terminé.")
+
+
+if __name__ == "__main__":
+    main()
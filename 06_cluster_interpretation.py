@@ -1,184 +1,305 @@
-import pandas as pd
-import numpy as np
-import os
-import matplotlib.pyplot as plt
-import seaborn as sns
-from math import pi
-from sklearn.preprocessing import MinMaxScaler
-
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-FEATURES_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_2024_features.parquet")
-KMEANS_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_kmeans_global.parquet")
-OUTPUT_DIR = os.path.join(BASE_DIR, "output", "cluster_analysis")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-sns.set_theme(style="whitegrid", context="paper") 
-PALETTE = "viridis" 
-
-def load_data():
-    print(" Chargement des données ")
-    df_feat = pd.read_parquet(FEATURES_PATH)
-    df_cluster = pd.read_parquet(KMEANS_PATH)
-    
-    df = df_feat.copy()
-    df["cluster"] = df_cluster["cluster_kmeans"].values
-    return df
-
-#PROFILS STATISTIQUES (CSV)
-def compute_cluster_profiles(df):
-    print("Calcul des profils ")
-    
-    profile = df.groupby("cluster").agg(
-        prix_m2_mean=("prix_m2", "mean"),
-        prix_m2_median=("prix_m2", "median"),
-        surface_mean=("Surface reelle bati", "mean"),
-        pieces_mean=("Nombre pieces principales", "mean"),
-        ratio_terrain_mean=("ratio_surface_terrain", "mean"),
-        part_maisons=("Type local", lambda x: (x == "Maison").mean()),
-        prix_median_commune=("prix_median_commune", "mean"),
-        n_biens=("cluster", "count")
-    ).reset_index()
-
-    output_csv = os.path.join(OUTPUT_DIR, "cluster_profiles.csv")
-    profile.to_csv(output_csv, index=False)
-    print(f"Profils sauvegardés : {output_csv}")
-    return profile
-
-#BOXPLOTS 
-def plot_smart_boxplots(df):
-    print("Génération des Boxplots")
-    
-    vars_to_plot = {
-        "prix_m2": "Prix au m² (€)",
-        "Surface reelle bati": "Surface (m²)",
-        "ratio_surface_terrain": "Ratio Terrain/Bâti"
-    }
-    
-    # Tri des clusters par prix médian pour l'ordre d'affichage
-    order = df.groupby("cluster")["prix_m2"].median().sort_values().index
-    
-    for var, label in vars_to_plot.items():
-        plt.figure(figsize=(10, 6))
-        sns.boxplot(
-            data=df, x="cluster", y=var, order=order, 
-            palette=PALETTE, showfliers=False, linewidth=1.2
-        )
-        plt.title(f"Distribution : {label}", fontsize=14)
-        plt.xlabel("Cluster", fontsize=11)
-        plt.ylabel(label, fontsize=11)
-        
-        plt.tight_layout()
-        plt.savefig(os.path.join(OUTPUT_DIR, f"boxplot_clean_{var}.png"), dpi=300)
-        plt.close()
-
-# RADAR CHART
-def plot_sexy_radar(profile):
-    print("Génération du Radar Chart")
-    
-    features = ['prix_m2_mean', 'surface_mean', 'pieces_mean', 'ratio_terrain_mean', 'part_maisons']
-    labels = ['Prix m²', 'Surface', 'Pièces', 'Terrain', '% Maisons']
-    
-    # Normalisation
-    scaler = MinMaxScaler()
-    data_scaled = pd.DataFrame(scaler.fit_transform(profile[features]), columns=labels)
-    data_scaled['cluster'] = profile['cluster']
-    
-    # Angles
-    angles = [n / float(len(labels)) * 2 * pi for n in range(len(labels))]
-    angles += angles[:1]
-    
-    plt.figure(figsize=(8, 8))
-    ax = plt.subplot(111, polar=True)
-    
-    plt.xticks(angles[:-1], labels, color='black', size=11)
-    ax.set_rlabel_position(0)
-    plt.yticks([0.25, 0.5, 0.75], ["25%", "50%", "75%"], color="grey", size=8)
-    plt.ylim(0, 1)
-    
-    palette = sns.color_palette(PALETTE, n_colors=len(profile))
-    
-    for i, row in data_scaled.iterrows():
-        values = row.drop('cluster').values.flatten().tolist()
-        values += values[:1]
-        cluster_id = int(row['cluster'])
-        ax.plot(angles, values, linewidth=2, label=f"Cluster {cluster_id}", color=palette[i])
-        ax.fill(angles, values, color=palette[i], alpha=0.15)
-        
-    plt.title("Profils Comparés", size=15, y=1.1)
-    plt.legend(loc='upper right', bbox_to_anchor=(0.1, 0.1), fontsize=9)
-    plt.savefig(os.path.join(OUTPUT_DIR, "radar_chart.png"), dpi=300, bbox_inches='tight')
-    plt.close()
-
-# SCATTER PLOT ALLÉGÉ
-def plot_light_scatter(df):
-    print("Génération du Scatter Plot Bivarié ")
-    
-    n_sample = min(5000, len(df))
-    df_sample = df.sample(n=n_sample, random_state=42)
-    
-    plt.figure(figsize=(10, 7))
-    
-    sns.scatterplot(
-        data=df_sample,
-        x="Surface reelle bati",
-        y="prix_m2",
-        hue="cluster",
-        palette=PALETTE,
-        alpha=0.7,  
-        s=30,       
-        edgecolor="w", 
-        linewidth=0.5
-    )
-    
-    plt.title(f"Segmentation Prix / Surface (Échantillon de {n_sample} biens)", fontsize=14)
-    plt.xlabel("Surface (m²)", fontsize=12)
-    plt.ylabel("Prix au m² (€)", fontsize=12)
-    
-    #Zoom pour éviter les extrêmes qui écrasent
-    plt.xlim(0, 250)
-    plt.ylim(0, 12000)
-    
-    plt.legend(title="Cluster", bbox_to_anchor=(1.02, 1), loc='upper left')
-    plt.tight_layout()
-    
-    plt.savefig(os.path.join(OUTPUT_DIR, "scatter_prix_surface_light.png"), dpi=300)
-    plt.close()
-    print("Sauvegardé : scatter_prix_surface_light.png")
-
-#ANALYSE GÉOGRAPHIQUE
-def process_geo_communes(df):
-    print(" Analyse Géographique ")
-    
-    #Génération CSV Communes
-    geo = df.groupby(["Code departement", "Commune", "cluster"]).size().reset_index(name="count")
-    dominant = geo.sort_values("count", ascending=False).groupby(["Code departement", "Commune"]).first().reset_index()
-    dominant.to_csv(os.path.join(OUTPUT_DIR, "dominant_cluster_by_commune.csv"), index=False)
-    
-    #Graphique Départements
-    top_depts = dominant["Code departement"].value_counts().nlargest(15).index
-    df_top = dominant[dominant["Code departement"].isin(top_depts)]
-    
-    ct = pd.crosstab(df_top["Code departement"], df_top["cluster"], normalize='index')
-    
-    ct.plot(kind='bar', stacked=True, figsize=(12, 6), colormap=PALETTE, width=0.8)
-    plt.title("Répartition des Clusters par Département (Top 15)", fontsize=14)
-    plt.xlabel("Département", fontsize=12)
-    plt.ylabel("Proportion", fontsize=12)
-    plt.legend(title="Cluster", bbox_to_anchor=(1.02, 1), loc='upper left')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig(os.path.join(OUTPUT_DIR, "geo_distrib_departements.png"), dpi=300)
-    plt.close()
-
-def main():
-    df = load_data()
-    profile = compute_cluster_profiles(df)
-    plot_smart_boxplots(df)
-    plot_sexy_radar(profile)
-    plot_light_scatter(df)
-    process_geo_communes(df)
-    
-    print("\nVisualisations générées dans output/cluster_analysis")
-
-if __name__ == "__main__":
+import pandas as pd
+import numpy as np
+import os
+import matplotlib.pyplot as plt
+import seaborn as sns
+from math import pi
+from sklearn.preprocessing import MinMaxScaler
+
+from dvf_dataset import read_dvf_dataset
+from dvf_geo import COMMUNES_CENTROIDS_PATH, RAYON_KM, CommuneIndex, code_insee
+from dvf_groupby import group_quantiles
+from dvf_schema import CODE_MAISON, type_local_codes
+from dvf_store import FeatureStore
+from dvf_sketch import QUANTILES, QuantileSketch, relative_error
+from dvf_boxstats import cluster_box_stats, draw_bxp, save_box_stats
+from dvf_report import Figure, render_figures
+from dvf_telemetry import traced
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEATURES_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_features")
+# variables numériques et clusters attachés depuis le magasin (memory-map, écrit par 04 et 05)
+STORE_DIR = os.path.join(BASE_DIR, "data", "processed", "feature_store")
+CLUSTER_STORE_DIR = os.path.join(BASE_DIR, "data", "processed", "feature_store_clusters")
+# seuls libellés lus dans le jeu de variables
+LABEL_COLS = ["Type local", "Code departement", "Commune", "Code commune"]
+OUTPUT_DIR = os.path.join(BASE_DIR, "output", "cluster_analysis")
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# quantiles du prix au m² et quartiles des boxplots par cluster : "exact" (tri) ou "sketch" (dvf_sketch, fusion par lots)
+MODE_QUANTILES = "exact"
+VALIDATION_SKETCH = False  # mode sketch : erreur mesurée contre les quantiles exacts
+TAILLE_LOT = 128_000
+
+sns.set_theme(style="whitegrid", context="paper") 
+PALETTE = "viridis" 
+
+@traced
+def load_data():
+    print(" Chargement des données ")
+    store = FeatureStore(STORE_DIR)
+    labels = read_dvf_dataset(FEATURES_PATH, columns=LABEL_COLS)
+    store.check_rows(len(labels))
+
+    df = pd.concat([store.frame("features"), labels], axis=1)
+    df["cluster"] = FeatureStore(CLUSTER_STORE_DIR).array("cluster_kmeans")
+    return df
+
+@traced
+def cluster_price_quantiles(df, mode=MODE_QUANTILES):
+    """
+    Quantiles (p10, p25, médiane, p75, p90) du prix au m² par cluster, servis ensemble.
+    En mode sketch, les lots sont ajoutés un à un à un sketch fusionnable.
+    """
+    clusters = df["cluster"].to_numpy().astype(np.int64)
+    prix = df["prix_m2"].to_numpy(dtype=float)
+    ids = np.unique(clusters)
+
+    def _exact():
+        values = group_quantiles(clusters - ids.min(), ids.max() - ids.min() + 1, prix, QUANTILES)
+        return {q: v[ids - ids.min()] for q, v in values.items()}
+
+    if mode != "sketch":
+        return _exact()
+
+    sketch = QuantileSketch()
+    for start in range(0, len(df), TAILLE_LOT):
+        sketch.update(clusters[start:start + TAILLE_LOT], prix[start:start + TAILLE_LOT])
+    approx = {q: sketch.lookup(ids, q) for q in QUANTILES}
+    if VALIDATION_SKETCH:
+        exact = _exact()
+        for q in QUANTILES:
+            err = relative_error(approx[q], exact[q])
+            print(f"  sketch p{int(q * 100)} : erreur relative max {err['max']:.3%} (borne {sketch.alpha:.1%})")
+    return approx
+
+#PROFILS STATISTIQUES (CSV)
+@traced
+def compute_cluster_profiles(df):
+    print("Calcul des profils ")
+    
+    est_maison = type_local_codes(df["Type local"]) == CODE_MAISON
+    profile = df.assign(est_maison=est_maison).groupby("cluster").agg(
+        prix_m2_mean=("prix_m2", "mean"),
+        surface_mean=("Surface reelle bati", "mean"),
+        pieces_mean=("Nombre pieces principales", "mean"),
+        ratio_terrain_mean=("ratio_surface_terrain", "mean"),
+        part_maisons=("est_maison", "mean"),
+        prix_median_commune=("prix_median_commune", "mean"),
+        n_biens=("cluster", "count")
+    ).reset_index()
+
+    quantiles = cluster_price_quantiles(df)
+    profile.insert(2, "prix_m2_median", quantiles[0.5])
+    for q in (0.1, 0.25, 0.75, 0.9):
+        profile[f"prix_m2_p{int(q * 100)}"] = quantiles[q]
+
+    output_csv = os.path.join(OUTPUT_DIR, "cluster_profiles.csv")
+    profile.to_csv(output_csv, index=False)
+    print(f"Profils sauvegardés : {output_csv}")
+    return profile
+
+#BOXPLOTS 
+BOXPLOT_VARS = {
+    "prix_m2": "Prix au m² (€)",
+    "Surface reelle bati": "Surface (m²)",
+    "ratio_surface_terrain": "Ratio Terrain/Bâti"
+}
+
+
+def render_boxplot(data):
+    fig, ax = plt.subplots(figsize=(10, 6))
+    lines = {"linewidth": 1.2}
+    draw_bxp(
+        ax, data["stats"], "cluster", order=data["order"],
+        colors=sns.color_palette(data["palette"], n_colors=len(data["order"])), showfliers=False,
+        boxprops=lines, whiskerprops=lines, capprops=lines, medianprops={"color": ".2", **lines}
+    )
+    plt.title(f"Distribution : {data['label']}", fontsize=14)
+    plt.xlabel("Cluster", fontsize=11)
+    plt.ylabel(data["label"], fontsize=11)
+    plt.tight_layout()
+    return fig
+
+
+@traced
+def boxplot_figures(df, profile):
+    """
+    Statistiques de boîte de chaque (cluster, variable) sur toutes les ventes, en une passe
+    groupée, persistées puis dessinées avec bxp (rendu indépendant du nombre de lignes).
+    """
+    print("Statistiques des boxplots")
+    stats = cluster_box_stats(df, "cluster", list(BOXPLOT_VARS), mode=MODE_QUANTILES)
+    save_box_stats(stats, os.path.join(OUTPUT_DIR, "cluster_box_stats.parquet"))
+
+    # Tri des clusters par prix médian pour l'ordre d'affichage
+    order = profile.sort_values("prix_m2_median")["cluster"].tolist()
+
+    return [
+        Figure(
+            f"boxplot_clean_{var}.png", render_boxplot,
+            {"stats": stats[stats["variable"] == var], "label": label, "order": order, "palette": PALETTE},
+            dpi=300,
+        )
+        for var, label in BOXPLOT_VARS.items()
+    ]
+
+# RADAR CHART
+RADAR_FEATURES = ['prix_m2_mean', 'surface_mean', 'pieces_mean', 'ratio_terrain_mean', 'part_maisons']
+RADAR_LABELS = ['Prix m²', 'Surface', 'Pièces', 'Terrain', '% Maisons']
+
+
+def render_radar(data):
+    profile, labels = data["profile"], RADAR_LABELS
+
+    # Normalisation
+    scaler = MinMaxScaler()
+    data_scaled = pd.DataFrame(scaler.fit_transform(profile[RADAR_FEATURES]), columns=labels)
+    data_scaled['cluster'] = profile['cluster']
+    
+    # Angles
+    angles = [n / float(len(labels)) * 2 * pi for n in range(len(labels))]
+    angles += angles[:1]
+    
+    fig = plt.figure(figsize=(8, 8))
+    ax = plt.subplot(111, polar=True)
+    
+    plt.xticks(angles[:-1], labels, color='black', size=11)
+    ax.set_rlabel_position(0)
+    plt.yticks([0.25, 0.5, 0.75], ["25%", "50%", "75%"], color="grey", size=8)
+    plt.ylim(0, 1)
+    
+    palette = sns.color_palette(data["palette"], n_colors=len(profile))
+    
+    for i, row in data_scaled.iterrows():
+        values = row.drop('cluster').values.flatten().tolist()
+        values += values[:1]
+        cluster_id = int(row['cluster'])
+        ax.plot(angles, values, linewidth=2, label=f"Cluster {cluster_id}", color=palette[i])
+        ax.fill(angles, values, color=palette[i], alpha=0.15)
+        
+    plt.title("Profils Comparés", size=15, y=1.1)
+    plt.legend(loc='upper right', bbox_to_anchor=(0.1, 0.1), fontsize=9)
+    return fig
+
+
+def radar_figure(profile):
+    data = {"profile": profile[["cluster", *RADAR_FEATURES]], "palette": PALETTE}
+    return Figure("radar_chart.png", render_radar, data, dpi=300, bbox_inches='tight')
+
+# SCATTER PLOT ALLÉGÉ
+def render_scatter(data):
+    df_sample = data["sample"]
+    fig = plt.figure(figsize=(10, 7))
+    
+    sns.scatterplot(
+        data=df_sample,
+        x="Surface reelle bati",
+        y="prix_m2",
+        hue="cluster",
+        palette=data["palette"],
+        alpha=0.7,  
+        s=30,       
+        edgecolor="w", 
+        linewidth=0.5
+    )
+    
+    plt.title(f"Segmentation Prix / Surface (Échantillon de {len(df_sample)} biens)", fontsize=14)
+    plt.xlabel("Surface (m²)", fontsize=12)
+    plt.ylabel("Prix au m² (€)", fontsize=12)
+    
+    #Zoom pour éviter les extrêmes qui écrasent
+    plt.xlim(0, 250)
+    plt.ylim(0, 12000)
+    
+    plt.legend(title="Cluster", bbox_to_anchor=(1.02, 1), loc='upper left')
+    plt.tight_layout()
+    return fig
+
+
+def scatter_figure(df):
+    n_sample = min(5000, len(df))
+    sample = df.sample(n=n_sample, random_state=42)[["Surface reelle bati", "prix_m2", "cluster"]]
+    return Figure("scatter_prix_surface_light.png", render_scatter, {"sample": sample, "palette": PALETTE}, dpi=300)
+
+#ANALYSE GÉOGRAPHIQUE
+def cluster_mix_within_radius(df, index, radius_km=RAYON_KM):
+    """
+    Pour chaque commune ayant des ventes : clusters de toutes les transactions à moins de
+    radius_km (centroïdes des communes), par un produit creux voisinage × comptages.
+    """
+    positions = index.locate(code_insee(df["Code departement"], df["Code commune"]))
+    clusters = df["cluster"].to_numpy()
+    n_clusters = clusters.max() + 1
+    known = positions >= 0
+
+    counts = np.bincount(
+        positions[known] * n_clusters + clusters[known], minlength=len(index) * n_clusters
+    ).reshape(len(index), n_clusters)
+    has_sales = np.flatnonzero(counts.sum(axis=1) > 0)
+
+    adjacency = index.radius_matrix(radius_km, sources=has_sales, targets=has_sales)
+    around = adjacency @ counts[has_sales]
+    total = around.sum(axis=1)
+
+    return pd.DataFrame({
+        "code_insee": index.codes[has_sales],
+        "n_ventes_rayon": total.astype(np.int64),
+        "cluster_dominant_rayon": around.argmax(axis=1),
+        "part_cluster_dominant_rayon": around.max(axis=1) / total,
+    })
+
+
+@traced
+def process_geo_communes(df):
+    print(" Analyse Géographique ")
+    
+    #Génération CSV Communes
+    # clés catégorielles : seules les combinaisons présentes (observed=True)
+    geo = df.groupby(["Code departement", "Commune", "cluster"], observed=True).size().reset_index(name="count")
+    dominant = (geo.sort_values("count", ascending=False)
+                .groupby(["Code departement", "Commune"], observed=True).first().reset_index())
+    dominant.to_csv(os.path.join(OUTPUT_DIR, "dominant_cluster_by_commune.csv"), index=False)
+
+    #Voisinage : cluster dominant dans un rayon autour de chaque commune
+    if os.path.exists(COMMUNES_CENTROIDS_PATH):
+        voisinage = cluster_mix_within_radius(df, CommuneIndex.from_csv(COMMUNES_CENTROIDS_PATH))
+        voisinage.to_csv(os.path.join(OUTPUT_DIR, "cluster_voisinage_communes.csv"), index=False)
+        print(f"Voisinage ({RAYON_KM:g} km) : {len(voisinage):,} communes")
+    
+    #Graphique Départements
+    top_depts = dominant["Code departement"].value_counts().nlargest(15).index
+    df_top = dominant[dominant["Code departement"].isin(top_depts)].copy()
+    df_top["Code departement"] = df_top["Code departement"].cat.remove_unused_categories()
+    
+    ct = pd.crosstab(df_top["Code departement"], df_top["cluster"], normalize='index')
+    return Figure("geo_distrib_departements.png", render_departements, {"crosstab": ct, "palette": PALETTE}, dpi=300)
+
+
+def render_departements(data):
+    ax = data["crosstab"].plot(kind='bar', stacked=True, figsize=(12, 6), colormap=data["palette"], width=0.8)
+    plt.title("Répartition des Clusters par Département (Top 15)", fontsize=14)
+    plt.xlabel("Département", fontsize=12)
+    plt.ylabel("Proportion", fontsize=12)
+    plt.legend(title="Cluster", bbox_to_anchor=(1.02, 1), loc='upper left')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    return ax.figure
+
+def main():
+    df = load_data()
+    profile = compute_cluster_profiles(df)
+
+    # résumés calculés ici ; le rendu (parallèle, figures inchangées sautées) ne voit qu'eux
+    figures = boxplot_figures(df, profile)
+    figures.append(radar_figure(profile))
+    figures.append(scatter_figure(df))
+    figures.append(process_geo_communes(df))
+
+    print("Rendu des figures")
+    render_figures(figures, OUTPUT_DIR)
+    
+    print("\nVisualisations générées dans output/cluster_analysis")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,85 +1,160 @@
-import pandas as pd
-import numpy as np
-import os
-
-from sklearn.ensemble import IsolationForest
-
-RANDOM_STATE = 42
-
-# Paramètres Isolation Forest
-CONTAMINATION = 0.03 
-N_ESTIMATORS = 200
-
-# PATHS
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-FEATURES_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_2024_features.parquet")
-KMEANS_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_kmeans_global.parquet")
-
-OUTPUT_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_anomalies_isolation_forest.parquet")
-
-# VARIABLES UTILISÉES
-ANOMALY_FEATURES = [
-    "prix_m2",
-    "Surface reelle bati",
-    "Nombre pieces principales",
-    "ratio_surface_terrain",
-    "prix_median_commune"
-]
-
-def main():
-
-    print("Chargement des données")
-    df_feat = pd.read_parquet(FEATURES_PATH)
-    df_cluster = pd.read_parquet(KMEANS_PATH)
-
-    df = df_feat.copy()
-    df["cluster"] = df_cluster["cluster_kmeans"].values
-
-    anomaly_scores = []
-    anomaly_flags = []
-
-    print("Isolation Forest par cluster")
-
-    for cluster_id in sorted(df["cluster"].unique()):
-        print(f"Cluster {cluster_id}")
-
-        df_c = df[df["cluster"] == cluster_id].copy()
-
-        X = df_c[ANOMALY_FEATURES].values
-
-        iso = IsolationForest(
-            n_estimators=N_ESTIMATORS,
-            contamination=CONTAMINATION,
-            random_state=RANDOM_STATE,
-            n_jobs=-1
-        )
-
-        iso.fit(X)
-
-        scores = iso.decision_function(X)
-        preds = iso.predict(X)  # -1 = anomalie, 1 = normal
-
-        df_c["anomaly_score"] = scores
-        df_c["anomaly_flag"] = preds
-
-        anomaly_scores.append(df_c[["anomaly_score"]])
-        anomaly_flags.append(df_c[["anomaly_flag"]])
-
-    # Reconstruction des résultats
-    df["anomaly_score"] = pd.concat(anomaly_scores).sort_index()
-    df["anomaly_flag"] = pd.concat(anomaly_flags).sort_index()
-
-    # Sauvegarde
-    df.to_parquet(OUTPUT_PATH, index=False)
-
-    n_anomalies = (df["anomaly_flag"] == -1).sum()
-    print(f"Anomalies détectées : {n_anomalies} ({n_anomalies / len(df):.2%})")
-    print(f"Fichier sauvegardé : {OUTPUT_PATH}")
-
-    print("Détection d’anomalies terminée.")
-
-
-if __name__ == "__main__":
-    main()
-
+import pandas as pd
+import numpy as np
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+from sklearn.ensemble import IsolationForest
+from threadpoolctl import threadpool_limits
+
+from dvf_dataset import read_dvf_dataset, open_dvf_dataset
+from dvf_schema import write_parquet
+from dvf_store import FeatureStore
+from dvf_telemetry import span, traced
+
+RANDOM_STATE = 42
+
+# Paramètres Isolation Forest
+CONTAMINATION = 0.03 
+N_ESTIMATORS = 200
+N_WORKERS = min(8, os.cpu_count() or 1)  # forêts ajustées en parallèle (une par cluster)
+
+# PATHS
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FEATURES_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_features")
+# variables numériques et clusters attachés depuis le magasin (memory-map, écrit par 04 et 05)
+STORE_DIR = os.path.join(BASE_DIR, "data", "processed", "feature_store")
+CLUSTER_STORE_DIR = os.path.join(BASE_DIR, "data", "processed", "feature_store_clusters")
+
+OUTPUT_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_anomalies_isolation_forest.parquet")
+# forêts par cluster + prix moyen au m² de chaque cluster, pour scorer sans réajustement (dvf_scoring)
+MODEL_PATH = os.path.join(BASE_DIR, "data", "models", "isolation_forests.joblib")
+
+# VARIABLES UTILISÉES
+ANOMALY_FEATURES = [
+    "prix_m2",
+    "Surface reelle bati",
+    "Nombre pieces principales",
+    "ratio_surface_terrain",
+    "prix_median_commune"
+]
+
+# matrice triée par cluster, partagée avec les processus (copie évitée grâce au fork)
+_SHARED = {}
+
+
+def _init_worker(X_sorted):
+    _SHARED["X"] = X_sorted
+    threadpool_limits(limits=1)
+
+
+def _fit_score_cluster(start, end):
+    """Ajuste la forêt d'un cluster et le score une seule fois (decision_function = score_samples - offset_)."""
+    X = _SHARED["X"][start:end]
+
+    with span("isolation_forest_cluster", lignes=end - start):
+        iso = IsolationForest(
+            n_estimators=N_ESTIMATORS,
+            contamination=CONTAMINATION,
+            random_state=RANDOM_STATE,
+            n_jobs=1
+        )
+        iso.fit(X)
+
+        scores = iso.score_samples(X) - iso.offset_
+    flags = np.where(scores < 0, -1, 1).astype(np.int8)  # -1 = anomalie, 1 = normal (comme predict)
+    return scores.astype(np.float32), flags, iso
+
+
+@traced
+def detect_anomalies(X, clusters, n_workers=N_WORKERS):
+    """
+    Isolation Forest par cluster. Les lignes sont regroupées une seule fois par un tri sur
+    les labels ; chaque cluster est un segment contigu traité dans un processus, et les
+    résultats sont replacés directement dans des tableaux préalloués (float32 / int8).
+    Renvoie (scores, flags, {cluster: forêt ajustée}).
+    """
+    clusters = np.asarray(clusters)
+    order = np.argsort(clusters, kind="stable")
+    cluster_ids, starts = np.unique(clusters[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    X_sorted = np.ascontiguousarray(np.asarray(X)[order])
+
+    scores = np.empty(len(order), dtype=np.float32)
+    flags = np.empty(len(order), dtype=np.int8)
+    forests = {}
+
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=context,
+        initializer=_init_worker, initargs=(X_sorted,)
+    ) as executor:
+        # les plus gros clusters d'abord pour équilibrer la charge
+        by_size = np.argsort(starts - ends)
+        futures = {i: executor.submit(_fit_score_cluster, starts[i], ends[i]) for i in by_size}
+        for i, cluster_id in enumerate(cluster_ids):
+            cluster_scores, cluster_flags, forests[cluster_id.item()] = futures[i].result()
+            rows = order[starts[i]:ends[i]]
+            scores[rows] = cluster_scores
+            flags[rows] = cluster_flags
+            print(f"Cluster {cluster_id} : {ends[i] - starts[i]:,} biens, "
+                  f"{np.sum(cluster_flags == -1):,} anomalies")
+
+    return scores, flags, forests
+
+
+def save_anomaly_models(forests, clusters, prix_m2, path=MODEL_PATH):
+    """Sauvegarde les forêts, les variables d'entrée et le prix moyen au m² de chaque cluster."""
+    clusters = np.asarray(clusters)
+    prix_m2 = np.asarray(prix_m2, dtype=float)
+    prix_m2_mean = {
+        cluster_id: float(prix_m2[clusters == cluster_id].mean()) for cluster_id in forests
+    }
+    dump_anomaly_models(forests, prix_m2_mean, path)
+
+
+def dump_anomaly_models(forests, prix_m2_mean, path=MODEL_PATH):
+    """Écrit le modèle lu par dvf_scoring : {cluster: forêt} et {cluster: prix moyen au m²}."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump(
+        {"features": ANOMALY_FEATURES, "forests": forests, "prix_m2_mean": prix_m2_mean},
+        path
+    )
+
+
+def main():
+
+    print("Chargement des données (magasin de variables, memory-map)")
+    store = FeatureStore(STORE_DIR)
+    clusters = np.asarray(FeatureStore(CLUSTER_STORE_DIR).array("cluster_kmeans"))
+
+    print("Isolation Forest par cluster")
+    scores, flags, forests = detect_anomalies(store.matrix("features", ANOMALY_FEATURES), clusters)
+
+    save_anomaly_models(forests, clusters, store.matrix("features", ["prix_m2"])[:, 0])
+    print(f"Modèles sauvegardés : {MODEL_PATH}")
+
+    # Sauvegarde : variables du magasin + libellés (et montant exact en float64) du jeu de variables
+    store_cols = [c for c in store.columns("features") if c != "Valeur fonciere"]
+    label_cols = [c for c in open_dvf_dataset(FEATURES_PATH).schema.names if c not in store_cols]
+    labels = read_dvf_dataset(FEATURES_PATH, columns=label_cols)
+    store.check_rows(len(labels))
+
+    df = pd.concat([store.frame("features", store_cols), labels], axis=1)
+    df["cluster"] = clusters
+    df["anomaly_score"] = scores
+    df["anomaly_flag"] = flags
+    write_parquet(df, OUTPUT_PATH)
+
+    n_anomalies = (df["anomaly_flag"] == -1).sum()
+    print(f"Anomalies détectées : {n_anomalies} ({n_anomalies / len(df):.2%})")
+    print(f"Fichier sauvegardé : {OUTPUT_PATH}")
+
+    print("Détection d’anomalies terminée.")
+
+
+if __name__ == "__main__":
+    main()
+
@@ -1,89 +1,114 @@
-
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from pathlib import Path
-
-OUTPUT_FIGURES = Path("output/figures")
-OUTPUT_FIGURES.mkdir(parents=True, exist_ok=True)
-
-print("Chargement des anomalies pour visualisation...")
-df = pd.read_parquet("data/processed/dvf_anomalies_isolation_forest.parquet")
-
-# Création d'un flag lisible
-df["is_anomaly"] = df["anomaly_flag"] == -1
-
-#Scatter Prix / Surface avec anomalies
-#Échantillon pour lisibilité
-df_sample = df.sample(n=min(8000, len(df)), random_state=42)
-
-plt.figure(figsize=(10, 6))
-
-#Points normaux
-plt.scatter(
-    df_sample.loc[~df_sample["is_anomaly"], "Surface reelle bati"],
-    df_sample.loc[~df_sample["is_anomaly"], "prix_m2"],
-    s=8,
-    alpha=0.3,
-    label="Biens normaux"
-)
-
-# Anomalies
-plt.scatter(
-    df_sample.loc[df_sample["is_anomaly"], "Surface reelle bati"],
-    df_sample.loc[df_sample["is_anomaly"], "prix_m2"],
-    s=15,
-    color="red",
-    alpha=0.7,
-    label="Anomalies"
-)
-
-plt.xlabel("Surface réelle bâtie (m²)")
-plt.ylabel("Prix au m² (€)")
-plt.title("Anomalies détectées – Prix au m² vs Surface")
-plt.legend()
-plt.tight_layout()
-
-plt.savefig(OUTPUT_FIGURES / "anomalies_scatter_prix_surface.png", dpi=150)
-plt.close()
-
-#Proportion d'anomalies par cluster
-anomaly_rate = (
-    df.groupby("cluster")["is_anomaly"]
-    .mean()
-    .reset_index()
-)
-
-plt.figure(figsize=(8, 5))
-sns.barplot(
-    data=anomaly_rate,
-    x="cluster",
-    y="is_anomaly"
-)
-
-plt.ylabel("Proportion d'anomalies")
-plt.xlabel("Cluster")
-plt.title("Proportion de biens atypiques par cluster")
-plt.ylim(0, anomaly_rate["is_anomaly"].max() * 1.2)
-plt.tight_layout()
-
-plt.savefig(OUTPUT_FIGURES / "anomalies_rate_by_cluster.png", dpi=150)
-plt.close()
-
-#Distribution des scores d'anomalie par cluster
-plt.figure(figsize=(10, 5))
-sns.boxplot(
-    data=df.sample(n=min(10000, len(df)), random_state=42),
-    x="cluster",
-    y="anomaly_score"
-)
-
-plt.title("Distribution des scores d'anomalie par cluster")
-plt.xlabel("Cluster")
-plt.ylabel("Score Isolation Forest")
-plt.tight_layout()
-
-plt.savefig(OUTPUT_FIGURES / "anomalies_score_distribution.png", dpi=150)
-plt.close()
-
-print("Visualisations des anomalies sauvegardées.")
+
+import pandas as pd
+import matplotlib.pyplot as plt
+import seaborn as sns
+from pathlib import Path
+
+from dvf_boxstats import cluster_box_stats, draw_bxp, save_box_stats
+from dvf_report import Figure, render_figures
+
+OUTPUT_FIGURES = Path("output/figures")
+ANOMALIES_PATH = Path("data/processed/dvf_anomalies_isolation_forest.parquet")
+# seules colonnes lues dans le fichier des anomalies
+COLUMNS = ["Surface reelle bati", "prix_m2", "cluster", "anomaly_flag", "anomaly_score"]
+SCORE_STATS_PATH = OUTPUT_FIGURES / "anomaly_score_box_stats.parquet"
+FLIERS_MAX = 200  # points hors moustaches gardés par cluster (tirage uniforme)
+
+
+#Scatter Prix / Surface avec anomalies
+def render_scatter(df_sample):
+    fig = plt.figure(figsize=(10, 6))
+
+    #Points normaux
+    plt.scatter(
+        df_sample.loc[~df_sample["is_anomaly"], "Surface reelle bati"],
+        df_sample.loc[~df_sample["is_anomaly"], "prix_m2"],
+        s=8,
+        alpha=0.3,
+        label="Biens normaux"
+    )
+
+    # Anomalies
+    plt.scatter(
+        df_sample.loc[df_sample["is_anomaly"], "Surface reelle bati"],
+        df_sample.loc[df_sample["is_anomaly"], "prix_m2"],
+        s=15,
+        color="red",
+        alpha=0.7,
+        label="Anomalies"
+    )
+
+    plt.xlabel("Surface réelle bâtie (m²)")
+    plt.ylabel("Prix au m² (€)")
+    plt.title("Anomalies détectées – Prix au m² vs Surface")
+    plt.legend()
+    plt.tight_layout()
+    return fig
+
+
+#Proportion d'anomalies par cluster
+def render_rate(anomaly_rate):
+    fig = plt.figure(figsize=(8, 5))
+    sns.barplot(
+        data=anomaly_rate,
+        x="cluster",
+        y="is_anomaly"
+    )
+
+    plt.ylabel("Proportion d'anomalies")
+    plt.xlabel("Cluster")
+    plt.title("Proportion de biens atypiques par cluster")
+    plt.ylim(0, anomaly_rate["is_anomaly"].max() * 1.2)
+    plt.tight_layout()
+    return fig
+
+
+#Distribution des scores d'anomalie par cluster
+def render_scores(stats):
+    fig, ax = plt.subplots(figsize=(10, 5))
+    draw_bxp(
+        ax, stats, "cluster", colors=[sns.color_palette()[0]] * len(stats), showfliers=True,
+        medianprops={"color": ".2"}, flierprops={"marker": "d", "markersize": 4}
+    )
+
+    plt.title("Distribution des scores d'anomalie par cluster")
+    plt.xlabel("Cluster")
+    plt.ylabel("Score Isolation Forest")
+    plt.tight_layout()
+    return fig
+
+
+def anomaly_figures(df):
+    """Résumés des trois figures (échantillon, taux et boîtes par cluster), calculés en une lecture."""
+    # Création d'un flag lisible
+    df["is_anomaly"] = df["anomaly_flag"] == -1
+
+    #Échantillon pour lisibilité
+    df_sample = df.sample(n=min(8000, len(df)), random_state=42)[["Surface reelle bati", "prix_m2", "is_anomaly"]]
+    anomaly_rate = (
+        df.groupby("cluster")["is_anomaly"]
+        .mean()
+        .reset_index()
+    )
+    # boîtes des scores sur toutes les ventes (statistiques groupées, persistées)
+    score_stats = cluster_box_stats(df, "cluster", ["anomaly_score"], n_fliers=FLIERS_MAX)
+    save_box_stats(score_stats, str(SCORE_STATS_PATH))
+
+    return [
+        Figure("anomalies_scatter_prix_surface.png", render_scatter, df_sample, dpi=150),
+        Figure("anomalies_rate_by_cluster.png", render_rate, anomaly_rate, dpi=150),
+        Figure("anomalies_score_distribution.png", render_scores, score_stats, dpi=150),
+    ]
+
+
+def main():
+    print("Chargement des anomalies pour visualisation...")
+    df = pd.read_parquet(ANOMALIES_PATH, columns=COLUMNS)
+
+    render_figures(anomaly_figures(df), OUTPUT_FIGURES)
+
+    print("Visualisations des anomalies sauvegardées.")
+
+
+if __name__ == "__main__":
+    main()
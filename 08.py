@@ -1,63 +1,169 @@
-import pandas as pd
-import os
-
-# --- CONFIGURATION ---
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-# NOM DU FICHIER CORRIGÉ ICI :
-ANOMALIES_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_anomalies_isolation_forest.parquet")
-PROFILES_PATH = os.path.join(BASE_DIR, "output", "cluster_analysis", "cluster_profiles.csv")
-OUTPUT_CSV = os.path.join(BASE_DIR, "output", "top_opportunities.csv")
-
-def main():
-    print(" Génération Express des Opportunités ")
-    
-    # 1. Chargement
-    if not os.path.exists(ANOMALIES_PATH):
-        print(f"ERREUR : Fichier toujours introuvable : {ANOMALIES_PATH}")
-        return
-
-    # Gestion souple du chemin des profils
-    if os.path.exists(PROFILES_PATH):
-        df_profiles = pd.read_csv(PROFILES_PATH)
-    else:
-        alt_path = os.path.join(BASE_DIR, "data", "processed", "cluster_profiles.csv")
-        if os.path.exists(alt_path):
-             df_profiles = pd.read_csv(alt_path)
-        else:
-             print("Profils introuvables. Impossible de calculer la décote exacte.")
-             return
-
-    # 2. Calculs
-    df_ano = pd.read_parquet(ANOMALIES_PATH)
-    
-    # Fusion pour avoir le prix moyen du cluster
-    df_merged = df_ano.merge(df_profiles[['cluster', 'prix_m2_mean']], on='cluster', how='left')
-    
-    # Calcul décote
-    df_merged['decote'] = (df_merged['prix_m2_mean'] - df_merged['prix_m2']) / df_merged['prix_m2_mean']
-    
-    # Filtre : On garde les vraies opportunités (décote > 20%)
-    opportunities = df_merged[df_merged['decote'] > 0.20].copy()
-    
-    # Tri
-    opportunities = opportunities.sort_values('decote', ascending=False)
-    
-    # Sauvegarde
-    opportunities.to_csv(OUTPUT_CSV, index=False)
-    print(f"Fichier sauvegardé : {OUTPUT_CSV}")
-
-    
-    view = opportunities.head(5).copy()
-    view['Cluster'] = view['cluster']
-    view['Commune'] = view['Commune']
-    view['Type'] = view['Type local']
-    view['Surface'] = view['Surface reelle bati'].astype(int).astype(str) + " m²"
-    view['Prix m²'] = view['prix_m2'].round(0).astype(int).astype(str) + " €"
-    view['Moyenne Cluster'] = view['prix_m2_mean'].round(0).astype(int).astype(str) + " €"
-    view['Décote'] = (view['decote'] * 100).round(1).astype(str) + " %"
-    
-    cols = ['Cluster', 'Commune', 'Type', 'Surface', 'Prix m²', 'Moyenne Cluster', 'Décote']
-    print(view[cols].to_markdown(index=False))
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import os
+
+from dvf_schema import to_arrow
+
+# --- CONFIGURATION ---
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# NOM DU FICHIER CORRIGÉ ICI :
+ANOMALIES_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_anomalies_isolation_forest.parquet")
+PROFILES_PATH = os.path.join(BASE_DIR, "output", "cluster_analysis", "cluster_profiles.csv")
+OUTPUT_TOP = os.path.join(BASE_DIR, "output", "top_opportunities.parquet")
+OUTPUT_TOP_GROUPE = os.path.join(BASE_DIR, "output", "top_opportunities_par_groupe.parquet")
+
+# Filtre : on garde les vraies opportunités (décote > 20%)
+DECOTE_MIN = 0.20
+# score de classement = décote - POIDS_ANOMALIE * anomaly_score (score < 0 = anomalie)
+POIDS_ANOMALIE = 1.0
+TOP_N = 100
+# meilleures opportunités par groupe : "cluster", "Code departement" ou "Commune"
+GROUPE_TOP = "Code departement"
+TOP_N_GROUPE = 10
+
+# seules colonnes lues dans le fichier d'anomalies
+COLUMNS = [
+    "cluster", "prix_m2", "anomaly_score", "anomaly_flag",
+    "Commune", "Code departement", "Code postal", "Type local",
+    "Surface reelle bati", "Valeur fonciere", "Date mutation",
+]
+
+
+def cluster_lookup(df_profiles, column="prix_m2_mean"):
+    """Tableau indexé par identifiant de cluster (NaN pour un cluster sans profil)."""
+    clusters = df_profiles["cluster"].to_numpy(dtype=np.int64)
+    lookup = np.full(clusters.max() + 1 if len(clusters) else 0, np.nan)
+    lookup[clusters] = df_profiles[column].to_numpy(dtype=float)
+    return lookup
+
+
+def opportunity_scores(prix_m2, anomaly_score, clusters, prix_m2_mean_lookup):
+    """
+    Décote par rapport au prix moyen du cluster et score combiné décote / anomalie.
+    Un cluster absent des profils (identifiant hors du tableau) a un prix moyen NaN.
+    """
+    clusters = np.asarray(clusters, dtype=np.int64)
+    known = (clusters >= 0) & (clusters < len(prix_m2_mean_lookup))
+    prix_m2_mean = np.full(len(clusters), np.nan)
+    prix_m2_mean[known] = prix_m2_mean_lookup[clusters[known]]
+    decote = (prix_m2_mean - prix_m2) / prix_m2_mean
+    score = decote - POIDS_ANOMALIE * anomaly_score
+    return prix_m2_mean, decote, score
+
+
+def top_n(score, n):
+    """Positions des n meilleurs scores, triées par score décroissant (sélection partielle)."""
+    n = min(n, len(score))
+    if n == 0:
+        return np.array([], dtype=np.int64)
+    best = np.argpartition(-score, n - 1)[:n]
+    return best[np.argsort(-score[best], kind="stable")]
+
+
+def top_n_by_group(score, codes, n):
+    """
+    Positions des n meilleurs scores de chaque groupe : tri par score décroissant puis tri
+    stable par groupe (radix sur 16 bits) des seules lignes candidates ; le rang dans le
+    groupe est lu par différence de positions. Renvoie (positions, rang dans le groupe).
+    """
+    if len(score) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    if codes.max() < np.iinfo(np.uint16).max:
+        by_score = np.argsort(-score)
+        order = by_score[np.argsort((codes[by_score] + 1).astype(np.uint16), kind="stable")]
+    else:
+        order = np.lexsort((-score, codes))
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    rank = np.arange(len(order)) - group_start
+    keep = rank < n
+    return order[keep], rank[keep] + 1
+
+
+def group_codes(column):
+    """Codes entiers d'une colonne Arrow (encodage dictionnaire, valeur manquante = -1)."""
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    indices = pc.dictionary_encode(column).indices
+    return pc.fill_null(indices, -1).to_numpy(zero_copy_only=False).astype(np.int64)
+
+
+def main():
+    print(" Génération Express des Opportunités ")
+
+    # 1. Chargement
+    if not os.path.exists(ANOMALIES_PATH):
+        print(f"ERREUR : Fichier toujours introuvable : {ANOMALIES_PATH}")
+        return
+
+    # Gestion souple du chemin des profils
+    if os.path.exists(PROFILES_PATH):
+        df_profiles = pd.read_csv(PROFILES_PATH)
+    else:
+        alt_path = os.path.join(BASE_DIR, "data", "processed", "cluster_profiles.csv")
+        if os.path.exists(alt_path):
+             df_profiles = pd.read_csv(alt_path)
+        else:
+             print("Profils introuvables. Impossible de calculer la décote exacte.")
+             return
+
+    # 2. Calculs
+    # lecture Arrow des seules colonnes utiles ; les libellés ne sont convertis que pour les lignes retenues
+    available = pq.read_schema(ANOMALIES_PATH).names
+    table = pq.read_table(ANOMALIES_PATH, columns=[c for c in COLUMNS if c in available])
+
+    # Prix moyen du cluster par indexation (pas de fusion)
+    clusters = table["cluster"].to_numpy().astype(np.int64)
+    prix_m2 = table["prix_m2"].to_numpy().astype(float)
+    anomaly_score = table["anomaly_score"].to_numpy().astype(float)
+    prix_m2_mean, decote, score = opportunity_scores(
+        prix_m2, anomaly_score, clusters, cluster_lookup(df_profiles)
+    )
+
+    # Filtre : seules les lignes candidates sont classées
+    candidates = np.flatnonzero(decote > DECOTE_MIN)
+    print(f"Opportunités (décote > {DECOTE_MIN:.0%}) : {len(candidates):,} / {table.num_rows:,}")
+
+    def _rows(positions):
+        rows = candidates[positions]
+        out = table.take(rows).to_pandas()
+        out["prix_m2_mean"] = prix_m2_mean[rows]
+        out["decote"] = decote[rows]
+        out["score_opportunite"] = score[rows]
+        return out
+
+    # Top N global
+    opportunities = _rows(top_n(score[candidates], TOP_N))
+    os.makedirs(os.path.dirname(OUTPUT_TOP), exist_ok=True)
+    pq.write_table(to_arrow(opportunities), OUTPUT_TOP)
+    print(f"Fichier sauvegardé : {OUTPUT_TOP}")
+
+    # Top N par groupe
+    codes = group_codes(table[GROUPE_TOP].take(candidates))
+    positions, rank = top_n_by_group(score[candidates], codes, TOP_N_GROUPE)
+    by_group = _rows(positions)
+    by_group.insert(0, "rang", rank.astype(np.int16))
+    pq.write_table(to_arrow(by_group), OUTPUT_TOP_GROUPE)
+    print(f"Top {TOP_N_GROUPE} par {GROUPE_TOP} sauvegardé : {OUTPUT_TOP_GROUPE}")
+
+
+    view = opportunities.head(5).copy()
+    view['Cluster'] = view['cluster']
+    view['Commune'] = view['Commune']
+    view['Type'] = view['Type local']
+    view['Surface'] = view['Surface reelle bati'].astype(int).astype(str) + " m²"
+    view['Prix m²'] = view['prix_m2'].round(0).astype(int).astype(str) + " €"
+    view['Moyenne Cluster'] = view['prix_m2_mean'].round(0).astype(int).astype(str) + " €"
+    view['Décote'] = (view['decote'] * 100).round(1).astype(str) + " %"
+    view['Score'] = view['score_opportunite'].round(3)
+
+    cols = ['Cluster', 'Commune', 'Type', 'Surface', 'Prix m²', 'Moyenne Cluster', 'Décote', 'Score']
+    print(view[cols].to_markdown(index=False))
+
+if __name__ == "__main__":
+    main()
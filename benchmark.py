@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import resource
+import platform
+import argparse
+import warnings
+import importlib
+import contextlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dvf_synth import generate_dvf
+
+# Banc d'essai de bout en bout sur fichiers DVF synthétiques (dvf_synth) : chargement, nettoyage,
+# variables, standardisation, PCA, K-Means et Isolation Forest enchaînés en mémoire, pour chaque
+# (taille, nombre de workers). Chaque cas tourne dans un processus neuf : temps et pic de mémoire
+# (RSS) mesurés étape par étape. Résultats en JSON (un fichier par exécution, tagué par commit)
+# pour suivre les courbes de passage à l'échelle et comparer deux commits.
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SYNTH_DIR = os.path.join(BASE_DIR, "data", "bench")
+OUTPUT_DIR = os.path.join(BASE_DIR, "output", "benchmarks")
+
+SIZES = [1_000_000, 5_000_000, 20_000_000]
+WORKERS = [1, os.cpu_count() or 1]
+ANNEE = 2024
+SEED = 0
+SEUIL_REGRESSION = 0.10  # écart relatif signalé par --compare (temps et mémoire)
+SEUIL_SECONDES = 0.05    # écarts de temps plus petits ignorés (bruit de mesure des étapes courtes)
+
+STAGES = [
+    "chargement", "nettoyage", "variables_base", "variables_temporelles", "variables_groupes",
+    "standardisation", "pca", "kmeans", "isolation_forest",
+]
+
+
+def _rss_mo(field):
+    """VmRSS / VmHWM du processus courant en Mo (Linux), ru_maxrss ailleurs."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def _reset_peak():
+    """Remet le pic de RSS (VmHWM) au niveau courant ; sans effet hors Linux (pic cumulé)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class StageTimer:
+    """Temps écoulé, temps CPU, RSS en fin d'étape et pic de RSS de chaque étape (processus courant et workers)."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        reset = _reset_peak()
+        rss_before = _rss_mo("VmRSS")
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        cpu = time.process_time()
+        start = time.perf_counter()
+        yield
+        wall = time.perf_counter() - start
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        self.stages[name] = {
+            "secondes": round(wall, 4),
+            "cpu_secondes": round(time.process_time() - cpu, 4),
+            "rss_avant_mo": round(rss_before, 1),
+            "rss_apres_mo": round(_rss_mo("VmRSS"), 1),
+            "rss_pic_mo": round(_rss_mo("VmHWM"), 1),
+            "pic_exact": reset,
+            # pic cumulé des workers terminés : renseigné seulement s'il a augmenté pendant l'étape
+            "rss_pic_workers_mo": round(children, 1) if children > children_before else None,
+        }
+
+
+def run_case(path, n_workers):
+    """Enchaîne les étapes en mémoire sur un fichier brut ; renvoie les mesures (appelé dans un processus neuf)."""
+    from threadpoolctl import threadpool_limits
+
+    loading = importlib.import_module("01_data_loading_dvf")
+    cleaning = importlib.import_module("02_cleaning_dvf")
+    features = importlib.import_module("03_feature_engineering_clustering")
+    reduction = importlib.import_module("04_dimensionality_reduction")
+    clustering = importlib.import_module("05_clustering_algorithms")
+    anomalies = importlib.import_module("07_anomaly_detection")
+    from dvf_schema import apply_schema
+
+    timer = StageTimer()
+    rows = {}
+    # affichages des étapes coupés : seules les mesures sortent du processus
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+            warnings.catch_warnings(), threadpool_limits(limits=n_workers):
+        warnings.simplefilter("ignore")
+        with timer("chargement"):
+            df = loading.load_and_prefilter_dvf_parallel(path, n_workers=n_workers)
+        rows["prefiltre"] = len(df)
+
+        with timer("nettoyage"):
+            df = cleaning.clean_dvf(df, verbose=False)
+            # typage appliqué à la relecture Parquet entre 02 et 03 (partition annee comprise)
+            df["annee"] = ANNEE
+            df = apply_schema(df.reset_index(drop=True))
+        rows["nettoye"] = len(df)
+
+        with timer("variables_base"):
+            df = features.add_basic_features(df)
+        with timer("variables_temporelles"):
+            df = features.add_temporal_features(df)
+        with timer("variables_groupes"):
+            df = features.add_group_features(df, {})
+            num_cols = df.select_dtypes("number").columns
+            df[num_cols] = df[num_cols].fillna(0)
+            df = apply_schema(df)
+
+        with timer("standardisation"):
+            X, _ = reduction.select_features(df)
+            scaled, _ = reduction.apply_standard_scaling(X)
+        with timer("pca"):
+            pcs, _ = reduction.apply_pca(scaled, min(reduction.N_COMPONENTS, scaled.shape[1]))
+        del X, scaled
+
+        with timer("kmeans"):
+            labels, sil, _ = clustering.run_kmeans(
+                pcs[:, :clustering.N_PCA_CLUSTER], clustering.N_CLUSTERS_GLOBAL, None, "global"
+            )
+
+        with timer("isolation_forest"):
+            X_anomalies = df[anomalies.ANOMALY_FEATURES].to_numpy(dtype=np.float32)
+            _, flags, _ = anomalies.detect_anomalies(X_anomalies, labels, n_workers=n_workers)
+        rows["anomalies"] = int(np.sum(flags == -1))
+
+    return {"lignes": rows, "silhouette": round(float(sil), 4), "etapes": timer.stages}
+
+
+def synthetic_file(n_rows, seed=SEED, synth_dir=SYNTH_DIR):
+    """Fichier synthétique de n_rows lignes, généré une fois puis réutilisé."""
+    path = os.path.join(synth_dir, f"ValeursFoncieres-{ANNEE}-synth-{n_rows}-s{seed}.txt")
+    if not os.path.exists(path):
+        print(f"Génération de {n_rows:,} lignes synthétiques -> {path}")
+        start = time.perf_counter()
+        generate_dvf(path + ".tmp", n_rows, annee=ANNEE, seed=seed)
+        os.replace(path + ".tmp", path)
+        print(f"  {time.perf_counter() - start:.1f}s")
+    return path
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        )
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+        ).stdout.strip()
+        return out.stdout.strip() + ("-modifie" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "inconnu"
+
+
+def _environment():
+    import pandas, sklearn, pyarrow
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pandas.__version__,
+        "sklearn": sklearn.__version__,
+        "pyarrow": pyarrow.__version__,
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+        "systeme": platform.system(),
+    }
+
+
+def scaling_exponents(results):
+    """
+    Exposant b de temps ~ taille^b par (étape, workers), ajusté en log-log :
+    b proche de 1 = linéaire, nettement au-dessus = étape qui ne passe pas à l'échelle.
+    """
+    out = {}
+    for w in sorted({r["workers"] for r in results}):
+        cases = sorted((r for r in results if r["workers"] == w and "etapes" in r), key=lambda r: r["taille"])
+        if len(cases) < 2:
+            continue
+        sizes = np.log([r["taille"] for r in cases])
+        for stage in STAGES:
+            t = np.array([r["etapes"][stage]["secondes"] for r in cases])
+            if (t > 0).all():
+                out.setdefault(str(w), {})[stage] = round(float(np.polyfit(sizes, np.log(t), 1)[0]), 2)
+    return out
+
+
+def plot_scaling(report, path):
+    """Courbes temps / taille (log-log) par étape, une figure par nombre de workers."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    workers = sorted({r["workers"] for r in report["resultats"]})
+    fig, axes = plt.subplots(1, len(workers), figsize=(6 * len(workers), 5), squeeze=False)
+    for ax, w in zip(axes[0], workers):
+        cases = sorted((r for r in report["resultats"] if r["workers"] == w and "etapes" in r),
+                       key=lambda r: r["taille"])
+        sizes = [r["taille"] for r in cases]
+        for stage in STAGES:
+            # étapes trop courtes pour l'échelle log (0 s arrondi) : ignorées
+            t = np.array([r["etapes"][stage]["secondes"] for r in cases])
+            if (t > 0).all():
+                ax.plot(sizes, t, marker="o", label=stage)
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("Lignes brutes")
+        ax.set_ylabel("Secondes")
+        ax.set_title(f"{w} worker(s) - commit {report['commit']}")
+        ax.grid(True, which="both", alpha=0.3)
+    axes[0][-1].legend(fontsize=8)
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+
+
+def compare(path_a, path_b, threshold=SEUIL_REGRESSION):
+    """Compare deux rapports (A = référence, B = candidat) ; renvoie le nombre de régressions."""
+    with open(path_a, encoding="utf-8") as f:
+        a = json.load(f)
+    with open(path_b, encoding="utf-8") as f:
+        b = json.load(f)
+    print(f"Référence : {a['commit']} ({a['date']})  /  candidat : {b['commit']} ({b['date']})")
+
+    ref = {(r["taille"], r["workers"]): r for r in a["resultats"] if "etapes" in r}
+    regressions = 0
+    for r in b["resultats"]:
+        base = ref.get((r["taille"], r["workers"]))
+        if base is None or "etapes" not in r:
+            continue
+        print(f"\n{r['taille']:,} lignes, {r['workers']} worker(s)")
+        print(f"  {'étape':<22}{'A (s)':>9}{'B (s)':>9}{'écart':>9}{'pic A':>9}{'pic B':>9}")
+        for stage in STAGES:
+            sa, sb = base["etapes"][stage], r["etapes"][stage]
+            dt = sb["secondes"] / sa["secondes"] - 1 if sa["secondes"] > 0 else 0.0
+            dm = sb["rss_pic_mo"] / sa["rss_pic_mo"] - 1 if sa["rss_pic_mo"] > 0 else 0.0
+            flag = ""
+            slower = dt > threshold and sb["secondes"] - sa["secondes"] > SEUIL_SECONDES
+            if slower or dm > threshold:
+                flag = "  <- régression"
+                regressions += 1
+            print(f"  {stage:<22}{sa['secondes']:>9.2f}{sb['secondes']:>9.2f}{dt:>+9.0%}"
+                  f"{sa['rss_pic_mo']:>9.0f}{sb['rss_pic_mo']:>9.0f}{flag}")
+    print(f"\nRégressions au-delà de {threshold:.0%} : {regressions}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai du pipeline DVF sur données synthétiques")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="lignes brutes générées")
+    parser.add_argument("--workers", type=int, nargs="+", default=WORKERS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--out", default=OUTPUT_DIR, help="répertoire des rapports JSON")
+    parser.add_argument("--synth-dir", default=SYNTH_DIR, help="cache des fichiers synthétiques")
+    parser.add_argument("--plot", action="store_true", help="courbes de passage à l'échelle (PNG)")
+    parser.add_argument("--compare", nargs=2, metavar=("A.json", "B.json"),
+                        help="compare deux rapports au lieu de lancer le banc")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    report = {
+        "commit": _git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environnement": _environment(),
+        "resultats": [],
+    }
+
+    # un processus neuf par cas : pics de mémoire et caches indépendants d'un cas à l'autre
+    context = multiprocessing.get_context("spawn")
+    for n_rows in args.sizes:
+        path = synthetic_file(n_rows, args.seed, args.synth_dir)
+        for n_workers in args.workers:
+            print(f"\n{n_rows:,} lignes, {n_workers} worker(s)")
+            case = {"taille": n_rows, "workers": n_workers}
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    case.update(executor.submit(run_case, path, n_workers).result())
+            except Exception as exc:  # mémoire insuffisante, etc. : le cas est noté, le banc continue
+                case["erreur"] = f"{type(exc).__name__}: {exc}"
+                print(f"  échec : {case['erreur']}")
+            else:
+                for stage, m in case["etapes"].items():
+                    print(f"  {stage:<22}{m['secondes']:>9.2f}s  pic {m['rss_pic_mo']:>8.0f} Mo")
+            report["resultats"].append(case)
+
+    report["exposants"] = scaling_exponents(report["resultats"])
+    if report["exposants"]:
+        print("\nExposants de passage à l'échelle (temps ~ taille^b) :")
+        for w, stages in report["exposants"].items():
+            print(f"  {w} worker(s) : " + ", ".join(f"{s} {b}" for s, b in stages.items()))
+
+    os.makedirs(args.out, exist_ok=True)
+    name = f"bench-{report['commit']}-{time.strftime('%Y%m%d-%H%M%S')}"
+    out_path = os.path.join(args.out, name + ".json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"\nRapport sauvegardé : {out_path}")
+
+    if args.plot:
+        plot_scaling(report, os.path.join(args.out, name + ".png"))
+
+
+if __name__ == "__main__":
+    main()
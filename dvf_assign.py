@@ -0,0 +1,109 @@
+import os
+import joblib
+import numpy as np
+
+from dvf_schema import TYPES_LOCAUX
+
+# Affectation au centroïde K-Means le plus proche, sans réajustement : les lignes sont traitées par
+# blocs de CHUNK_ROWS, en float32. Pour chaque bloc, un produit matriciel (BLAS) donne
+# x·c pour tous les centroïdes, et argmin(‖c‖² - 2·x·c) donne le label. La distance au centroïde
+# retenu est ensuite recalculée directement (‖x - c‖), sans l'annulation numérique du développement.
+# Les lignes peuvent être des scores PC déjà projetés ou des variables brutes : la standardisation
+# et la PCA de 04 sont alors fusionnées en une projection affine appliquée au bloc.
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(BASE_DIR, "data", "models")
+# centroïdes persistés par 05 (espace des premières composantes de la PCA de 04)
+CENTROIDS_FILES = {
+    "global": "kmeans_global_centroids.npy",
+    "Appartement": "kmeans_appart_centroids.npy",
+    "Maison": "kmeans_maison_centroids.npy",
+}
+CHUNK_ROWS = 32_768  # bloc de lignes (et sa matrice de distances) tenant dans le cache
+
+
+class CentroidAssigner:
+    """
+    Centroïdes figés d'un K-Means (float32) et, si scaler et pca sont fournis, projection des
+    variables brutes sur les composantes des centroïdes : z = x @ weights + bias.
+    """
+
+    def __init__(self, centroids, scaler=None, pca=None, chunk_rows=CHUNK_ROWS):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.half_sq_norms = 0.5 * (self.centroids.astype(np.float64) ** 2).sum(axis=1).astype(np.float32)
+        self.chunk_rows = chunk_rows
+        self.weights = self.bias = None
+        if scaler is not None and pca is not None:
+            # z = ((x - mean) / scale - pca.mean_) @ components.T, restreint aux composantes des centroïdes
+            components = pca.components_[:self.centroids.shape[1]]
+            self.weights = np.ascontiguousarray((components / scaler.scale_).T, dtype=np.float32)
+            self.bias = (-(scaler.mean_ / scaler.scale_ + pca.mean_) @ components.T).astype(np.float32)
+
+    @property
+    def n_clusters(self):
+        return len(self.centroids)
+
+    def project(self, X):
+        """Scores PC (float32) de variables brutes, dans l'ordre feature_cols de 04."""
+        if self.weights is None:
+            raise ValueError("Projection indisponible : centroïdes chargés sans standardisation ni PCA")
+        Z = np.asarray(X, dtype=np.float32) @ self.weights
+        Z += self.bias
+        return Z
+
+    def assign(self, X, raw=False):
+        """
+        Label (int32) et distance euclidienne au centroïde (float32) de chaque ligne de X.
+        raw=True : X contient les variables brutes, projetées bloc par bloc avant l'affectation.
+        """
+        n = len(X)
+        labels = np.empty(n, dtype=np.int32)
+        distances = np.empty(n, dtype=np.float32)
+        for start in range(0, n, self.chunk_rows):
+            end = min(start + self.chunk_rows, n)
+            Z = self.project(X[start:end]) if raw else np.asarray(X[start:end], dtype=np.float32)
+            # argmin ‖z - c‖² = argmin (‖c‖²/2 - z·c) : un produit matriciel par bloc
+            scores = Z @ self.centroids.T
+            np.subtract(self.half_sq_norms, scores, out=scores)
+            best = scores.argmin(axis=1)
+            diff = Z - self.centroids[best]
+            labels[start:end] = best
+            distances[start:end] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        return labels, distances
+
+
+def load_assigners(models_dir=MODELS_DIR, scaler=None, pca=None, chunk_rows=CHUNK_ROWS):
+    """
+    Affectateurs des K-Means persistés par 05 : {"global", "Appartement", "Maison"} (fichiers présents).
+    scaler / pca : modèle de 04, pour affecter des variables brutes (lu dans pca.joblib si absent).
+    """
+    if scaler is None or pca is None:
+        path = os.path.join(models_dir, "pca.joblib")
+        if os.path.exists(path):
+            model = joblib.load(path)
+            scaler, pca = model["scaler"], model["pca"]
+
+    assigners = {}
+    for name, filename in CENTROIDS_FILES.items():
+        path = os.path.join(models_dir, filename)
+        if os.path.exists(path):
+            assigners[name] = CentroidAssigner(np.load(path), scaler, pca, chunk_rows)
+    return assigners
+
+
+def assign_by_type(X, type_codes, assigners, raw=False):
+    """
+    Labels K-Means par type de bien (Appartement / Maison) : chaque ligne est affectée aux
+    centroïdes de son type (type_codes : codes de dvf_schema). Les autres lignes gardent le
+    label -1 et une distance NaN.
+    """
+    labels = np.full(len(X), -1, dtype=np.int32)
+    distances = np.full(len(X), np.nan, dtype=np.float32)
+    type_codes = np.asarray(type_codes)
+    for name in ("Appartement", "Maison"):
+        if name not in assigners:
+            continue
+        rows = np.flatnonzero(type_codes == TYPES_LOCAUX.index(name))
+        if len(rows):
+            labels[rows], distances[rows] = assigners[name].assign(X[rows], raw=raw)
+    return labels, distances
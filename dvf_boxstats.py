@@ -0,0 +1,132 @@
+import os
+import numpy as np
+import pandas as pd
+
+from dvf_groupby import group_count, group_mean, group_quantiles
+from dvf_sketch import QuantileSketch
+
+# Statistiques de boîtes à moustaches par groupe (cluster), calculées sur toutes les lignes :
+# quartiles (exacts, ou lus dans un sketch fusionnable), moustaches à 1,5 IQR comme matplotlib
+# (valeur extrême restant dans les bornes) et, en option, un réservoir borné de points hors
+# moustaches tirés uniformément. Le tableau obtenu est petit (une ligne par groupe et variable),
+# persisté, et dessiné avec Axes.bxp : le coût du rendu ne dépend plus du nombre de ventes.
+
+WHIS = 1.5
+TAILLE_LOT = 128_000  # lots ajoutés au sketch en mode "sketch"
+STATS_COLUMNS = ["variable", "n", "mean", "q1", "med", "q3", "whislo", "whishi", "fliers"]
+
+
+def _bottom_k(codes, keys, k):
+    """Positions des k plus petites clés aléatoires de chaque groupe (échantillon uniforme borné)."""
+    order = np.lexsort((keys, codes))
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    return order[rank < k]
+
+
+def box_stats(codes, n_groups, values, mode="exact", whis=WHIS, n_fliers=0, random_state=42):
+    """
+    Statistiques de boîte de chaque groupe (codes 0..n_groups-1, -1 ignoré ; NaN ignorés).
+    mode "sketch" : quartiles à ALPHA près, sketch alimenté par lots ; réservé aux valeurs
+    positives (repli sur l'exact sinon). n_fliers : au plus n_fliers points hors moustaches
+    gardés par groupe. Renvoie ({statistique: tableau par groupe}, mode effectivement utilisé).
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    keep = (codes >= 0) & ~np.isnan(values)
+
+    if mode == "sketch" and (values[keep] <= 0).any():
+        mode = "exact"
+    if mode == "sketch":
+        sketch = QuantileSketch()
+        for start in range(0, len(values), TAILLE_LOT):
+            part = slice(start, start + TAILLE_LOT)
+            sketch.update(codes[part][keep[part]], values[part][keep[part]])
+        ids = np.arange(n_groups)
+        quartiles = {q: sketch.lookup(ids, q) for q in (0.25, 0.5, 0.75)}
+    else:
+        quartiles = group_quantiles(codes, n_groups, values, (0.25, 0.5, 0.75))
+
+    q1, med, q3 = quartiles[0.25], quartiles[0.5], quartiles[0.75]
+    iqr = q3 - q1
+    low, high = q1 - whis * iqr, q3 + whis * iqr
+
+    # moustaches : valeurs extrêmes restant dans [q1 - whis·IQR, q3 + whis·IQR]
+    c, v = codes[keep], values[keep]
+    inside = (v >= low[c]) & (v <= high[c])
+    whislo = np.full(n_groups, np.inf)
+    whishi = np.full(n_groups, -np.inf)
+    np.minimum.at(whislo, c[inside], v[inside])
+    np.maximum.at(whishi, c[inside], v[inside])
+    whislo = np.where(np.isfinite(whislo), whislo, q1)
+    whishi = np.where(np.isfinite(whishi), whishi, q3)
+
+    fliers = [np.empty(0)] * n_groups
+    if n_fliers:
+        out_codes, out_values = c[~inside], v[~inside]
+        rng = np.random.RandomState(random_state)
+        kept = np.sort(_bottom_k(out_codes, rng.random_sample(len(out_codes)), n_fliers))
+        kept = kept[np.argsort(out_codes[kept], kind="stable")]
+        bounds = np.searchsorted(out_codes[kept], np.arange(n_groups + 1))
+        fliers = [out_values[kept[bounds[g]:bounds[g + 1]]] for g in range(n_groups)]
+
+    stats = {
+        "n": group_count(codes, n_groups, values),
+        "mean": group_mean(codes, n_groups, values),
+        "q1": q1, "med": med, "q3": q3,
+        "whislo": whislo, "whishi": whishi,
+        "fliers": fliers,
+    }
+    return stats, mode
+
+
+def cluster_box_stats(df, group_col, variables, mode="exact", n_fliers=0, whis=WHIS):
+    """
+    Statistiques de boîte de chaque (groupe, variable) : groupes factorisés une fois, une passe
+    par variable. Renvoie un tableau long (une ligne par groupe et par variable).
+    """
+    codes, labels = pd.factorize(df[group_col], sort=True)
+    frames = []
+    for var in variables:
+        stats, used = box_stats(codes, len(labels), df[var].to_numpy(), mode=mode, whis=whis, n_fliers=n_fliers)
+        if used != mode:
+            print(f"  {var} : valeurs négatives ou nulles, quartiles exacts")
+        frame = pd.DataFrame(stats)
+        frame.insert(0, "variable", var)
+        frame.insert(0, group_col, np.asarray(labels))
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def save_box_stats(stats, path):
+    """Parquet (points hors moustaches en colonne de listes)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    stats.assign(fliers=[np.asarray(f, dtype=float) for f in stats["fliers"]]).to_parquet(path, index=False)
+
+
+def load_box_stats(path):
+    return pd.read_parquet(path)
+
+
+def draw_bxp(ax, stats, group_col, order=None, colors=None, showfliers=False, **kwargs):
+    """
+    Dessine les boîtes d'une variable (lignes de cluster_box_stats) avec Axes.bxp,
+    dans l'ordre order des groupes ; colors : une couleur de remplissage par boîte.
+    """
+    rows = stats.set_index(group_col)
+    order = list(rows.index) if order is None else list(order)
+    bxpstats = [
+        {
+            "label": str(label),
+            "med": rows.at[label, "med"], "q1": rows.at[label, "q1"], "q3": rows.at[label, "q3"],
+            "whislo": rows.at[label, "whislo"], "whishi": rows.at[label, "whishi"],
+            "mean": rows.at[label, "mean"],
+            "fliers": np.asarray(rows.at[label, "fliers"], dtype=float),
+        }
+        for label in order
+    ]
+    artists = ax.bxp(bxpstats, showfliers=showfliers, patch_artist=True, **kwargs)
+    for box, color in zip(artists["boxes"], colors if colors is not None else []):
+        box.set_facecolor(color)
+    return artists
@@ -0,0 +1,144 @@
+import os
+import shutil
+from urllib.parse import unquote
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from dvf_schema import apply_schema, to_arrow
+from dvf_telemetry import traced
+
+# Jeu de données DVF partitionné façon hive : <racine>/annee=2024/Code departement=75/part-0.parquet
+# Ajouter une année ne réécrit que ses propres partitions.
+
+# Années traitées par les étapes du pipeline (None = toutes les années présentes)
+ANNEES = [2024]
+# Départements traités (None = tous)
+DEPARTEMENTS = None
+
+PARTITION_COLS = ["annee", "Code departement"]
+PARTITIONING = ds.partitioning(
+    pa.schema([("annee", pa.int16()), ("Code departement", pa.string())]),
+    flavor="hive",
+)
+
+ROWS_PER_GROUP = 128_000  # taille des row groups (statistiques min/max par row group)
+
+
+def _partition_filter(annees=None, departements=None):
+    """Construit le filtre de partitions (élagage à la lecture)."""
+    expr = None
+    if annees is not None:
+        expr = ds.field("annee").isin([int(a) for a in annees])
+    if departements is not None:
+        dep_expr = ds.field("Code departement").isin([str(d) for d in departements])
+        expr = dep_expr if expr is None else expr & dep_expr
+    return expr
+
+
+def open_dvf_dataset(path):
+    """Ouvre un jeu de données partitionné (découverte des fichiers triée, ordre stable)."""
+    return ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+
+
+@traced
+def read_dvf_dataset(path, annees=ANNEES, departements=DEPARTEMENTS, columns=None):
+    """
+    Lit uniquement les partitions demandées.
+    Les clés de partition sont restituées comme colonnes ordinaires.
+    """
+    dataset = open_dvf_dataset(path)
+    table = dataset.to_table(
+        columns=columns,
+        filter=_partition_filter(annees, departements),
+    )
+    # schéma commun : identifiants catégoriels (clés de partition comprises), float32, annee int16
+    df = apply_schema(table.to_pandas())
+    return df
+
+
+def count_dvf_rows(path, annees=ANNEES, departements=DEPARTEMENTS):
+    """Nombre de lignes des partitions demandées (métadonnées Parquet, sans lecture des données)."""
+    return open_dvf_dataset(path).count_rows(filter=_partition_filter(annees, departements))
+
+
+def iter_dvf_batches(path, annees=ANNEES, departements=DEPARTEMENTS, columns=None, batch_size=ROWS_PER_GROUP):
+    """
+    Parcourt les partitions demandées par lots (RecordBatch), dans le même ordre de lignes
+    que read_dvf_dataset : la mémoire reste bornée par la taille d'un lot.
+    """
+    dataset = open_dvf_dataset(path)
+    scanner = dataset.scanner(
+        columns=columns,
+        filter=_partition_filter(annees, departements),
+        batch_size=batch_size,
+        use_threads=False,  # lots restitués dans l'ordre des fichiers
+    )
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch
+
+
+def _remove_stale_partitions(path, table, departements=None):
+    """
+    Supprime les partitions département des années écrites qui n'ont plus de lignes dans table
+    (delete_matching ne remplace que les partitions écrites). departements : périmètre de
+    l'écriture (None = tous les départements des années écrites).
+    """
+    written = table.select(PARTITION_COLS).to_pandas().drop_duplicates()
+    pairs = set(zip(written["annee"].tolist(), written["Code departement"].tolist()))
+    scope = None if departements is None else {str(d) for d in departements}
+    for annee in {a for a, _ in pairs}:
+        year_dir = os.path.join(path, f"annee={annee}")
+        if not os.path.isdir(year_dir):
+            continue
+        for name in os.listdir(year_dir):
+            dep = unquote(name.split("=", 1)[1])
+            if (scope is None or dep in scope) and (annee, dep) not in pairs:
+                shutil.rmtree(os.path.join(year_dir, name))
+
+
+@traced
+def write_dvf_dataset(df, path, annee=None, departements=None):
+    """
+    Écrit df dans le jeu partitionné par année et département.
+    Les partitions des années de df (restreintes à departements si précisé) sont remplacées :
+    celles devenues vides sont supprimées, celles des autres années sont conservées.
+    """
+    if annee is not None:
+        df = df.assign(annee=annee)
+    if "annee" not in df.columns:
+        raise ValueError("Colonne 'annee' absente : préciser l'année à écrire")
+
+    table = to_arrow(df)
+    # clés de partition : types du partitionnement (int16, texte)
+    for field in PARTITIONING.schema:
+        i = table.schema.get_field_index(field.name)
+        table = table.set_column(i, field.name, table[field.name].cast(field.type))
+
+    os.makedirs(path, exist_ok=True)
+    _remove_stale_partitions(path, table, departements)
+    ds.write_dataset(
+        table,
+        path,
+        format="parquet",
+        partitioning=PARTITIONING,
+        existing_data_behavior="delete_matching",
+        basename_template="part-{i}.parquet",
+        max_rows_per_group=ROWS_PER_GROUP,
+        min_rows_per_group=min(ROWS_PER_GROUP, 10_000),
+        file_options=ds.ParquetFileFormat().make_write_options(
+            write_statistics=True, compression="snappy"
+        ),
+    )
+
+
+def list_annees(path):
+    """Années déjà présentes dans le jeu de données."""
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        int(name.split("=", 1)[1])
+        for name in os.listdir(path)
+        if name.startswith("annee=")
+    )
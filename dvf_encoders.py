@@ -0,0 +1,188 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# Tables de correspondance persistées des encodages (target / frequency encoding) :
+# clés hachées en uint64 triées + un tableau float32 par variable, lus en memory-map.
+# Une nouvelle transaction est enrichie par recherche dichotomique, sans groupby sur l'historique.
+
+META_FILE = "encoders.json"
+_HASH_MULT = np.uint64(0x100000001B3)  # combinaison des hachés d'une clé composite
+# une table peut avoir une valeur par (fold, clé) : encodage hors fold (dvf_shrinkage), le fold
+# d'une vente étant déduit de son contenu, identique au fit et à l'application des tables
+FOLD_COLUMNS = ["Date mutation", "Valeur fonciere", "Surface reelle bati"]
+
+
+def hash_keys(col):
+    """Hache les clés (converties en texte) en uint64 ; renvoie aussi le masque des clés manquantes."""
+    as_str = pd.Series(col, copy=False).astype("string")
+    missing = as_str.isna().to_numpy()
+    values = as_str.fillna("").to_numpy(dtype=object)
+    return pd.util.hash_array(values, categorize=True), missing
+
+
+def hash_key(df, key, cache=None):
+    """
+    Hache la clé d'une table sur les lignes de df : une colonne, ou plusieurs colonnes dont
+    les hachés sont combinés (clé composite, manquante dès qu'une partie l'est).
+    cache : dict {colonne: (hachés, manquants)} partagé entre tables (chaque colonne hachée une fois).
+    """
+    def hash_col(col):
+        if cache is None:
+            return hash_keys(df[col])
+        if col not in cache:
+            cache[col] = hash_keys(df[col])
+        return cache[col]
+
+    if isinstance(key, str):
+        return hash_col(key)
+    h, missing = hash_col(key[0])
+    for col in key[1:]:
+        h_col, missing_col = hash_col(col)
+        h = combine_hashes(h, h_col)
+        missing = missing | missing_col
+    return h, missing
+
+
+def combine_hashes(h, h_next):
+    """Haché de la clé (..., suivante) à partir du haché du préfixe et de celui de la partie suivante."""
+    return (h * _HASH_MULT) ^ h_next
+
+
+def fold_ids(df, n_folds):
+    """
+    Fold de chaque vente (0..n_folds-1), haché de sa date, de sa valeur (float64) et de sa surface
+    (float32, comme dans les partitions) prises bit à bit : une vente connue retrouve au scoring
+    le fold de son encodage hors fold.
+    """
+    date = np.asarray(df["Date mutation"]).astype("datetime64[D]").view(np.uint64)
+    valeur = df["Valeur fonciere"].to_numpy(dtype=np.float64).view(np.uint64)
+    surface = df["Surface reelle bati"].to_numpy(dtype=np.float32).view(np.uint32).astype(np.uint64)
+    # parties combinées en un entier (débordement modulo 2**64), haché une seule fois ;
+    # fold = partie haute du haché ramenée à [0, n_folds) (multiplication, sans division)
+    h = pd.util.hash_array(combine_hashes(combine_hashes(date, valeur), surface))
+    return ((h >> np.uint64(32)) * np.uint64(n_folds) >> np.uint64(32)).astype(np.int64)
+
+
+class LookupTable:
+    """
+    Encodage d'une clé : valeurs par clé, valeurs du groupe « clé manquante » et valeurs de repli.
+    Un repli peut être une constante ou le nom d'une variable déjà calculée (repli hiérarchique,
+    appliqué par transform_encoders). key : nom de colonne ou liste de colonnes (clé composite).
+    Valeurs d'une variable : une par clé, ou une par (fold, clé) (tableau à deux dimensions).
+    """
+
+    def __init__(self, key, hashes, values, missing=None, fallback=None):
+        self.key = key
+        self.hashes = hashes
+        self.values = values
+        self.missing = missing or {}
+        self.fallback = fallback or {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def lookup(self, col):
+        """Renvoie {variable: tableau float32} pour chaque ligne de col."""
+        return self.lookup_hashes(*hash_keys(col))
+
+    @property
+    def n_folds(self):
+        """Nombre de folds des variables hors fold (0 si aucune)."""
+        return max((v.shape[0] for v in self.values.values() if v.ndim == 2), default=0)
+
+    def lookup_hashes(self, h, is_missing, folds=None):
+        """Comme lookup, à partir des clés déjà hachées (hash_key) ; folds : fold de chaque ligne (fold_ids)."""
+        pos = np.searchsorted(self.hashes, h)
+        pos = np.minimum(pos, max(len(self.hashes) - 1, 0))
+        found = (self.hashes[pos] == h) & ~is_missing if len(self.hashes) else np.zeros(len(h), bool)
+
+        out = {}
+        for name, table_values in self.values.items():
+            fill = self.fallback.get(name, np.nan)
+            res = np.full(len(h), np.nan if isinstance(fill, str) else fill, dtype=np.float32)
+            if table_values.ndim == 2:
+                res[found] = table_values[folds[found], pos[found]]
+            else:
+                res[found] = table_values[pos[found]]
+            if name in self.missing:
+                res[is_missing] = self.missing[name]
+            out[name] = res
+        return out
+
+
+def build_lookup_table(key, col, codes, n_groups, aggs, fallback=None):
+    """
+    Construit la table d'une clé à partir des codes de factorize_key et des agrégats par groupe.
+    Un groupe dont la clé est manquante (dropna=False) devient la valeur « missing ».
+    """
+    codes = np.asarray(codes)
+    rows = np.flatnonzero(codes >= 0)
+
+    # une ligne représentative par groupe (première occurrence)
+    first = np.empty(n_groups, dtype=np.int64)
+    first[codes[rows[::-1]]] = rows[::-1]
+
+    h, is_missing = hash_keys(col.iloc[first])
+    keep = ~is_missing
+    order = np.argsort(h[keep])
+
+    values = {name: np.asarray(v, dtype=float)[keep][order] for name, v in aggs.items()}
+    missing = {}
+    if is_missing.any():
+        missing = {name: float(np.asarray(v, dtype=float)[is_missing][0]) for name, v in aggs.items()}
+
+    return LookupTable(key, h[keep][order], values, missing=missing, fallback=fallback)
+
+
+def save_encoders(tables, dirpath):
+    """Écrit les tables : un .npy par tableau (float32) et un fichier de métadonnées JSON."""
+    os.makedirs(dirpath, exist_ok=True)
+    meta = {}
+    for name, table in tables.items():
+        np.save(os.path.join(dirpath, f"{name}__keys.npy"), table.hashes.astype(np.uint64))
+        for feature, values in table.values.items():
+            np.save(os.path.join(dirpath, f"{name}__{feature}.npy"), values.astype(np.float32))
+        meta[name] = {
+            "key": table.key,
+            "features": list(table.values),
+            "missing": table.missing,
+            "fallback": table.fallback,
+            "n_keys": len(table),
+        }
+    with open(os.path.join(dirpath, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def load_encoders(dirpath, mmap=True):
+    """Charge les tables ; les tableaux sont ouverts en memory-map (aucune copie en RAM)."""
+    mode = "r" if mmap else None
+    with open(os.path.join(dirpath, META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+
+    tables = {}
+    for name, info in meta.items():
+        hashes = np.load(os.path.join(dirpath, f"{name}__keys.npy"), mmap_mode=mode)
+        values = {
+            feature: np.load(os.path.join(dirpath, f"{name}__{feature}.npy"), mmap_mode=mode)
+            for feature in info["features"]
+        }
+        tables[name] = LookupTable(
+            info["key"], hashes, values, missing=info["missing"], fallback=info["fallback"]
+        )
+    return tables
+
+
+def transform_encoders(df, tables):
+    """Ajoute à df toutes les variables encodées à partir des tables (aucun groupby)."""
+    hashed = {}
+    n_folds = max((table.n_folds for table in tables.values()), default=0)
+    folds = fold_ids(df, n_folds) if n_folds else None
+    for table in tables.values():
+        for feature, values in table.lookup_hashes(*hash_key(df, table.key, hashed), folds).items():
+            parent = table.fallback.get(feature)
+            if isinstance(parent, str):
+                values = np.where(np.isnan(values), df[parent].to_numpy(dtype=np.float32), values)
+            df[feature] = values
+    return df
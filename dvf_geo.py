@@ -0,0 +1,131 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.neighbors import BallTree
+
+from dvf_groupby import group_count, group_median, broadcast
+from dvf_encoders import LookupTable, hash_keys
+from dvf_telemetry import traced
+
+# Index spatial des communes : BallTree (distance haversine) sur une table locale de centroïdes.
+# Sert aux variables de prix lissées dans l'espace (k communes voisines, rayon) et aux
+# agrégats des transactions à moins de X km de chaque commune (matrice d'adjacence creuse).
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# table fournie localement, colonnes : code_insee, latitude, longitude (degrés)
+COMMUNES_CENTROIDS_PATH = os.path.join(BASE_DIR, "data", "ref", "communes_centroides.csv")
+
+EARTH_RADIUS_KM = 6371.0
+K_VOISINS = 10     # communes voisines (la commune elle-même comprise) pour le prix lissé
+RAYON_KM = 10.0    # rayon du prix lissé et des requêtes de voisinage
+
+GEO_FEATURES = ["prix_m2_knn_communes", "prix_m2_rayon_communes", "n_ventes_rayon_communes"]
+
+
+def code_insee(departement, commune):
+    """
+    Code INSEE de la commune à partir des colonnes DVF : département sur 2 caractères
+    + code commune sur 3 chiffres. Pour les DOM (département sur 3 caractères, ex. 971),
+    le troisième caractère du département est déjà porté par le code commune (97101).
+    """
+    dep = pd.Series(departement, copy=False).astype("string").str.strip().str.zfill(2)
+    com = pd.Series(commune, copy=False).astype("string").str.strip().str.zfill(3)
+    return (dep.str[:2] + com.str[-3:]).to_numpy(dtype=object, na_value=None)
+
+
+class CommuneIndex:
+    """Centroïdes des communes triés par code INSEE, avec un BallTree en coordonnées radians."""
+
+    def __init__(self, codes, latitude, longitude):
+        codes = np.asarray(codes, dtype=object)
+        order = np.argsort(codes)
+        self.codes = codes[order]
+        self.coords = np.radians(np.column_stack([latitude, longitude]).astype(float))[order]
+        self.tree = BallTree(self.coords, metric="haversine")
+        self._lookup = pd.Index(self.codes)
+
+    @classmethod
+    def from_csv(cls, path=COMMUNES_CENTROIDS_PATH):
+        ref = pd.read_csv(path, dtype={"code_insee": str})
+        ref = ref.dropna(subset=["latitude", "longitude"]).drop_duplicates("code_insee")
+        return cls(ref["code_insee"].to_numpy(), ref["latitude"].to_numpy(), ref["longitude"].to_numpy())
+
+    def __len__(self):
+        return len(self.codes)
+
+    def locate(self, codes):
+        """Position de chaque code INSEE dans l'index (-1 si la commune est inconnue)."""
+        return self._lookup.get_indexer(pd.Index(codes, dtype=object))
+
+    def radius_matrix(self, radius_km=RAYON_KM, sources=None, targets=None):
+        """
+        Matrice creuse d'adjacence (communes sources × communes cibles) : 1 si les centroïdes sont
+        à moins de radius_km. sources / targets restreignent les lignes / colonnes à un
+        sous-ensemble de positions (seules les lignes demandées sont interrogées).
+        """
+        sources = np.arange(len(self)) if sources is None else np.asarray(sources)
+        targets = np.arange(len(self)) if targets is None else np.asarray(targets)
+        tree = self.tree if len(targets) == len(self) else BallTree(self.coords[targets], metric="haversine")
+        neighbours = tree.query_radius(self.coords[sources], r=radius_km / EARTH_RADIUS_KM)
+        indptr = np.concatenate(([0], np.cumsum([len(n) for n in neighbours])))
+        indices = np.concatenate(neighbours) if len(neighbours) else np.array([], dtype=np.int64)
+        data = np.ones(len(indices), dtype=np.float64)
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(sources), len(targets)))
+
+
+def smoothed_commune_prices(index, positions, prix_m2, k=K_VOISINS, radius_km=RAYON_KM):
+    """
+    Prix lissés pour chaque commune de l'index (y compris sans vente) :
+    moyenne des médianes des k communes voisines ayant des ventes, et des communes
+    à moins de radius_km, pondérée par le nombre de ventes de chaque commune.
+    """
+    n = len(index)
+    median = group_median(positions, n, prix_m2)
+    count = group_count(positions, n, prix_m2).astype(float)
+    has_sales = np.flatnonzero(count > 0)
+    weighted = np.nan_to_num(median * count)
+
+    out = {name: np.full(n, np.nan) for name in GEO_FEATURES}
+    if len(has_sales) == 0:
+        return out
+
+    # k plus proches communes avec ventes
+    tree = BallTree(index.coords[has_sales], metric="haversine")
+    _, ind = tree.query(index.coords, k=min(k, len(has_sales)))
+    neighbours = has_sales[ind]
+    out["prix_m2_knn_communes"] = weighted[neighbours].sum(axis=1) / count[neighbours].sum(axis=1)
+
+    # toutes les communes avec ventes dans le rayon (somme par produit matriciel creux)
+    adjacency = index.radius_matrix(radius_km, targets=has_sales)
+    n_rayon = adjacency @ count[has_sales]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["prix_m2_rayon_communes"] = (adjacency @ weighted[has_sales]) / n_rayon
+    out["n_ventes_rayon_communes"] = n_rayon
+    return out
+
+
+def geo_lookup_table(index, stats):
+    """Table d'encodage (dvf_encoders) des prix lissés, clé code_insee : couvre toutes les communes de l'index."""
+    hashes, _ = hash_keys(pd.Series(index.codes, dtype=object))
+    order = np.argsort(hashes)
+    values = {name: np.asarray(v, dtype=float)[order] for name, v in stats.items()}
+    return LookupTable("code_insee", hashes[order], values)
+
+
+@traced
+def add_geo_features(df, index, tables=None):
+    """Ajoute code_insee et les prix lissés dans l'espace (table d'encodage ajoutée à tables si fourni)."""
+    df["code_insee"] = code_insee(df["Code departement"], df["Code commune"])
+    positions = index.locate(df["code_insee"])
+    n_unknown = np.count_nonzero(positions < 0)
+    if n_unknown:
+        print(f"  communes sans centroïde : {n_unknown:,} lignes")
+
+    stats = smoothed_commune_prices(index, positions, df["prix_m2"])
+    for name, values in stats.items():
+        df[name] = broadcast(values, positions)
+
+    if tables is not None:
+        tables["geo"] = geo_lookup_table(index, stats)
+    return df
@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+
+# Agrégations groupées par tri : chaque clé est factorisée une seule fois en codes entiers,
+# tous les agrégats d'une clé sont calculés sur ces codes, puis rediffusés par indexation.
+
+
+def factorize_key(col, dropna=True):
+    """
+    Factorise une colonne clé en codes entiers 0..n-1.
+    dropna=True : les valeurs manquantes ont le code -1 (exclues des groupes).
+    dropna=False : les valeurs manquantes forment leur propre groupe.
+    """
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        # codes du dictionnaire réutilisés tels quels ; catégories absentes des lignes retirées
+        codes = col.cat.codes.to_numpy().astype(np.int64)
+        n_groups = len(col.cat.categories)
+        used = np.bincount(codes[codes >= 0], minlength=n_groups) > 0
+        if not used.all():
+            remap = np.cumsum(used) - 1
+            codes = np.where(codes >= 0, remap[codes], -1)
+            n_groups = int(used.sum())
+        if not dropna and (codes == -1).any():
+            codes[codes == -1] = n_groups
+            n_groups += 1
+        return codes, n_groups
+
+    codes, uniques = pd.factorize(col, use_na_sentinel=dropna)
+    return codes.astype(np.int64, copy=False), len(uniques)
+
+
+def _valid(codes, values):
+    values = np.asarray(values, dtype=float)
+    return values, (codes >= 0) & ~np.isnan(values)
+
+
+def group_count(codes, n_groups, values=None):
+    """Nombre de valeurs non nulles par groupe (nombre de lignes si values est None)."""
+    if values is None:
+        keep = codes >= 0
+    else:
+        _, keep = _valid(codes, values)
+    return np.bincount(codes[keep], minlength=n_groups)
+
+
+def group_mean(codes, n_groups, values):
+    """Moyenne par groupe (valeurs manquantes ignorées)."""
+    values, keep = _valid(codes, values)
+    sums = np.bincount(codes[keep], weights=values[keep], minlength=n_groups)
+    counts = np.bincount(codes[keep], minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def value_order(values):
+    """Ordre de tri des valeurs (NaN en dernier), réutilisable pour plusieurs clés."""
+    return np.argsort(np.asarray(values, dtype=float))
+
+
+def group_quantiles(codes, n_groups, values, qs, order=None):
+    """
+    Quantiles par groupe (interpolation linéaire, comme pandas) en un seul tri :
+    les valeurs sont triées par (groupe, valeur) puis lues aux rangs voulus de chaque segment.
+    order : ordre de tri des valeurs déjà calculé par value_order (évite de retrier).
+    """
+    values, keep = _valid(codes, values)
+    if order is None:
+        order = value_order(values)
+
+    # ordre par valeur, puis tri stable par groupe : tri radix quand les codes tiennent
+    # sur 16 bits, sinon tri d'une clé unique (groupe, rang de la valeur)
+    by_value = order[keep[order]]
+    if n_groups <= np.iinfo(np.uint16).max + 1:
+        by_group = np.argsort(codes[by_value].astype(np.uint16), kind="stable")
+    else:
+        m = len(by_value)
+        by_group = np.argsort(codes[by_value] * m + np.arange(m))
+    sorted_values = values[by_value[by_group]]
+    codes_k = codes[keep]
+
+    counts = np.bincount(codes_k, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has_values = counts > 0
+
+    out = {}
+    for q in qs:
+        pos = q * (counts - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        frac = pos - lo
+        res = np.full(n_groups, np.nan)
+        idx_lo = (starts + lo)[has_values]
+        idx_hi = (starts + hi)[has_values]
+        v_lo = sorted_values[idx_lo]
+        v_hi = sorted_values[idx_hi]
+        res[has_values] = v_lo + (v_hi - v_lo) * frac[has_values]
+        out[q] = res
+    return out
+
+
+def group_median(codes, n_groups, values, order=None):
+    """Médiane par groupe."""
+    return group_quantiles(codes, n_groups, values, [0.5], order=order)[0.5]
+
+
+def group_aggregates(codes, n_groups, specs):
+    """
+    Calcule tous les agrégats d'une même clé.
+    specs : {nom_sortie: (valeurs, "median" | "mean" | "count" | "size" | "freq"[, ordre])}
+    l'ordre optionnel (value_order) évite de retrier une colonne déjà triée pour une autre clé.
+    Une même colonne demandée plusieurs fois avec la même fonction n'est calculée qu'une fois.
+    """
+    cache = {}
+    out = {}
+    for name, spec in specs.items():
+        values, func = spec[:2]
+        order = spec[2] if len(spec) > 2 else None
+        key = (id(values), func)
+        if key not in cache:
+            if func == "median":
+                cache[key] = group_median(codes, n_groups, values, order=order)
+            elif func == "mean":
+                cache[key] = group_mean(codes, n_groups, values)
+            elif func == "count":
+                cache[key] = group_count(codes, n_groups, values)
+            elif func == "size":
+                cache[key] = group_count(codes, n_groups)
+            elif func == "freq":
+                sizes = group_count(codes, n_groups)
+                cache[key] = sizes / max(sizes.sum(), 1)
+            else:
+                raise ValueError(f"Agrégation inconnue : {func}")
+        out[name] = cache[key]
+    return out
+
+
+def broadcast(group_values, codes):
+    """Rediffuse une valeur par groupe sur chaque ligne ; les lignes de code -1 reçoivent NaN."""
+    if (codes < 0).any():
+        padded = np.append(group_values.astype(float), np.nan)
+        return padded[codes]
+    return group_values[codes]
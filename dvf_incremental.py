@@ -0,0 +1,623 @@
+import os
+import json
+import shutil
+import time
+import argparse
+import importlib
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from dvf_assign import CentroidAssigner, assign_by_type
+from dvf_dataset import ANNEES, DEPARTEMENTS, iter_dvf_batches
+from dvf_encoders import LookupTable, load_encoders, save_encoders, transform_encoders
+from dvf_geo import code_insee
+from dvf_schema import TYPES_LOCAUX, apply_schema, write_parquet
+from dvf_scoring import INCREMENTAL_MODELS_DIR, ScoringModels, current_models_dir, iter_raw_batches, score_forests
+from dvf_shrinkage import LEVELS, N_FOLDS, hierarchy_moments, hierarchical_tables
+from dvf_sketch import QuantileSketch, label_keys
+from dvf_store import FeatureStore
+from dvf_telemetry import span, traced
+
+# Mise à jour incrémentale (nouveau mois de DVF) sans relancer 01 -> 08 sur toute l'année.
+# Un état persistant remplace les passes sur l'historique :
+#   - agrégats par clé (département, commune, voie, code postal, type de voie) additifs :
+#     moments de l'encodage hiérarchique, comptes, sketches de quantiles (dvf_sketch) ;
+#     les tables d'encodage de 03 sont recalculées depuis ces agrégats ;
+#   - moments des variables (effectif, moyenne, produits croisés) : standardisation et PCA de 04
+#     redéduites comme en mode streaming, signes alignés sur la base précédente ;
+#   - effectif de chaque cluster : centroïdes mis à jour en moyenne courante (pas 1 / effectif,
+#     celui de MiniBatchKMeans.partial_fit) après réexpression dans la nouvelle base ;
+#   - lignes ajoutées à chaque cluster depuis l'ajustement de sa forêt : seules les forêts des
+#     clusters dont l'effectif a dérivé au-delà de SEUIL_DERIVE sont réajustées.
+# Les ventes ajoutées sont encodées avec les tables d'avant la mise à jour (leur propre prix
+# n'entre pas dans leur encodage), puis intégrées aux agrégats. Les modèles mis à jour sont écrits
+# sous STATE_DIR (dvf_scoring les préfère tant qu'ils sont plus récents que ceux du pipeline) :
+# les sorties des étapes 03 à 07 ne sont jamais réécrites. « init » repart de ces sorties et
+# efface les modèles et les ventes des mises à jour précédentes.
+# Le coût d'une mise à jour dépend du mois ajouté (et du nombre de groupes), pas de l'historique,
+# sauf pour les forêts réajustées (lignes de leur cluster). Les variables déjà écrites des ventes
+# de l'historique ne sont pas recalculées : une exécution complète du pipeline les réaligne.
+
+_cleaning = importlib.import_module("02_cleaning_dvf")
+_features = importlib.import_module("03_feature_engineering_clustering")
+_reduction = importlib.import_module("04_dimensionality_reduction")
+_clustering = importlib.import_module("05_clustering_algorithms")
+_anomalies = importlib.import_module("07_anomaly_detection")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = os.path.join(BASE_DIR, "data", "models", "incremental")
+STATE_FILE = "etat.json"
+# encodeurs, PCA, centroïdes et forêts mis à jour (mêmes noms de fichiers que le pipeline)
+MODELS_DIR = INCREMENTAL_MODELS_DIR
+# ventes ajoutées (variables, clusters, scores), un fichier par mise à jour
+INCREMENTS_DIR = os.path.join(BASE_DIR, "data", "processed", "increments")
+
+SEUIL_DERIVE = 0.10  # part de lignes ajoutées à un cluster depuis l'ajustement de sa forêt
+TYPES_CLUSTERS = {
+    "Appartement": _clustering.OUT_CENTROIDS_APPART,
+    "Maison": _clustering.OUT_CENTROIDS_MAISON,
+}
+KEY_COLUMNS = ["Code departement", "Commune", "Voie", "Code postal", "Type de voie"]
+
+
+class GroupSums:
+    """
+    Sommes additives par clé hachée (uint64), compactées par tri comme les comptes de
+    QuantileSketch. attrs : valeurs déterminées par la clé (ex. clé du groupe parent), gardées telles quelles.
+    """
+
+    def __init__(self, names, attrs=()):
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.sums = {name: np.empty(0) for name in names}
+        self.attrs = {name: np.empty(0, dtype=np.uint64) for name in attrs}
+
+    def add(self, keys, attrs=None, **sums):
+        """Ajoute les contributions d'un lot (une valeur par clé, clés éventuellement répétées)."""
+        keys = np.concatenate([self.keys, np.asarray(keys, dtype=np.uint64)])
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=np.int64)
+        self.keys = keys[starts]
+        for name in self.sums:
+            values = np.concatenate([self.sums[name], np.asarray(sums[name], dtype=float)])[order]
+            self.sums[name] = np.add.reduceat(values, starts) if len(starts) else values
+        for name in self.attrs:
+            values = np.concatenate([self.attrs[name], np.asarray(attrs[name], dtype=np.uint64)])[order]
+            self.attrs[name] = values[starts]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {f"sum_{k}": v for k, v in self.sums.items()}
+        arrays.update({f"attr_{k}": v for k, v in self.attrs.items()})
+        np.savez(path, keys=self.keys, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        names = [k[4:] for k in data.files if k.startswith("sum_")]
+        attrs = [k[5:] for k in data.files if k.startswith("attr_")]
+        groups = cls(names, attrs)
+        groups.keys = data["keys"]
+        groups.sums = {k: data[f"sum_{k}"] for k in names}
+        groups.attrs = {k: data[f"attr_{k}"] for k in attrs}
+        return groups
+
+
+def _sketch_specs():
+    specs = _features.SKETCH_SPECS_HIERARCHIQUE if _features.ENCODAGE_PRIX == "hierarchique" else _features.SKETCH_SPECS
+    return list(specs)
+
+
+def _missing_key():
+    """Haché d'une clé manquante dans les sketches des clés gardant leurs manquants (voies)."""
+    h, _ = label_keys(pd.Series([None], dtype="string"), dropna=False)
+    return h[0]
+
+
+def _sketch_table(key, sketch, name, fallback=None, missing_key=None):
+    """Table d'encodage d'une médiane lue dans un sketch (groupe manquant en valeur « missing »)."""
+    keys, values = sketch.quantiles()
+    medians = values[0.5]
+    missing = {}
+    if missing_key is not None:
+        is_missing = keys == missing_key
+        if is_missing.any():
+            missing = {name: float(medians[is_missing][0])}
+        keys, medians = keys[~is_missing], medians[~is_missing]
+    return LookupTable(key, keys, {name: medians}, missing=missing, fallback=fallback)
+
+
+class IncrementalState:
+    """
+    État persistant de la mise à jour incrémentale : agrégats par clé, moments des variables
+    de la PCA, effectifs des clusters et suivi des forêts. Sauvegardé dans STATE_DIR.
+    """
+
+    def __init__(self, path=STATE_DIR):
+        self.path = path
+        # moments hiérarchiques par (fold, clé) : n_<fold>, s_<fold> ; sommes des carrés par niveau dans meta
+        fold_sums = [f"{name}_{fold}" for name in ("n", "s") for fold in range(N_FOLDS)]
+        self.groups = {f"hier_{level}": GroupSums(fold_sums, attrs=["parent"]) for level in LEVELS}
+        self.groups["commune"] = GroupSums(["volume", "maisons", "n_type"])
+        self.groups["type_voie"] = GroupSums(["n"])
+        self.sketches = {spec: QuantileSketch() for spec in _sketch_specs()}
+        self.sketches[("global", "prix_m2")] = QuantileSketch()
+        self.meta = {
+            "lignes": 0, "racine": [[0.0] * N_FOLDS, [0.0] * N_FOLDS], "carres": {level: 0.0 for level in LEVELS},
+            "type_voie_manquant": 0, "mises_a_jour": [],
+            "modeles_pipeline": {},  # dates de modification des modèles du pipeline lors de « init »
+        }
+        self.moments = None   # (n, moyenne, produits croisés centrés)
+        self.clusters = {}    # {nom: {"effectifs": [...]}} ; "global" porte aussi le suivi des forêts
+
+    # --- persistance ---
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        for name, groups in self.groups.items():
+            groups.save(os.path.join(self.path, "groupes", f"{name}.npz"))
+        for (key, value_col), sketch in self.sketches.items():
+            sketch.save(os.path.join(self.path, "sketches", f"{key}__{value_col}.npz"))
+        n, mean, m2 = self.moments
+        np.savez(os.path.join(self.path, "moments.npz"), n=n, mean=mean, m2=m2)
+        tmp = os.path.join(self.path, STATE_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({**self.meta, "clusters": self.clusters}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(self.path, STATE_FILE))
+
+    @classmethod
+    def load(cls, path=STATE_DIR):
+        if not os.path.exists(os.path.join(path, STATE_FILE)):
+            raise FileNotFoundError(f"État incrémental absent ({path}) : lancer d'abord « init »")
+        state = cls(path)
+        for name in state.groups:
+            state.groups[name] = GroupSums.load(os.path.join(path, "groupes", f"{name}.npz"))
+        for key, value_col in state.sketches:
+            state.sketches[(key, value_col)] = QuantileSketch.load(
+                os.path.join(path, "sketches", f"{key}__{value_col}.npz")
+            )
+        data = np.load(os.path.join(path, "moments.npz"))
+        state.moments = (int(data["n"]), data["mean"], data["m2"])
+        with open(os.path.join(path, STATE_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        state.clusters = meta.pop("clusters")
+        state.meta = meta
+        return state
+
+    # --- agrégats par clé ---
+
+    def add_sales(self, df):
+        """Ajoute un lot de ventes (variables de base de 03 calculées) aux agrégats par clé."""
+        if _features.ENCODAGE_PRIX == "hierarchique":
+            moments, root = hierarchy_moments(df, df["log_prix_m2"])
+            for level, (keys, parent_keys, n, s, q) in moments.items():
+                sums = {f"n_{fold}": n[fold] for fold in range(N_FOLDS)}
+                sums.update({f"s_{fold}": s[fold] for fold in range(N_FOLDS)})
+                self.groups[f"hier_{level}"].add(keys, attrs={"parent": parent_keys}, **sums)
+                self.meta["carres"][level] += q
+            self.meta["racine"] = [(np.asarray(old) + new).tolist() for old, new in zip(self.meta["racine"], root)]
+
+        h, keep = label_keys(df["Commune"])
+        type_codes = df["type_local_encoded"].to_numpy(dtype=float)
+        self.groups["commune"].add(
+            h[keep],
+            volume=df["Valeur fonciere"].notna().to_numpy()[keep],
+            maisons=np.nan_to_num(type_codes)[keep],
+            n_type=~np.isnan(type_codes[keep]),
+        )
+
+        h, keep = label_keys(df["Type de voie"])
+        self.groups["type_voie"].add(h[keep], n=np.ones(int(keep.sum())))
+        self.meta["type_voie_manquant"] += int((~keep).sum())
+        self.meta["lignes"] += len(df)
+
+        values = {"prix_m2": df["prix_m2"].to_numpy(dtype=float),
+                  "Surface reelle bati": df["Surface reelle bati"].to_numpy(dtype=float)}
+        for (key, value_col), sketch in self.sketches.items():
+            if key == "global":
+                sketch.update(np.zeros(len(df), dtype=np.uint64), values[value_col])
+            else:
+                h, keep = label_keys(df[key], dropna=key not in _features.SKETCH_KEYS_WITH_NA)
+                sketch.update(h[keep], values[value_col][keep])
+
+    def encoders(self):
+        """Tables d'encodage de 03 (mêmes noms, même ordre) recalculées depuis les agrégats."""
+        tables = {}
+        commune = self.groups["commune"]
+        commune_values = {}
+
+        if _features.ENCODAGE_PRIX == "hierarchique":
+            moments = {}
+            for level in LEVELS:
+                g = self.groups[f"hier_{level}"]
+                n = np.stack([g.sums[f"n_{fold}"] for fold in range(N_FOLDS)])
+                s = np.stack([g.sums[f"s_{fold}"] for fold in range(N_FOLDS)])
+                moments[level] = (g.keys, g.attrs["parent"], n, s, self.meta["carres"][level])
+            tables.update(hierarchical_tables(moments, self.meta["racine"], _features.PRIX_HIERARCHIQUE))
+            _features.alias_commune_price(tables)
+        else:
+            prix = self.sketches[("Commune", "prix_m2")].lookup(commune.keys, 0.5)
+            commune_values["prix_median_commune"] = prix
+
+        commune_values["surface_median_commune"] = self.sketches[("Commune", "Surface reelle bati")].lookup(commune.keys, 0.5)
+        commune_values["dynamique_volume_commune"] = commune.sums["volume"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            commune_values["part_maisons_commune"] = commune.sums["maisons"] / commune.sums["n_type"]
+        if "prix_median_commune" in commune_values:
+            commune_values["prix_m2_median_commune"] = commune_values["prix_median_commune"]
+        tables["commune"] = LookupTable("Commune", commune.keys, commune_values)
+
+        if _features.ENCODAGE_PRIX != "hierarchique":
+            tables["code_postal"] = _sketch_table("Code postal", self.sketches[("Code postal", "prix_m2")], "prix_median_cp")
+            tables["departement"] = _sketch_table(
+                "Code departement", self.sketches[("Code departement", "prix_m2")], "prix_median_departement"
+            )
+
+        # type de voie jamais vu : fréquence nulle ; types manquants : leur propre modalité
+        type_voie = self.groups["type_voie"]
+        n_rows = self.meta["lignes"]
+        missing = {}
+        if self.meta["type_voie_manquant"]:
+            missing = {"freq_type_voie": self.meta["type_voie_manquant"] / n_rows}
+        tables["type_voie"] = LookupTable(
+            "Type de voie", type_voie.keys, {"freq_type_voie": type_voie.sums["n"] / n_rows},
+            missing=missing, fallback={"freq_type_voie": 0.0}
+        )
+
+        if _features.ENCODAGE_PRIX != "hierarchique":
+            # voie jamais vue : médiane globale
+            prix_global = self.sketches[("global", "prix_m2")].lookup(np.zeros(1, dtype=np.uint64), 0.5)[0]
+            tables["voie"] = _sketch_table(
+                "Voie", self.sketches[("Voie", "prix_m2")], "prix_median_voie",
+                fallback={"prix_median_voie": float(prix_global)}, missing_key=_missing_key()
+            )
+        return tables
+
+    # --- moments des variables (standardisation + PCA) ---
+
+    def add_moments(self, X):
+        """Fusionne les moments d'un lot (formule de Chan : effectif, moyenne, produits croisés centrés)."""
+        X = np.asarray(X, dtype=np.float64)
+        n_b, mean_b = len(X), X.mean(axis=0)
+        centered = X - mean_b
+        m2_b = centered.T @ centered
+        if self.moments is None:
+            self.moments = (n_b, mean_b, m2_b)
+            return
+        n_a, mean_a, m2_a = self.moments
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        self.moments = (n, mean_a + delta * n_b / n, m2_a + m2_b + np.outer(delta, delta) * n_a * n_b / n)
+
+    def fit_pca(self, n_components):
+        """Standardisation et PCA de tout l'historique, déduites des moments (comme 04 en streaming)."""
+        n, mean, m2 = self.moments
+        return _reduction.fit_streaming_pca(n, mean, np.diag(m2) / n, m2 / (n - 1), n_components)
+
+
+def _align_signs(pca, reference):
+    """Oriente chaque composante comme celle de la base précédente (scores et centroïdes comparables)."""
+    signs = np.sign((pca.components_ * reference.components_).sum(axis=1))
+    signs[signs == 0] = 1
+    pca.components_ = pca.components_ * signs[:, None]
+    return pca
+
+
+def reexpress_centroids(centroids, old, new):
+    """
+    Coordonnées dans la nouvelle base (scaler, pca) des points que centroids représentent dans
+    l'ancienne : retour à l'espace des variables, puis projection sur les nouvelles composantes.
+    """
+    (old_scaler, old_pca), (new_scaler, new_pca) = old, new
+    p = centroids.shape[1]
+    x = old_scaler.mean_ + old_scaler.scale_ * (centroids @ old_pca.components_[:p] + old_pca.mean_)
+    return ((x - new_scaler.mean_) / new_scaler.scale_ - new_pca.mean_) @ new_pca.components_[:p].T
+
+
+def update_centroids(centroids, counts, Z, labels):
+    """Moyenne courante : chaque centroïde absorbe les lignes qui lui sont affectées (pas 1 / effectif)."""
+    k = len(centroids)
+    added = np.bincount(labels, minlength=k)
+    sums = np.zeros_like(centroids, dtype=np.float64)
+    np.add.at(sums, labels, Z)
+    total = counts + added
+    with np.errstate(invalid="ignore", divide="ignore"):
+        updated = (centroids * counts[:, None] + sums) / total[:, None]
+    return np.where(total[:, None] > 0, updated, centroids), total
+
+
+# MODÈLES
+
+def _pipeline_model_paths():
+    """Modèles des étapes 04, 05 et 07 repris (et jamais réécrits) par les mises à jour."""
+    return [_reduction.MODEL_PATH, _clustering.OUT_CENTROIDS_GLOBAL, *TYPES_CLUSTERS.values(), _anomalies.MODEL_PATH]
+
+
+def _pipeline_stamp():
+    """Dates de modification des modèles du pipeline : une exécution complète les change."""
+    return {os.path.basename(p): os.stat(p).st_mtime_ns for p in _pipeline_model_paths() if os.path.exists(p)}
+
+
+def _model_path(pipeline_path, models_dir):
+    """Même fichier que celui du pipeline, dans models_dir."""
+    return os.path.join(models_dir, os.path.basename(pipeline_path))
+
+
+def _load_pca_model(models_dir=None):
+    return joblib.load(_model_path(_reduction.MODEL_PATH, models_dir or current_models_dir()))
+
+
+def _load_anomaly_model(models_dir=None):
+    return joblib.load(_model_path(_anomalies.MODEL_PATH, models_dir or current_models_dir()))
+
+
+# INITIALISATION (une passe sur l'historique)
+
+def _feature_columns():
+    # Date mutation : entre dans le fold de l'encodage hiérarchique (dvf_encoders.fold_ids)
+    return ["annee", "Date mutation"] + KEY_COLUMNS + ["Valeur fonciere", "Surface reelle bati", "Surface terrain", "Type local"]
+
+
+@traced
+def init_state(path=STATE_DIR):
+    """
+    État initial depuis les sorties du pipeline complet (03, 04, 05, 07) : une lecture en flux
+    du jeu de variables, des effectifs de clusters lus dans les magasins. Les modèles et les
+    ventes des mises à jour précédentes sont effacés.
+    """
+    shutil.rmtree(MODELS_DIR, ignore_errors=True)
+    shutil.rmtree(INCREMENTS_DIR, ignore_errors=True)
+    state = IncrementalState(path)
+    state.meta["modeles_pipeline"] = _pipeline_stamp()
+
+    print("Agrégats par clé (lecture en flux du jeu de variables)")
+    for batch in iter_dvf_batches(_features.OUTPUT_PATH, ANNEES, DEPARTEMENTS, columns=_feature_columns()):
+        df = apply_schema(batch.to_pandas())
+        state.add_sales(_features.add_basic_features(df))
+
+    print("Moments des variables de la PCA")
+    model = _load_pca_model()
+    n, mean, _, cov = _reduction.fit_streaming_moments(_features.OUTPUT_PATH, model["feature_cols"])
+    state.moments = (n, mean, cov * (n - 1))
+
+    print("Effectifs des clusters")
+    labels = np.asarray(FeatureStore(_clustering.CLUSTER_STORE_DIR).array("cluster_kmeans"))
+    counts = np.bincount(labels, minlength=len(np.load(_clustering.OUT_CENTROIDS_GLOBAL)))
+    prix_m2 = np.asarray(FeatureStore(_clustering.STORE_DIR).matrix("features", ["prix_m2"])[:, 0], dtype=float)
+    state.clusters["global"] = {
+        "effectifs": counts.tolist(),
+        "prix_m2_somme": np.bincount(labels, weights=prix_m2, minlength=len(counts)).tolist(),
+        "forets_lignes": counts.tolist(),   # lignes sur lesquelles chaque forêt a été ajustée (07)
+        "ajoutees": [0] * len(counts),      # lignes ajoutées depuis
+    }
+    by_type = {"Appartement": _clustering.OUT_KMEANS_APPART, "Maison": _clustering.OUT_KMEANS_MAISON}
+    for name, parquet in by_type.items():
+        if os.path.exists(TYPES_CLUSTERS[name]):
+            type_labels = pd.read_parquet(parquet, columns=["cluster_kmeans"])["cluster_kmeans"].to_numpy()
+            k = len(np.load(TYPES_CLUSTERS[name]))
+            state.clusters[name] = {"effectifs": np.bincount(type_labels, minlength=k).tolist()}
+
+    state.save()
+    print(f"État incrémental initialisé : {state.meta['lignes']:,} ventes, {len(state.groups['commune']):,} communes")
+    return state
+
+
+# MISE À JOUR
+
+def read_delta(filepath):
+    """Ventes brutes du mois ajouté : filtres de 01, nettoyage de 02, variables de base de 03."""
+    df_raw = pd.concat(list(iter_raw_batches(filepath)), ignore_index=True)
+    df = _cleaning.clean_dvf(df_raw, verbose=False)
+    df = _features.add_basic_features(df)
+    df = _features.add_temporal_features(df)
+    return df.reset_index(drop=True)
+
+
+def _history_rows(cluster_ids, updates):
+    """
+    Variables d'anomalie et cluster des ventes de l'historique (magasins de 04 / 05) et des
+    mises à jour précédentes enregistrées dans l'état (updates), pour les seuls clusters demandés.
+    """
+    store = FeatureStore(_clustering.STORE_DIR)
+    clusters = FeatureStore(_clustering.CLUSTER_STORE_DIR)
+    features = store.matrix("features", _anomalies.ANOMALY_FEATURES)
+    parts, labels = [], []
+    for cluster_id in cluster_ids:
+        rows = np.asarray(clusters.rows("cluster_kmeans", cluster_id))
+        parts.append(np.asarray(features[rows], dtype=np.float32))
+        labels.append(np.full(len(rows), cluster_id, dtype=np.int32))
+
+    # fichiers des seules mises à jour intégrées (pas ceux d'une mise à jour interrompue)
+    paths = [os.path.join(INCREMENTS_DIR, f"{name}.parquet") for name in updates]
+    if paths:
+        table = ds.dataset(paths, format="parquet").to_table(
+            columns=_anomalies.ANOMALY_FEATURES + ["cluster"],
+            filter=ds.field("cluster").isin([int(c) for c in cluster_ids]),
+        ).to_pandas()
+        parts.append(table[_anomalies.ANOMALY_FEATURES].to_numpy(dtype=np.float32))
+        labels.append(table["cluster"].to_numpy(dtype=np.int32))
+    return np.concatenate(parts), np.concatenate(labels)
+
+
+@traced
+def apply_update(filepath, name=None, state=None, seuil=SEUIL_DERIVE):
+    """
+    Intègre un fichier DVF brut (nouveau mois) : agrégats, encodages, standardisation / PCA,
+    centroïdes, forêts des clusters ayant dérivé. Écrit les ventes ajoutées, scorées, dans
+    INCREMENTS_DIR et renvoie ce tableau.
+    """
+    name = name or os.path.splitext(os.path.basename(filepath))[0]
+    state = state or IncrementalState.load()
+    if name in state.meta["mises_a_jour"]:
+        raise ValueError(f"Mise à jour « {name} » déjà intégrée")
+    if _pipeline_stamp() != state.meta.get("modeles_pipeline"):
+        raise ValueError("Modèles du pipeline modifiés depuis « init » (exécution complète) : relancer « init »")
+    models_dir = current_models_dir()
+    timings = {}
+
+    start = time.perf_counter()
+    with span("increment_lecture"):
+        df = read_delta(filepath)
+    timings["lecture"] = time.perf_counter() - start
+    print(f"Ventes ajoutées : {len(df):,}")
+    if df.empty:
+        print("Aucune vente retenue après nettoyage")
+        return df
+
+    # encodages des nouvelles ventes avec les tables d'avant la mise à jour, puis agrégats par clé
+    start = time.perf_counter()
+    with span("increment_encodages"):
+        previous = load_encoders(_model_path(_features.ENCODERS_DIR, models_dir), mmap=False)
+        if "geo" in previous:
+            df["code_insee"] = code_insee(df["Code departement"], df["Code commune"])
+        df = transform_encoders(df, previous)
+        state.add_sales(df)
+        tables = state.encoders()
+        if "geo" in previous:
+            # voisinages géographiques non mis à jour : table de la dernière exécution complète
+            tables["geo"] = previous["geo"]
+        num_cols = df.select_dtypes("number").columns
+        df[num_cols] = df[num_cols].fillna(0)
+        df = apply_schema(df)
+        df = df.drop(columns=[c for c in ("Nature mutation", "No voie") if c in df.columns])
+    timings["encodages"] = time.perf_counter() - start
+
+    # standardisation et PCA de tout l'historique, centroïdes réexprimés dans la nouvelle base
+    start = time.perf_counter()
+    with span("increment_pca"):
+        model = _load_pca_model(models_dir)
+        X = df[model["feature_cols"]].to_numpy(dtype=np.float64, na_value=0.0)
+        X = np.nan_to_num(X, nan=0.0)
+        state.add_moments(X)
+        scaler, pca = state.fit_pca(model["pca"].n_components_)
+        pca = _align_signs(pca, model["pca"])
+        old, new = (model["scaler"], model["pca"]), (scaler, pca)
+        previous_centroids = np.load(_model_path(_clustering.OUT_CENTROIDS_GLOBAL, models_dir))
+        centroids = {"global": reexpress_centroids(previous_centroids, old, new)}
+        for type_name, centroids_path in TYPES_CLUSTERS.items():
+            if type_name in state.clusters:
+                previous_centroids = np.load(_model_path(centroids_path, models_dir))
+                centroids[type_name] = reexpress_centroids(previous_centroids, old, new)
+    timings["pca"] = time.perf_counter() - start
+
+    # affectation des nouvelles ventes (centroïdes d'avant la mise à jour), puis moyennes courantes
+    start = time.perf_counter()
+    with span("increment_clusters"):
+        assigners = {n: CentroidAssigner(c, scaler, pca) for n, c in centroids.items()}
+        labels, distances = assigners["global"].assign(X, raw=True)
+        type_labels, _ = assign_by_type(X, df["type_local_encoded"].to_numpy(), assigners, raw=True)
+        df["cluster"] = labels
+        df["distance_cluster"] = distances
+        df["cluster_type"] = type_labels
+
+        type_codes = df["type_local_encoded"].to_numpy()
+        for cluster_name, c in centroids.items():
+            if cluster_name == "global":
+                rows = np.arange(len(df))
+            else:
+                rows = np.flatnonzero(type_codes == TYPES_LOCAUX.index(cluster_name))
+            info = state.clusters[cluster_name]
+            Z = assigners[cluster_name].project(X[rows])
+            cluster_labels = labels[rows] if cluster_name == "global" else type_labels[rows]
+            centroids[cluster_name], counts = update_centroids(
+                c, np.asarray(info["effectifs"], dtype=float), Z, cluster_labels
+            )
+            info["effectifs"] = counts.astype(np.int64).tolist()
+    timings["clusters"] = time.perf_counter() - start
+
+    # forêts : seuls les clusters dont l'effectif a dérivé sont réajustés
+    start = time.perf_counter()
+    with span("increment_forets"):
+        info = state.clusters["global"]
+        k = len(info["effectifs"])
+        added = np.bincount(labels, minlength=k)
+        info["ajoutees"] = (np.asarray(info["ajoutees"]) + added).tolist()
+        info["prix_m2_somme"] = (
+            np.asarray(info["prix_m2_somme"]) + np.bincount(labels, weights=df["prix_m2"].to_numpy(dtype=float), minlength=k)
+        ).tolist()
+
+        anomaly_model = _load_anomaly_model(models_dir)
+        forests = anomaly_model["forests"]
+        drift = np.asarray(info["ajoutees"]) / np.maximum(np.asarray(info["forets_lignes"]), 1)
+        drifted = [int(c) for c in np.flatnonzero(drift > seuil)]
+        for c in range(k):
+            status = "réajustée" if c in drifted else "conservée"
+            print(f"  cluster {c} : +{added[c]:,} ventes, dérive {drift[c]:.1%} -> forêt {status}")
+
+        X_anomaly = df[_anomalies.ANOMALY_FEATURES].to_numpy(dtype=np.float32, na_value=0.0)
+        X_anomaly = np.nan_to_num(X_anomaly, nan=0.0)
+        if drifted:
+            X_hist, labels_hist = _history_rows(drifted, state.meta["mises_a_jour"])
+            in_drifted = np.isin(labels, drifted)
+            X_fit = np.concatenate([X_hist, X_anomaly[in_drifted]])
+            labels_fit = np.concatenate([labels_hist, labels[in_drifted]])
+            _, _, refitted = _anomalies.detect_anomalies(X_fit, labels_fit)
+            forests.update(refitted)
+            for c in drifted:
+                info["forets_lignes"][c] = int(np.sum(labels_fit == c))
+                info["ajoutees"][c] = 0
+
+        effectifs = np.asarray(info["effectifs"], dtype=float)
+        prix_m2_mean = {c: float(info["prix_m2_somme"][c] / effectifs[c]) for c in forests if effectifs[c] > 0}
+    timings["forets"] = time.perf_counter() - start
+
+    # écriture des modèles sous STATE_DIR (lus par dvf_scoring), puis scores des ventes ajoutées
+    start = time.perf_counter()
+    with span("increment_ecriture"):
+        os.makedirs(MODELS_DIR, exist_ok=True)
+        save_encoders(tables, _model_path(_features.ENCODERS_DIR, MODELS_DIR))
+        _reduction.save_pca_model(model["feature_cols"], scaler, pca, path=_model_path(_reduction.MODEL_PATH, MODELS_DIR))
+        np.save(_model_path(_clustering.OUT_CENTROIDS_GLOBAL, MODELS_DIR), centroids["global"])
+        for type_name, centroids_path in TYPES_CLUSTERS.items():
+            if type_name in centroids:
+                np.save(_model_path(centroids_path, MODELS_DIR), centroids[type_name])
+        # forêts écrites en dernier : leur date marque des modèles complets (dvf_scoring.current_models_dir)
+        _anomalies.dump_anomaly_models(forests, prix_m2_mean, path=_model_path(_anomalies.MODEL_PATH, MODELS_DIR))
+
+        models = ScoringModels(tables, model["feature_cols"], scaler, pca, centroids["global"],
+                               forests, _anomalies.ANOMALY_FEATURES, prix_m2_mean)
+        scores, flags = score_forests(X_anomaly, labels, models)
+        prix_m2_cluster = models.prix_m2_mean[labels]
+        df["anomaly_score"] = scores
+        df["anomaly_flag"] = flags
+        df["prix_m2_mean"] = prix_m2_cluster.astype(np.float32)
+        df["decote"] = ((prix_m2_cluster - df["prix_m2"].to_numpy()) / prix_m2_cluster).astype(np.float32)
+
+        os.makedirs(INCREMENTS_DIR, exist_ok=True)
+        write_parquet(df, os.path.join(INCREMENTS_DIR, f"{name}.parquet"))
+        state.meta["mises_a_jour"].append(name)
+        state.save()
+    timings["ecriture"] = time.perf_counter() - start
+
+    print("Durées : " + ", ".join(f"{step} {seconds:.2f}s" for step, seconds in timings.items()))
+    print(f"Anomalies parmi les ventes ajoutées : {int((flags == -1).sum()):,}")
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mise à jour incrémentale du pipeline DVF (nouveau mois)")
+    sub = parser.add_subparsers(dest="commande", required=True)
+    sub.add_parser("init", help="état initial depuis les sorties du pipeline complet")
+    update = sub.add_parser("update", help="intègre un fichier DVF brut (format ValeursFoncieres)")
+    update.add_argument("input")
+    update.add_argument("--nom", help="identifiant de la mise à jour (défaut : nom du fichier)")
+    update.add_argument("--seuil", type=float, default=SEUIL_DERIVE,
+                        help="part de lignes ajoutées à un cluster au-delà de laquelle sa forêt est réajustée")
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.commande == "init":
+        init_state()
+    else:
+        apply_update(args.input, name=args.nom, seuil=args.seuil)
+    print(f"Terminé en {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
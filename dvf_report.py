@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import hashlib
+import sys
+import inspect
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dvf_telemetry import span
+
+# Rendu des figures des rapports (06, 07visu) : chaque figure est décrite par un petit tableau
+# résumé (quantiles, tableaux croisés, échantillons) calculé une fois par le script, et par une
+# fonction de rendu qui ne voit que ce résumé. Les figures sont rendues en parallèle dans des
+# processus ; une figure dont le résumé, le code de rendu et les options de sauvegarde n'ont
+# pas changé depuis le dernier rendu n'est pas redessinée. Le code de rendu comprend tout le
+# module de la fonction de rendu et les modules du projet qu'il utilise (ex. dvf_boxstats.draw_bxp),
+# ainsi que les versions des bibliothèques de tracé.
+
+N_WORKERS = min(4, os.cpu_count() or 1)
+CACHE_FILE = ".figures_cache.json"
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+RENDER_LIBS = ["matplotlib", "seaborn"]
+
+
+class Figure:
+    """
+    Figure à produire : render(data) dessine à partir du résumé et renvoie la figure matplotlib,
+    sauvegardée sous filename avec les options savefig (dpi, bbox_inches...).
+    render doit être une fonction de niveau module (envoyée aux processus de rendu).
+    """
+
+    def __init__(self, filename, render, data, **savefig):
+        self.filename = filename
+        self.render = render
+        self.data = data
+        self.savefig = savefig or {"dpi": 300}
+
+
+def _update_hash(h, value):
+    """Hash stable d'un résumé : DataFrame, Series, tableaux numpy, dict, listes, scalaires."""
+    if isinstance(value, pd.DataFrame):
+        h.update(repr((list(value.columns), [str(t) for t in value.dtypes])).encode("utf-8"))
+        h.update(pd.util.hash_pandas_object(value.index).to_numpy().tobytes())
+        for col in value.columns:
+            if value[col].dtype == object:
+                # colonne de listes ou de tableaux (ex. points hors moustaches) : valeur par valeur
+                _update_hash(h, list(value[col]))
+            else:
+                h.update(pd.util.hash_pandas_object(value[col], index=False).to_numpy().tobytes())
+    elif isinstance(value, (pd.Series, pd.Index)):
+        h.update(repr((value.name, str(value.dtype))).encode("utf-8"))
+        h.update(pd.util.hash_pandas_object(value, index=isinstance(value, pd.Series)).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        h.update(repr((value.dtype.str, value.shape)).encode("utf-8"))
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            h.update(repr(key).encode("utf-8"))
+            _update_hash(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}{len(value)}".encode("utf-8"))
+        for item in value:
+            _update_hash(h, item)
+    else:
+        h.update(repr(value).encode("utf-8"))
+
+
+def _project_file(obj):
+    """Fichier source d'un module, d'une fonction ou d'une classe du projet, None sinon."""
+    try:
+        path = inspect.getsourcefile(obj if inspect.ismodule(obj) else inspect.getmodule(obj))
+    except TypeError:
+        return None
+    if path is None or os.path.dirname(os.path.abspath(path)) != PROJECT_DIR:
+        return None
+    return os.path.abspath(path)
+
+
+def _module_closure(module):
+    """Fichiers du projet dont dépend un module : lui-même et, récursivement, les modules, fonctions
+    et classes du projet présents dans ses globales (from dvf_xxx import ..., importlib.import_module)."""
+    seen, todo = {}, [module]
+    while todo:
+        module = todo.pop()
+        path = _project_file(module)
+        if path is None or path in seen:
+            continue
+        seen[path] = module
+        for value in vars(module).values():
+            if inspect.ismodule(value) or inspect.isfunction(value) or inspect.isclass(value):
+                dependency = value if inspect.ismodule(value) else inspect.getmodule(value)
+                if dependency is not None and _project_file(dependency) not in seen:
+                    todo.append(dependency)
+    return sorted(seen)
+
+
+@functools.lru_cache(maxsize=None)
+def _render_code_hash(module_name):
+    """Empreinte du code de rendu d'un module : sources de sa fermeture et versions des bibliothèques."""
+    h = hashlib.blake2b(digest_size=16)
+    for path in _module_closure(sys.modules[module_name]):
+        h.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            h.update(f.read())
+    for lib in RENDER_LIBS:
+        h.update(f"{lib}={getattr(sys.modules.get(lib), '__version__', None)}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def figure_hash(figure):
+    """Empreinte d'une figure : résumé, code de rendu (module et dépendances du projet), options de sauvegarde."""
+    h = hashlib.blake2b(digest_size=16)
+    module_name = getattr(figure.render, "__module__", None)
+    if module_name in sys.modules and _project_file(sys.modules[module_name]) is not None:
+        h.update(_render_code_hash(module_name).encode("utf-8"))
+    else:
+        try:
+            h.update(inspect.getsource(figure.render).encode("utf-8"))
+        except (OSError, TypeError):
+            h.update(figure.render.__code__.co_code)
+    _update_hash(h, figure.savefig)
+    _update_hash(h, figure.data)
+    return h.hexdigest()
+
+
+def _load_cache(out_dir):
+    path = os.path.join(out_dir, CACHE_FILE)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_cache(out_dir, cache):
+    path = os.path.join(out_dir, CACHE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def _init_render_worker():
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+
+
+def _render(figure, path):
+    """Dessine et sauvegarde une figure (écriture atomique) ; renvoie la durée."""
+    import matplotlib.pyplot as plt
+
+    start = time.perf_counter()
+    with span("figure", fichier=os.path.basename(path)):
+        fig = figure.render(figure.data)
+        # même extension que le fichier final : le format est déduit du nom temporaire
+        tmp = f"{path}.tmp{os.path.splitext(path)[1]}"
+        fig.savefig(tmp, **figure.savefig)
+        plt.close(fig)
+        os.replace(tmp, path)
+    return time.perf_counter() - start
+
+
+def render_figures(figures, out_dir, n_workers=N_WORKERS, force=False):
+    """
+    Rend les figures dont l'empreinte a changé (ou absentes du disque), en parallèle.
+    Renvoie {fichier: durée du rendu en secondes, None si la figure était à jour}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    cache = _load_cache(out_dir)
+    results, todo = {}, []
+    for figure in figures:
+        digest = figure_hash(figure)
+        path = os.path.join(out_dir, figure.filename)
+        if not force and cache.get(figure.filename) == digest and os.path.exists(path):
+            results[figure.filename] = None
+        else:
+            todo.append((figure, path, digest))
+
+    if n_workers > 1 and len(todo) > 1:
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(
+            max_workers=min(n_workers, len(todo)), mp_context=context, initializer=_init_render_worker
+        ) as executor:
+            futures = [executor.submit(_render, figure, path) for figure, path, _ in todo]
+            durations = [fut.result() for fut in futures]
+    else:
+        durations = [_render(figure, path) for figure, path, _ in todo]
+
+    for (figure, _, digest), seconds in zip(todo, durations):
+        cache[figure.filename] = digest
+        results[figure.filename] = seconds
+    _save_cache(out_dir, cache)
+
+    for filename, seconds in results.items():
+        status = "inchangée" if seconds is None else f"rendue en {seconds:.1f}s"
+        print(f"  {filename:<45} {status}")
+    return results
+
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Schéma typé commun à toutes les étapes, appliqué à la lecture et à l'écriture :
+#   identifiants texte -> catégoriel (dictionnaire Arrow), groupby et filtres sur codes entiers
+#   Type local        -> catégoriel à codes fixes (Maison = 0, Appartement = 1)
+#   numériques        -> float32 (petits entiers compris : exacts), annee en int16
+# Valeur fonciere reste en float64 : au-delà de 16 M€, le float32 perd l'euro près.
+
+TYPES_LOCAUX = ["Maison", "Appartement", "Dépendance", "Local industriel. commercial ou assimilé"]
+CODE_MAISON = 0
+CODE_APPARTEMENT = 1
+
+IDENTIFIANTS = [
+    "Nature mutation", "Code postal", "Code commune", "Code departement",
+    "Commune", "Voie", "Type de voie", "No voie", "code_insee",
+]
+COLONNES_INT16 = ["annee"]
+COLONNES_FLOAT64 = ["Valeur fonciere"]
+
+# dictionnaires Arrow : même type d'indices dans tous les fichiers (partitions écrites séparément)
+_DICT_IDENTIFIANT = pa.dictionary(pa.int32(), pa.string())
+_DICT_TYPE_LOCAL = pa.dictionary(pa.int8(), pa.string())
+
+
+def type_local_codes(col):
+    """Codes fixes du type de local (int8, -1 pour un type inconnu ou manquant)."""
+    col = pd.Series(col, copy=False)
+    if isinstance(col.dtype, pd.CategoricalDtype) and list(col.cat.categories) == TYPES_LOCAUX:
+        return col.cat.codes.to_numpy().astype(np.int8, copy=False)
+    return pd.Categorical(col, categories=TYPES_LOCAUX).codes.astype(np.int8, copy=False)
+
+
+def apply_schema(df):
+    """Applique le schéma aux colonnes présentes (sans effet sur une colonne déjà typée)."""
+    for col in df.columns:
+        dtype = df[col].dtype
+        if col == "Type local":
+            if not (isinstance(dtype, pd.CategoricalDtype) and list(dtype.categories) == TYPES_LOCAUX):
+                df[col] = pd.Categorical.from_codes(type_local_codes(df[col]), categories=TYPES_LOCAUX)
+        elif col in IDENTIFIANTS:
+            if not isinstance(dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("string").astype("category")
+        elif not pd.api.types.is_numeric_dtype(dtype):
+            continue  # texte brut (étape 01) : converti au nettoyage
+        elif col in COLONNES_INT16:
+            df[col] = df[col].astype(np.int16)
+        elif col in COLONNES_FLOAT64:
+            df[col] = df[col].astype(np.float64)
+        elif pd.api.types.is_float_dtype(dtype) and dtype != np.float32:
+            df[col] = df[col].astype(np.float32)
+    return df
+
+
+def to_arrow(df):
+    """Table Arrow au schéma commun (dictionnaires à indices fixes pour les identifiants)."""
+    table = pa.Table.from_pandas(apply_schema(df.copy(deep=False)), preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if field.name == "Type local":
+            table = table.set_column(i, field.name, table[field.name].cast(_DICT_TYPE_LOCAL))
+        elif field.name in IDENTIFIANTS:
+            table = table.set_column(i, field.name, table[field.name].cast(_DICT_IDENTIFIANT))
+    return table
+
+
+def read_parquet(path, columns=None):
+    """Lit un fichier Parquet et applique le schéma."""
+    return apply_schema(pd.read_parquet(path, columns=columns))
+
+
+def write_parquet(df, path):
+    """Écrit df en Parquet au schéma commun."""
+    pq.write_table(to_arrow(df), path)
@@ -0,0 +1,284 @@
+import os
+import time
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+
+try:
+    from sklearn.ensemble._iforest import _average_path_length
+except ImportError:  # fonction privée de sklearn : repli sur decision_function (cf. ForestScorer)
+    _average_path_length = None
+
+from dvf_assign import CentroidAssigner
+from dvf_encoders import load_encoders, transform_encoders
+from dvf_geo import code_insee
+from dvf_schema import to_arrow
+
+# Scoring de nouvelles transactions DVF avec les modèles persistés par le pipeline, sans réajustement :
+#   lignes brutes -> nettoyage (02) -> variables (03 + tables d'encodage) -> standardisation + PCA (04)
+#   -> cluster K-Means global le plus proche (05) -> Isolation Forest du cluster (07) -> décote (08)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(BASE_DIR, "data", "models")
+ENCODERS_DIR = os.path.join(MODELS_DIR, "encoders")
+PCA_MODEL_PATH = os.path.join(MODELS_DIR, "pca.joblib")
+CENTROIDS_PATH = os.path.join(MODELS_DIR, "kmeans_global_centroids.npy")
+FORESTS_PATH = os.path.join(MODELS_DIR, "isolation_forests.joblib")
+# modèles écrits par les mises à jour incrémentales (dvf_incremental), mêmes noms de fichiers
+INCREMENTAL_MODELS_DIR = os.path.join(MODELS_DIR, "incremental", "modeles")
+
+OUTPUT_PATH = os.path.join(BASE_DIR, "data", "processed", "dvf_scores_nouvelles_transactions.parquet")
+
+TAILLE_LOT = 8 * 1024 * 1024  # octets de fichier brut lus par lot en mode flux
+
+# étapes du pipeline réutilisées telles quelles (scripts numérotés)
+_loading = importlib.import_module("01_data_loading_dvf")
+_cleaning = importlib.import_module("02_cleaning_dvf")
+_features = importlib.import_module("03_feature_engineering_clustering")
+
+OUTPUT_COLUMNS = ["cluster", "distance_cluster", "anomaly_score", "anomaly_flag", "prix_m2_mean", "decote"]
+# attributs privés d'IsolationForest lus par ForestScorer (absents : repli sur decision_function)
+FOREST_INTERNALS = ["_decision_path_lengths", "_average_path_length_per_tree", "_max_samples"]
+
+
+class ForestScorer:
+    """
+    Isolation Forest figée pour le scoring : chaque arbre est réduit à sa structure (Tree.apply,
+    parcours compilé) et à la profondeur de chaque feuille, chemin moyen des échantillons restants
+    compris, calculée une fois au chargement. Même score que decision_function, sans la validation
+    ni la boucle joblib de sklearn (un appel par arbre et par lot). n_jobs > 1 : arbres répartis
+    en blocs sur des threads (Tree.apply libère le GIL). Repose sur des attributs privés de
+    sklearn : s'ils manquent (autre version), la forêt est scorée par son decision_function public.
+    """
+
+    def __init__(self, forest, n_jobs=1):
+        self.forest = forest
+        self.n_jobs = (os.cpu_count() or 1) if n_jobs in (None, -1) else n_jobs
+        self.fast = _average_path_length is not None and all(hasattr(forest, a) for a in FOREST_INTERNALS)
+        if not self.fast:
+            return
+        self.trees = [tree.tree_ for tree in forest.estimators_]
+        self.features = [
+            None if len(features) == forest.n_features_in_ else np.asarray(features)
+            for features in forest.estimators_features_
+        ]
+        self.leaf_depths = [
+            path_lengths + avg_lengths - 1.0
+            for path_lengths, avg_lengths in zip(forest._decision_path_lengths, forest._average_path_length_per_tree)
+        ]
+        self.denominator = len(self.trees) * _average_path_length([forest._max_samples])[0]
+        self.offset = forest.offset_
+
+    def _depths(self, X, tree_ids):
+        depths = np.zeros(len(X))
+        for i in tree_ids:
+            X_tree = X if self.features[i] is None else np.ascontiguousarray(X[:, self.features[i]])
+            depths += self.leaf_depths[i][self.trees[i].apply(X_tree)]
+        return depths
+
+    def decision_function(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if not self.fast:
+            return self.forest.decision_function(X)
+        n_blocks = min(self.n_jobs, len(self.trees))
+        if n_blocks <= 1:
+            depths = self._depths(X, range(len(self.trees)))
+        else:
+            blocks = np.array_split(np.arange(len(self.trees)), n_blocks)
+            with ThreadPoolExecutor(max_workers=n_blocks) as executor:
+                depths = sum(executor.map(lambda ids: self._depths(X, ids), blocks))
+        # même calcul que IsolationForest.score_samples (score 1 pour un arbre d'un seul échantillon)
+        ratio = np.divide(depths, self.denominator, out=np.ones_like(depths), where=self.denominator != 0)
+        return -(2.0 ** -ratio) - self.offset
+
+
+class ScoringModels:
+    """
+    Modèles figés du pipeline. La standardisation, la PCA et la restriction aux premières
+    composantes sont fusionnées en une seule projection affine, suivie de l'affectation au
+    centroïde le plus proche (dvf_assign : produits matriciels float32 par blocs).
+    """
+
+    def __init__(self, tables, feature_cols, scaler, pca, centroids, forests, anomaly_features, prix_m2_mean,
+                 n_jobs=1):
+        self.tables = tables
+        self.feature_cols = feature_cols
+        self.assigner = CentroidAssigner(centroids, scaler, pca)
+        self.forests = {cluster_id: ForestScorer(forest, n_jobs) for cluster_id, forest in forests.items()}
+        self.anomaly_features = anomaly_features
+
+        # prix moyen au m² par identifiant de cluster (tableau indexé, pas de jointure)
+        self.prix_m2_mean = np.full(self.assigner.n_clusters, np.nan)
+        for cluster_id, value in prix_m2_mean.items():
+            self.prix_m2_mean[cluster_id] = value
+
+
+def current_models_dir():
+    """
+    Modèles de la dernière mise à jour incrémentale s'ils sont plus récents que ceux du pipeline
+    complet (écrits après eux), sinon ceux du pipeline (03, 04, 05, 07).
+    """
+    # les forêts sont le dernier fichier écrit par une mise à jour
+    marker = os.path.join(INCREMENTAL_MODELS_DIR, os.path.basename(FORESTS_PATH))
+    if not os.path.exists(marker):
+        return MODELS_DIR
+    pipeline = [p for p in (PCA_MODEL_PATH, CENTROIDS_PATH, FORESTS_PATH) if os.path.exists(p)]
+    if all(os.path.getmtime(marker) >= os.path.getmtime(p) for p in pipeline):
+        return INCREMENTAL_MODELS_DIR
+    return MODELS_DIR
+
+
+def load_scoring_models(models_dir=None, n_jobs=-1):
+    """Charge les modèles sauvegardés par les étapes 03, 04, 05 et 07 (défaut : current_models_dir())."""
+    models_dir = models_dir or current_models_dir()
+    pca_model = joblib.load(os.path.join(models_dir, os.path.basename(PCA_MODEL_PATH)))
+    anomaly_model = joblib.load(os.path.join(models_dir, os.path.basename(FORESTS_PATH)))
+
+    return ScoringModels(
+        tables=load_encoders(os.path.join(models_dir, os.path.basename(ENCODERS_DIR))),
+        feature_cols=pca_model["feature_cols"],
+        scaler=pca_model["scaler"],
+        pca=pca_model["pca"],
+        centroids=np.load(os.path.join(models_dir, os.path.basename(CENTROIDS_PATH))),
+        forests=anomaly_model["forests"],
+        anomaly_features=anomaly_model["features"],
+        prix_m2_mean=anomaly_model["prix_m2_mean"],
+        n_jobs=n_jobs,  # forêts ajustées avec n_jobs=1 ; au scoring les arbres sont répartis sur les coeurs
+    )
+
+
+def build_features(df_raw, models):
+    """Nettoyage et variables des étapes 02 / 03, encodages lus dans les tables (aucun groupby)."""
+    df = _cleaning.clean_dvf(df_raw, verbose=False)
+    df = _features.add_basic_features(df)
+    df = _features.add_temporal_features(df)
+    if "geo" in models.tables:
+        df["code_insee"] = code_insee(df["Code departement"], df["Code commune"])
+    df = transform_encoders(df, models.tables)
+    return df
+
+
+def assign_clusters(X, models):
+    """Projection PCA puis centroïde K-Means global le plus proche : (labels, distances au centroïde)."""
+    return models.assigner.assign(X, raw=True)
+
+
+def score_forests(X, clusters, models):
+    """Score de chaque ligne par la forêt de son cluster (même convention que 07 : score < 0 = anomalie)."""
+    scores = np.full(len(X), np.nan, dtype=np.float32)
+    flags = np.ones(len(X), dtype=np.int8)
+
+    order = np.argsort(clusters, kind="stable")
+    cluster_ids, starts = np.unique(clusters[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    for cluster_id, start, end in zip(cluster_ids, starts, ends):
+        forest = models.forests.get(cluster_id.item())
+        if forest is None:
+            continue
+        rows = order[start:end]
+        cluster_scores = forest.decision_function(X[rows])
+        scores[rows] = cluster_scores
+        flags[rows] = np.where(cluster_scores < 0, -1, 1)
+    return scores, flags
+
+
+def score_transactions(df_raw, models):
+    """
+    Score un lot de transactions brutes (colonnes DVF d'origine, valeurs en texte).
+    Seules les lignes retenues par le nettoyage sont renvoyées, enrichies de
+    cluster, anomaly_score, anomaly_flag, prix_m2_mean et decote.
+    """
+    df = build_features(df_raw, models)
+    if df.empty:
+        return df.assign(**{col: pd.Series(dtype="float32") for col in OUTPUT_COLUMNS})
+
+    # mêmes valeurs manquantes que dans le jeu de variables de l'étape 03
+    X_pca = df[models.feature_cols].to_numpy(dtype=np.float64, na_value=0.0)
+    X_pca = np.nan_to_num(X_pca, nan=0.0)
+    clusters, distances = assign_clusters(X_pca, models)
+
+    X_anomaly = df[models.anomaly_features].to_numpy(dtype=np.float32, na_value=0.0)
+    X_anomaly = np.nan_to_num(X_anomaly, nan=0.0)
+    scores, flags = score_forests(X_anomaly, clusters, models)
+
+    prix_m2_mean = models.prix_m2_mean[clusters]
+    df["cluster"] = clusters
+    df["distance_cluster"] = distances
+    df["anomaly_score"] = scores
+    df["anomaly_flag"] = flags
+    df["prix_m2_mean"] = prix_m2_mean.astype(np.float32)
+    df["decote"] = ((prix_m2_mean - df["prix_m2"].to_numpy()) / prix_m2_mean).astype(np.float32)
+    return df
+
+
+def iter_raw_batches(filepath, batch_bytes=TAILLE_LOT):
+    """
+    Lit un fichier DVF brut en flux (lecteur CSV d'Arrow, blocs de batch_bytes octets) : mêmes
+    colonnes, mêmes valeurs manquantes (champ vide) et mêmes filtres Vente / non nul que l'étape 01.
+    """
+    reader = pcsv.open_csv(
+        filepath,
+        read_options=pcsv.ReadOptions(block_size=batch_bytes),
+        parse_options=pcsv.ParseOptions(delimiter="|"),
+        convert_options=pcsv.ConvertOptions(
+            include_columns=_loading.COLUMNS_TO_KEEP,
+            column_types={col: pa.string() for col in _loading.COLUMNS_TO_KEEP},
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        keep = pc.and_(pc.equal(batch["Nature mutation"], "Vente"), pc.is_valid(batch["Valeur fonciere"]))
+        batch = batch.filter(keep)
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def score_stream(batches, models):
+    """Score un flux de lots de transactions brutes ; renvoie un générateur de lots scorés."""
+    for df_raw in batches:
+        yield score_transactions(df_raw, models)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scoring d'anomalies de nouvelles transactions DVF")
+    parser.add_argument("input", help="fichier DVF brut (format ValeursFoncieres, séparateur |)")
+    parser.add_argument("-o", "--output", default=OUTPUT_PATH, help="parquet de sortie")
+    args = parser.parse_args()
+
+    models_dir = current_models_dir()
+    print(f"Chargement des modèles : {models_dir}")
+    models = load_scoring_models(models_dir)
+
+    start = time.time()
+    n_rows = n_anomalies = 0
+    writer = None
+    for scored in score_stream(iter_raw_batches(args.input), models):
+        if scored.empty:
+            continue
+        table = to_arrow(scored)
+        if writer is None:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            writer = pq.ParquetWriter(args.output, table.schema)
+        writer.write_table(table.cast(writer.schema))
+        n_rows += len(scored)
+        n_anomalies += int((scored["anomaly_flag"] == -1).sum())
+    if writer is not None:
+        writer.close()
+
+    elapsed = time.time() - start
+    print(f"Transactions scorées : {n_rows:,} en {elapsed:.1f}s ({n_rows / max(elapsed, 1e-9):,.0f} lignes/s)")
+    print(f"Anomalies détectées : {n_anomalies:,}")
+    print(f"Fichier sauvegardé : {args.output}")
+
+
+if __name__ == "__main__":
+    main()
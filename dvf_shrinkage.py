@@ -0,0 +1,277 @@
+import numpy as np
+import pandas as pd
+
+from dvf_encoders import LookupTable, hash_keys, combine_hashes, fold_ids
+
+# Encodage hiérarchique par rétrécissement (bayésien empirique) : département -> commune -> voie
+# (et département -> code postal).
+# Comptes, sommes et sommes des carrés de tous les niveaux sont obtenus par bincount sur des codes
+# entiers factorisés une seule fois. Chaque groupe est tiré vers l'estimation de son parent
+# d'autant plus fortement qu'il compte peu de ventes. Les estimations sont hors fold : le fold
+# d'une vente est déduit de son contenu (dvf_encoders.fold_ids) et les tables gardent une valeur
+# par (fold, groupe), de sorte que la vente d'une ligne n'entre jamais dans son propre encodage,
+# au fit comme lorsqu'une vente connue est réencodée par les tables (dvf_scoring).
+
+N_FOLDS = 5
+
+# niveaux de la hiérarchie : colonnes formant la clé de chaque niveau ; le parent d'un niveau est
+# celui dont la clé est la sienne sans sa dernière colonne (un niveau est listé après son parent)
+LEVELS = {
+    "departement": ["Code departement"],
+    "commune": ["Code departement", "Commune"],
+    "voie": ["Code departement", "Commune", "Voie"],
+    "code_postal": ["Code departement", "Code postal"],
+}
+
+
+def parent_level(levels, level):
+    """Niveau parent d'un niveau (None pour la racine)."""
+    prefix = levels[level][:-1]
+    return next((name for name, cols in levels.items() if cols == prefix), None) if prefix else None
+
+
+def _labels(col):
+    """Codes des libellés d'une colonne (-1 si manquant) et libellés distincts (catégories réutilisées)."""
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return col.cat.codes.to_numpy().astype(np.int64), col.cat.categories
+    codes, uniques = pd.factorize(col)
+    return codes.astype(np.int64, copy=False), uniques
+
+
+def _renumber(combined, size):
+    """
+    Codes 0..n-1 des valeurs distinctes de combined (-1 conservé) et ces valeurs, dans l'ordre
+    des codes : par comptage quand l'espace des codes combinés (parent, libellé) ne dépasse pas
+    le nombre de lignes, sinon par hachage.
+    """
+    known = combined >= 0
+    all_known = known.all()
+    if size <= len(combined):
+        used = np.bincount(combined if all_known else combined[known], minlength=size) > 0
+        if used.all():
+            return combined, np.arange(size)
+        remap = np.cumsum(used) - 1
+        if all_known:
+            return remap[combined], np.flatnonzero(used)
+        return np.where(known, remap[np.maximum(combined, 0)], -1), np.flatnonzero(used)
+    if all_known:
+        level_codes, uniques = pd.factorize(combined)
+        return level_codes.astype(np.int64, copy=False), uniques
+    level_codes = np.full(len(combined), -1, dtype=np.int64)
+    level_codes[known], uniques = pd.factorize(combined[known])
+    return level_codes, uniques
+
+
+def hierarchy_codes(df, levels=LEVELS):
+    """
+    Codes entiers de chaque niveau : le code d'un niveau combine celui du parent et le libellé
+    du niveau (une commune est identifiée par son département, une voie par sa commune, un
+    code postal par son département).
+    Une clé incomplète (libellé manquant) a le code -1.
+    Renvoie {niveau: (codes, nombre de groupes, groupe parent de chaque groupe, haché de la clé)} ;
+    parent et libellé d'un groupe se lisent sur son code combiné, sans repasser sur les lignes,
+    et les libellés ne sont hachés qu'une fois par valeur distincte (même haché que dvf_encoders.hash_key).
+    """
+    codes = {}
+    for level, cols in levels.items():
+        label, labels = _labels(df[cols[-1]])
+        n_labels = max(len(labels), 1)
+        parent = parent_level(levels, level)
+        if parent is None:
+            combined, size = label, len(labels)
+        else:
+            parent_codes, n_parent, _, parent_hashes = codes[parent]
+            combined = parent_codes * n_labels + label
+            known = (parent_codes >= 0) & (label >= 0)
+            if not known.all():
+                combined[~known] = -1
+            size = n_parent * n_labels
+        level_codes, uniques = _renumber(combined, size)
+        n_groups = len(uniques)
+
+        label_hashes, _ = hash_keys(pd.Series(np.asarray(labels, dtype=object)))
+        if parent is None:
+            parent_group = np.zeros(n_groups, dtype=np.int64)
+            hashes = label_hashes[uniques]
+        else:
+            parent_group = uniques // n_labels
+            hashes = combine_hashes(parent_hashes[parent_group], label_hashes[uniques % n_labels])
+
+        codes[level] = (level_codes, n_groups, parent_group, hashes)
+    return codes
+
+
+def _fold_moments(codes, n_groups, y, y2, folds, n_folds):
+    """
+    Comptes et sommes par (fold, groupe) en une passe de bincount, et somme des carrés des lignes
+    connues (seul son total entre dans prior_strength). Renvoie aussi l'indice (fold, groupe) de ces lignes.
+    """
+    known = codes >= 0
+    idx = folds * n_groups + codes
+    if not known.all():
+        idx, y, y2 = idx[known], y[known], y2[known]
+    size = n_groups * n_folds
+    n = np.bincount(idx, minlength=size).reshape(n_folds, n_groups)
+    s = np.bincount(idx, weights=y, minlength=size).reshape(n_folds, n_groups)
+    return n, s, float(y2.sum()), idx
+
+
+def prior_strength(n, s, q, parent_estimate):
+    """
+    Pseudo-compte m = variance intra-groupe / variance inter-groupes (méthode des moments) :
+    l'estimation d'un groupe de n ventes est (somme + m * parent) / (n + m).
+    q : sommes des carrés par groupe, ou leur total.
+    """
+    has = n > 0
+    n, s, parent_estimate = n[has], s[has], parent_estimate[has]
+    means = s / n
+    dof = n.sum() - len(n)
+    within = max((np.sum(q) - (s * means).sum()) / dof, 1e-12) if dof > 0 else 1e-12
+    between = np.mean((means - parent_estimate) ** 2 - within / n)
+    return within / max(between, within * 1e-6)
+
+
+def shrink(n_f, s_f, q, parent_full, parent_oof):
+    """
+    Estimations d'un niveau à partir des moments par (fold, groupe) : pseudo-compte m, estimation
+    sur toutes les ventes (parent des niveaux suivants) et estimation hors fold par (fold, groupe),
+    dont le parent est lui-même hors fold.
+    """
+    n, s = n_f.sum(axis=0), s_f.sum(axis=0)
+    m = prior_strength(n, s, q, parent_full)
+    full = (s + m * parent_full) / (n + m)
+    oof = s - s_f
+    oof += m * parent_oof
+    oof /= (n + m) - n_f
+    return m, full, oof
+
+
+def _root(n_f, s_f):
+    """Moyenne globale et moyenne hors fold de la racine (une par fold)."""
+    n, s = n_f.sum(), s_f.sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        oof = np.where(n > n_f, (s - s_f) / (n - n_f), s / n)
+    return s / n, oof
+
+
+def _table(cols, keys, name, values, parent_feature, global_mean):
+    """Table d'un niveau ; clé inconnue : valeur du niveau parent (constante globale pour la racine)."""
+    order = np.argsort(keys)
+    fallback = parent_feature if parent_feature else float(np.expm1(global_mean))
+    return LookupTable(cols, keys[order], {name: values[:, order]}, fallback={name: fallback}), order
+
+
+def hierarchical_encode(df, target, features, levels=LEVELS, n_folds=N_FOLDS, tables=None):
+    """
+    Encode target (tableau aligné sur df, ex. log du prix au m²) à chaque niveau.
+    features : {niveau: nom de variable}. Renvoie {nom: float32} hors fold pour chaque ligne,
+    lu dans la table (fold, groupe) du niveau : transform_encoders restitue les mêmes valeurs.
+    Si tables est un dict, il reçoit une table par niveau, avec repli sur le niveau parent
+    pour une clé inconnue.
+    """
+    y = np.asarray(target, dtype=float)
+    codes = hierarchy_codes(df, levels)
+    folds = fold_ids(df, n_folds)
+    valid = ~np.isnan(y)
+    if not valid.all():
+        y = np.where(valid, y, 0.0)
+    y2 = y * y
+
+    root_n = np.bincount(folds, weights=valid, minlength=n_folds)
+    root_s = np.bincount(folds, weights=y, minlength=n_folds)
+    global_mean, root_oof = _root(root_n, root_s)
+    root_row = np.full(len(y), np.expm1(global_mean), dtype=np.float32)
+
+    out = {}
+    done = {}
+    for level, cols in levels.items():
+        level_codes, n_groups, parent_group, keys = codes[level]
+        # lignes sans cible : exclues des moments
+        masked = level_codes if valid.all() else np.where(valid, level_codes, -1)
+        n_f, s_f, q, idx = _fold_moments(masked, n_groups, y, y2, folds, n_folds)
+
+        parent = parent_level(levels, level)
+        if parent is None:
+            parent_full = np.full(n_groups, global_mean)
+            parent_oof = root_oof[:, None]
+            parent_row, parent_feature = root_row, None
+        else:
+            parent_full, parent_oof, parent_feature = done[parent]
+            parent_full, parent_oof = parent_full[parent_group], parent_oof[:, parent_group]
+            parent_row = out[parent_feature]
+
+        m, full, oof = shrink(n_f, s_f, q, parent_full, parent_oof)
+        values = np.expm1(oof, dtype=np.float32)
+
+        # valeur (fold, groupe) de chaque ligne ; clé incomplète : valeur du parent
+        known = level_codes >= 0
+        if known.all():
+            est_row = values.ravel()[idx if valid.all() else folds * n_groups + level_codes]
+        else:
+            est_row = parent_row.copy()
+            est_row[known] = values.ravel()[folds[known] * n_groups + level_codes[known]]
+
+        name = features[level]
+        out[name] = est_row
+        if tables is not None:
+            tables[f"hier_{level}"], _ = _table(cols, keys, name, values, parent_feature, global_mean)
+
+        print(f"  {level:<12}: {n_groups:,} groupes, pseudo-compte m = {m:.1f}")
+        done[level] = (full, oof, name)
+
+    return out
+
+
+def hierarchy_moments(df, target, levels=LEVELS, n_folds=N_FOLDS):
+    """
+    Moments par (fold, groupe) de target à chaque niveau (n et somme par fold) et somme des carrés
+    du niveau, indexés par le haché de la clé (celui des tables) et accompagnés du haché du groupe
+    parent : ils s'additionnent d'un lot de ventes à l'autre.
+    Renvoie {niveau: (clés, clés parentes, n, s, q)} et (n, s) de la racine par fold.
+    """
+    y = np.asarray(target, dtype=float)
+    valid = ~np.isnan(y)
+    y = np.where(valid, y, 0.0)
+    codes = hierarchy_codes(df, levels)
+    folds = fold_ids(df, n_folds)
+
+    out = {}
+    for level in levels:
+        level_codes, n_groups, parent_group, keys = codes[level]
+        n_f, s_f, q, _ = _fold_moments(np.where(valid, level_codes, -1), n_groups, y, y * y, folds, n_folds)
+        parent = parent_level(levels, level)
+        parent_keys = np.zeros(n_groups, dtype=np.uint64) if parent is None else codes[parent][3][parent_group]
+        out[level] = (keys, parent_keys, n_f, s_f, q)
+    root = (np.bincount(folds, weights=valid, minlength=n_folds), np.bincount(folds, weights=y, minlength=n_folds))
+    return out, root
+
+
+def hierarchical_tables(moments, root, features, levels=LEVELS):
+    """
+    Tables de hierarchical_encode recalculées à partir de moments accumulés (hierarchy_moments,
+    additionnés lot par lot), sans relire les ventes.
+    moments : {niveau: (clés, clés parentes, n, s, q)} ; root : (n, s) de la racine par fold.
+    """
+    global_mean, root_oof = _root(np.asarray(root[0], dtype=float), np.asarray(root[1], dtype=float))
+    tables = {}
+    done = {}
+    for level, cols in levels.items():
+        keys, parent_keys, n_f, s_f, q = moments[level]
+        parent = parent_level(levels, level)
+        if parent is None:
+            parent_full = np.full(len(keys), global_mean)
+            parent_oof = root_oof[:, None]
+            parent_feature = None
+        else:
+            parent_sorted, parent_full, parent_oof, parent_feature = done[parent]
+            pos = np.minimum(np.searchsorted(parent_sorted, parent_keys), len(parent_sorted) - 1)
+            parent_full, parent_oof = parent_full[pos], parent_oof[:, pos]
+
+        m, full, oof = shrink(n_f, s_f, q, parent_full, parent_oof)
+        name = features[level]
+        tables[f"hier_{level}"], order = _table(
+            cols, keys, name, np.expm1(oof, dtype=np.float32), parent_feature, global_mean
+        )
+        print(f"  {level:<12}: {len(keys):,} groupes, pseudo-compte m = {m:.1f}")
+        done[level] = (keys[order], full[order], oof[:, order], name)
+    return tables
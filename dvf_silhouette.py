@@ -0,0 +1,188 @@
+import numpy as np
+
+from dvf_telemetry import traced
+
+# Silhouette sans échantillonnage arbitraire :
+#   exact      : calcul complet O(n²) par blocs de distances, mémoire bornée
+#   simplified : silhouette simplifiée sur les distances aux centroïdes, O(n·k)
+#   bootstrap  : moyenne et intervalle de confiance sur des sous-échantillons exacts
+#   auto       : exact si n <= EXACT_MAX_ROWS, sinon simplifiée
+
+EXACT_MAX_ROWS = 50_000
+WORKING_MEMORY_MB = 256
+# libellé affiché de chaque mode (la silhouette simplifiée n'est pas comparable à l'exacte)
+MODE_LABELS = {"exact": "Silhouette", "simplified": "Silhouette simplifiée", "bootstrap": "Silhouette (bootstrap)"}
+
+
+def _encode_labels(labels):
+    uniques, codes = np.unique(np.asarray(labels), return_inverse=True)
+    return codes, len(uniques)
+
+
+def _silhouette_values(a, b, singleton):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        s = (b - a) / np.maximum(a, b)
+    s[singleton] = 0.0  # convention sklearn : silhouette nulle pour un cluster d'un seul point
+    return np.nan_to_num(s, nan=0.0)
+
+
+def _distance_block(X, sq_norms, start, end):
+    """Distances euclidiennes (float32) des lignes start:end de X à toutes les lignes."""
+    rows = np.arange(end - start)
+    dist = X[start:end] @ X.T
+    dist *= -2
+    dist += sq_norms[start:end, None]
+    dist += sq_norms[None, :]
+    np.maximum(dist, 0, out=dist)
+    np.sqrt(dist, out=dist)
+    dist[rows, start + rows] = 0.0
+    return dist
+
+
+def _block_silhouette(dist, onehot, codes, counts, start):
+    """Silhouette des lignes d'un bloc de distances, à partir des sommes de distances par cluster."""
+    end = start + len(dist)
+    rows = np.arange(end - start)
+    sums = (dist @ onehot).astype(np.float64)
+    own = codes[start:end]
+    a = sums[rows, own] / np.maximum(counts[own] - 1, 1)
+    sums[rows, own] = np.inf
+    b = (sums / counts).min(axis=1)
+    return _silhouette_values(a, b, counts[own] == 1)
+
+
+def _onehot(codes, k):
+    onehot = np.zeros((len(codes), k), dtype=np.float32)
+    onehot[np.arange(len(codes)), codes] = 1.0
+    return onehot
+
+
+def silhouette_samples_exact(X, labels, working_memory_mb=WORKING_MEMORY_MB):
+    """
+    Silhouette exacte de chaque point. Les distances sont calculées par blocs de lignes
+    (produit matriciel float32), puis sommées par cluster : un bloc ne dépasse jamais working_memory_mb.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    codes, k = _encode_labels(labels)
+    n = len(X)
+    counts = np.bincount(codes, minlength=k)
+    onehot = _onehot(codes, k)
+    sq_norms = np.einsum("ij,ij->i", X, X)
+
+    chunk = max(1, int(working_memory_mb * 2**20 // (4 * n)))
+    s = np.empty(n, dtype=np.float64)
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        dist = _distance_block(X, sq_norms, start, end)
+        s[start:end] = _block_silhouette(dist, onehot, codes, counts, start)
+    return s
+
+
+def distance_matrix(X, working_memory_mb=WORKING_MEMORY_MB):
+    """Matrice complète des distances euclidiennes en float32 (n² × 4 octets), remplie par blocs."""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    n = len(X)
+    sq_norms = np.einsum("ij,ij->i", X, X)
+    out = np.empty((n, n), dtype=np.float32)
+    chunk = max(1, int(working_memory_mb * 2**20 // (4 * n)))
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        out[start:end] = _distance_block(X, sq_norms, start, end)
+    return out
+
+
+def silhouette_precomputed(dist, labels, working_memory_mb=WORKING_MEMORY_MB):
+    """
+    Silhouette moyenne à partir d'une matrice de distances déjà calculée (distance_matrix) :
+    seul le produit par l'indicatrice des clusters reste à faire, O(n²·k) sans recalcul des distances.
+    """
+    codes, k = _encode_labels(labels)
+    n = len(codes)
+    counts = np.bincount(codes, minlength=k)
+    onehot = _onehot(codes, k)
+
+    chunk = max(1, int(working_memory_mb * 2**20 // (4 * max(n, 1))))
+    s = np.empty(n, dtype=np.float64)
+    for start in range(0, n, chunk):
+        s[start:start + chunk] = _block_silhouette(dist[start:start + chunk], onehot, codes, counts, start)
+    return float(s.mean())
+
+
+def silhouette_exact(X, labels, working_memory_mb=WORKING_MEMORY_MB):
+    """Silhouette moyenne exacte sur toutes les lignes."""
+    return float(silhouette_samples_exact(X, labels, working_memory_mb).mean())
+
+
+def silhouette_simplified(X, labels, centers=None):
+    """
+    Silhouette simplifiée : a = distance au centroïde de son cluster,
+    b = distance au centroïde le plus proche parmi les autres. Coût O(n·k).
+    """
+    X = np.asarray(X, dtype=np.float64)
+    codes, k = _encode_labels(labels)
+    counts = np.bincount(codes, minlength=k)
+    if centers is None:
+        centers = np.zeros((k, X.shape[1]))
+        np.add.at(centers, codes, X)
+        centers /= counts[:, None]
+    else:
+        # centroïdes fournis dans l'ordre des labels triés
+        centers = np.asarray(centers, dtype=np.float64)[np.unique(np.asarray(labels))]
+
+    sq = (X ** 2).sum(axis=1)[:, None] - 2 * X @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+    dist = np.sqrt(np.maximum(sq, 0))
+    rows = np.arange(len(X))
+    a = dist[rows, codes].copy()
+    dist[rows, codes] = np.inf
+    b = dist.min(axis=1)
+    return float(_silhouette_values(a, b, counts[codes] == 1).mean())
+
+
+def silhouette_bootstrap(X, labels, n_boot=20, sample_size=10_000, ci=0.95, random_state=42):
+    """
+    Silhouette exacte sur n_boot sous-échantillons : renvoie (moyenne, borne basse, borne haute).
+    Sous-échantillons d'un seul cluster ignorés ; (nan, nan, nan) si aucun n'en compte deux.
+    """
+    X = np.asarray(X)
+    labels = np.asarray(labels)
+    rng = np.random.RandomState(random_state)
+    size = min(sample_size, len(X))
+
+    scores = []
+    for _ in range(n_boot):
+        idx = rng.choice(len(X), size, replace=False)
+        if len(np.unique(labels[idx])) > 1:
+            scores.append(silhouette_exact(X[idx], labels[idx]))
+    scores = np.array(scores)
+    if len(scores) == 0:
+        return np.nan, np.nan, np.nan
+
+    alpha = (1 - ci) / 2
+    return float(scores.mean()), float(np.quantile(scores, alpha)), float(np.quantile(scores, 1 - alpha))
+
+
+def resolve_mode(mode, n_rows):
+    """Mode effectivement calculé : "auto" vaut "exact" jusqu'à EXACT_MAX_ROWS lignes, "simplified" au-delà."""
+    if mode == "auto":
+        return "exact" if n_rows <= EXACT_MAX_ROWS else "simplified"
+    return mode
+
+
+@traced
+def silhouette(X, labels, mode="auto", centers=None, sample_size=10_000, n_boot=20, random_state=42):
+    """
+    Point d'entrée unique. Renvoie (score, intervalle) ; l'intervalle de confiance
+    n'est renseigné qu'en mode bootstrap (sample_size et n_boot ne servent qu'à ce mode).
+    """
+    mode = resolve_mode(mode, len(X))
+
+    if mode == "exact":
+        return silhouette_exact(X, labels), None
+    if mode == "simplified":
+        return silhouette_simplified(X, labels, centers), None
+    if mode == "bootstrap":
+        mean, low, high = silhouette_bootstrap(
+            X, labels, n_boot=n_boot, sample_size=sample_size, random_state=random_state
+        )
+        return mean, (low, high)
+    raise ValueError(f"Mode de silhouette inconnu : {mode}")
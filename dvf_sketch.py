@@ -0,0 +1,164 @@
+import os
+import numpy as np
+import pandas as pd
+
+from dvf_encoders import hash_keys
+
+# Sketch de quantiles par groupe, fusionnable (principe DDSketch) : chaque valeur positive tombe
+# dans un bucket logarithmique d'indice ceil(log_gamma(x)), gamma = (1 + alpha) / (1 - alpha).
+# Un groupe ne garde que ses comptes par bucket ; tout quantile est restitué à alpha près
+# (erreur relative), quel que soit le nombre de ventes. Les sketches construits lot par lot,
+# partition par partition ou année par année se fusionnent par simple addition des comptes.
+
+ALPHA = 0.005                          # précision relative garantie (0,5 %)
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)  # servis ensemble, en une lecture des comptes
+COMPACT_ROWS = 2_000_000               # compaction des mises à jour en attente au-delà
+
+
+class QuantileSketch:
+    """
+    Comptes par (groupe, bucket) stockés en tableaux triés : clé de groupe uint64
+    (haché stable d'un libellé, ou identifiant entier), indice de bucket int32, compte int64.
+    """
+
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.buckets = np.empty(0, dtype=np.int32)
+        self.counts = np.empty(0, dtype=np.int64)
+        self._pending = []
+        self._n_pending = 0
+        self._served = None
+
+    def update(self, keys, values):
+        """Ajoute un lot de valeurs (valeurs non positives ou manquantes ignorées)."""
+        keys = np.asarray(keys).astype(np.uint64, copy=False)
+        values = np.asarray(values, dtype=float)
+        ok = values > 0  # NaN exclus
+        buckets = np.ceil(np.log(values[ok]) / np.log(self.gamma)).astype(np.int32)
+        self._add(keys[ok], buckets, np.ones(len(buckets), dtype=np.int64))
+
+    def merge(self, other):
+        """Fusionne un autre sketch (même précision) : addition des comptes."""
+        if other.alpha != self.alpha:
+            raise ValueError("Fusion impossible : précisions différentes")
+        other._compact()
+        self._add(other.keys, other.buckets, other.counts)
+        return self
+
+    def _add(self, keys, buckets, counts):
+        self._pending.append((keys, buckets, counts))
+        self._n_pending += len(keys)
+        self._served = None
+        if self._n_pending > COMPACT_ROWS:
+            self._compact()
+
+    def _compact(self):
+        """Regroupe les mises à jour en attente : tri (groupe, bucket) puis somme des doublons."""
+        if not self._pending:
+            return
+        keys = np.concatenate([self.keys] + [p[0] for p in self._pending])
+        buckets = np.concatenate([self.buckets] + [p[1] for p in self._pending])
+        counts = np.concatenate([self.counts] + [p[2] for p in self._pending])
+        self._pending, self._n_pending = [], 0
+
+        order = np.lexsort((buckets, keys))
+        keys, buckets, counts = keys[order], buckets[order], counts[order]
+        new = np.ones(len(keys), dtype=bool)
+        new[1:] = (keys[1:] != keys[:-1]) | (buckets[1:] != buckets[:-1])
+        starts = np.flatnonzero(new)
+        self.keys, self.buckets = keys[starts], buckets[starts]
+        self.counts = np.add.reduceat(counts, starts) if len(starts) else counts
+
+    def __len__(self):
+        """Nombre de groupes."""
+        self._compact()
+        return int(np.count_nonzero(np.r_[True, self.keys[1:] != self.keys[:-1]])) if len(self.keys) else 0
+
+    def quantiles(self, qs=QUANTILES):
+        """
+        Quantiles de tous les groupes (interpolation linéaire entre rangs, comme pandas).
+        Renvoie (clés de groupe triées, {q: valeurs}) ; le résultat est gardé pour les lectures suivantes.
+        """
+        if self._served is not None and all(q in self._served[1] for q in qs):
+            return self._served
+        self._compact()
+        if len(self.keys) == 0:
+            return np.empty(0, dtype=np.uint64), {q: np.empty(0) for q in qs}
+
+        starts = np.flatnonzero(np.r_[True, self.keys[1:] != self.keys[:-1]])
+        group_keys = self.keys[starts]
+        cum = np.cumsum(self.counts)
+        n = np.add.reduceat(self.counts, starts)
+        before = cum[starts] - self.counts[starts]
+        # valeur représentative d'un bucket : erreur relative <= alpha sur tout l'intervalle
+        bucket_values = 2 * self.gamma ** self.buckets.astype(float) / (self.gamma + 1)
+
+        out = {}
+        for q in qs:
+            pos = q * (n - 1)
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.ceil(pos).astype(np.int64)
+            v_lo = bucket_values[np.searchsorted(cum, before + lo, side="right")]
+            v_hi = bucket_values[np.searchsorted(cum, before + hi, side="right")]
+            out[q] = v_lo + (v_hi - v_lo) * (pos - lo)
+        self._served = (group_keys, out)
+        return self._served
+
+    def lookup(self, keys, q=0.5):
+        """Quantile q du groupe de chaque clé (NaN pour un groupe absent du sketch)."""
+        group_keys, values = self.quantiles(tuple(sorted(set(QUANTILES) | {q})))
+        keys = np.asarray(keys).astype(np.uint64, copy=False)
+        res = np.full(len(keys), np.nan)
+        if len(group_keys) == 0:
+            return res
+        pos = np.minimum(np.searchsorted(group_keys, keys), len(group_keys) - 1)
+        found = group_keys[pos] == keys
+        res[found] = values[q][pos[found]]
+        return res
+
+    def save(self, path):
+        self._compact()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, alpha=self.alpha, keys=self.keys, buckets=self.buckets, counts=self.counts)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        sketch = cls(float(data["alpha"]))
+        sketch.keys, sketch.buckets, sketch.counts = data["keys"], data["buckets"], data["counts"]
+        return sketch
+
+
+def label_keys(col, dropna=True):
+    """
+    Clés de groupe stables d'une colonne de libellés (haché uint64, identique d'un lot à l'autre).
+    dropna=False : les valeurs manquantes forment leur propre groupe. Renvoie (clés, lignes gardées).
+    """
+    h, missing = hash_keys(col)
+    keep = ~missing if dropna else np.ones(len(h), dtype=bool)
+    return h, keep
+
+
+def sketch_group_values(sketch, col, codes, n_groups, q=0.5, dropna=True):
+    """
+    Quantile q de chaque groupe factorisé (codes de dvf_groupby.factorize_key), lu dans le sketch
+    via le libellé de la première ligne du groupe : remplace group_median sans retrier les valeurs.
+    """
+    codes = np.asarray(codes)
+    rows = np.flatnonzero(codes >= 0)
+    first = np.zeros(n_groups, dtype=np.int64)
+    first[codes[rows[::-1]]] = rows[::-1]
+    keys, _ = label_keys(pd.Series(col, copy=False).iloc[first], dropna=dropna)
+    return sketch.lookup(keys, q)
+
+
+def relative_error(approx, exact):
+    """Erreurs relatives (max, p99, médiane) d'une estimation par rapport aux valeurs exactes."""
+    approx, exact = np.asarray(approx, dtype=float), np.asarray(exact, dtype=float)
+    ok = ~np.isnan(approx) & ~np.isnan(exact) & (exact != 0)
+    if not ok.any():
+        return {"max": np.nan, "p99": np.nan, "median": np.nan}
+    err = np.abs(approx[ok] - exact[ok]) / np.abs(exact[ok])
+    return {"max": float(err.max()), "p99": float(np.quantile(err, 0.99)), "median": float(np.median(err))}
@@ -0,0 +1,118 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# Magasin de variables partagé par les étapes 04 à 07 : les matrices numériques (variables de 03,
+# scores PC de 04) sont écrites une fois en float32 contigu (.npy) et relues en memory-map.
+# Des étapes lancées en parallèle sur la même machine partagent les mêmes pages du cache disque
+# au lieu de tenir chacune sa copie. Les sous-ensembles de lignes (type de bien, cluster) sont
+# des index de lignes persistés : seules les lignes demandées sont matérialisées.
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE_DIR = os.path.join(BASE_DIR, "data", "processed", "feature_store")
+INDEX_FILE = "index.json"
+
+
+class FeatureStore:
+    """
+    Répertoire de tableaux .npy + index JSON des colonnes :
+    matrices float32 (lignes × colonnes) et tableaux 1D (codes, labels, index de lignes).
+    """
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        self._index = {"matrices": {}, "arrays": []}
+        if os.path.exists(os.path.join(path, INDEX_FILE)):
+            with open(os.path.join(path, INDEX_FILE), encoding="utf-8") as f:
+                self._index = json.load(f)
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    def _save_index(self):
+        tmp = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+    def __contains__(self, name):
+        return name in self._index["matrices"] or name in self._index["arrays"]
+
+    # --- écriture ---
+
+    def create_matrix(self, name, n_rows, columns):
+        """Matrice float32 vide à remplir par blocs de lignes (memory-map en écriture)."""
+        os.makedirs(self.path, exist_ok=True)
+        out = np.lib.format.open_memmap(
+            self._file(name), mode="w+", dtype=np.float32, shape=(n_rows, len(columns))
+        )
+        self._index["matrices"][name] = list(columns)
+        self._save_index()
+        return out
+
+    def write_matrix(self, name, data, columns=None):
+        """Écrit une matrice complète (DataFrame : colonne par colonne, sans copie float64 intermédiaire)."""
+        if isinstance(data, pd.DataFrame):
+            columns = list(data.columns)
+        out = self.create_matrix(name, len(data), columns)
+        for j, col in enumerate(columns):
+            out[:, j] = data[col].to_numpy(dtype=np.float32) if isinstance(data, pd.DataFrame) else data[:, j]
+        out.flush()
+
+    def write_array(self, name, values):
+        """Écrit un tableau 1D (codes, labels, index de lignes)."""
+        os.makedirs(self.path, exist_ok=True)
+        np.save(self._file(name), np.asarray(values))
+        if name not in self._index["arrays"]:
+            self._index["arrays"].append(name)
+            self._save_index()
+
+    def write_groups(self, name, codes, labels):
+        """
+        Codes de groupe de chaque ligne (tableau name) et index des lignes de chaque groupe
+        (tableaux name=label, lignes dans l'ordre d'origine). codes : 0..len(labels)-1, -1 ignoré.
+        """
+        codes = np.asarray(codes)
+        self.write_array(name, codes)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+        for i, label in enumerate(labels):
+            self.write_array(f"{name}={label}", order[bounds[i]:bounds[i + 1]])
+
+    # --- lecture (memory-map, lecture seule) ---
+
+    def columns(self, name):
+        return self._index["matrices"][name]
+
+    def matrix(self, name, columns=None):
+        """
+        Matrice en memory-map. columns : vue sans copie si les colonnes forment un bloc
+        contigu dans l'ordre stocké, sinon copie des seules colonnes demandées.
+        """
+        data = np.load(self._file(name), mmap_mode="r")
+        if columns is None:
+            return data
+        idx = [self.columns(name).index(c) for c in columns]
+        if idx == list(range(idx[0], idx[0] + len(idx))):
+            return data[:, idx[0]:idx[0] + len(idx)]
+        return data[:, idx]
+
+    def frame(self, name, columns=None):
+        """DataFrame adossé au memory-map (aucune copie des données pour la matrice complète)."""
+        return pd.DataFrame(self.matrix(name, columns), columns=columns or self.columns(name), copy=False)
+
+    def array(self, name):
+        return np.load(self._file(name), mmap_mode="r")
+
+    def rows(self, name, label):
+        """Index des lignes d'un groupe (ex. rows("type_local", "Appartement"), rows("cluster_kmeans", 3))."""
+        return self.array(f"{name}={label}")
+
+    def check_rows(self, n_rows, name="features"):
+        """Vérifie que le magasin est aligné sur un jeu de n_rows lignes (même filtre années / départements)."""
+        n_store = np.load(self._file(name), mmap_mode="r").shape[0]
+        if n_store != n_rows:
+            raise ValueError(
+                f"Magasin de variables désaligné ({n_store:,} lignes contre {n_rows:,}) : relancer l'étape 04"
+            )
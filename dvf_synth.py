@@ -0,0 +1,189 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+# Générateur de fichiers DVF synthétiques au format ValeursFoncieres-<annee>.txt :
+# mêmes 43 colonnes, séparateur |, décimales à virgule, dates jj/mm/aaaa, champs vides.
+# Cardinalités asymétriques (loi de Zipf) des départements, communes et voies, ventes
+# multi-lignes (mutation avec dépendance) et multi-lots, mutations hors vente, valeurs
+# manquantes et prix aberrants : de quoi mesurer le pipeline sans le fichier réel.
+
+COLUMNS = [
+    "Identifiant de document", "Reference document", "1 Articles CGI", "2 Articles CGI",
+    "3 Articles CGI", "4 Articles CGI", "5 Articles CGI", "No disposition", "Date mutation",
+    "Nature mutation", "Valeur fonciere", "No voie", "B/T/Q", "Type de voie", "Code voie", "Voie",
+    "Code postal", "Commune", "Code departement", "Code commune", "Prefixe de section", "Section",
+    "No plan", "No Volume", "1er lot", "Surface Carrez du 1er lot", "2eme lot",
+    "Surface Carrez du 2eme lot", "3eme lot", "Surface Carrez du 3eme lot", "4eme lot",
+    "Surface Carrez du 4eme lot", "5eme lot", "Surface Carrez du 5eme lot", "Nombre de lots",
+    "Code type local", "Type local", "Identifiant local", "Surface reelle bati",
+    "Nombre pieces principales", "Nature culture", "Nature culture speciale", "Surface terrain",
+]
+
+DEPARTEMENTS = (
+    [f"{d:02d}" for d in range(1, 96) if d != 20] + ["2A", "2B", "971", "972", "973", "974", "976"]
+)
+NATURES = ["Vente", "Vente en l'état futur d'achèvement", "Echange", "Adjudication",
+           "Vente terrain à bâtir", "Expropriation"]
+NATURES_POIDS = [0.90, 0.05, 0.02, 0.01, 0.015, 0.005]
+TYPES_LOCAUX = ["Maison", "Appartement", "Dépendance", "Local industriel. commercial ou assimilé", ""]
+TYPES_POIDS = [0.30, 0.28, 0.27, 0.05, 0.10]
+CODES_TYPE_LOCAL = {"Maison": "1", "Appartement": "2", "Dépendance": "3",
+                    "Local industriel. commercial ou assimilé": "4", "": ""}
+TYPES_VOIE = ["RUE", "AV", "BD", "CHE", "ALL", "IMP", "PL", "RTE", "LOT", "CRS", ""]
+TYPES_VOIE_POIDS = [0.45, 0.14, 0.06, 0.08, 0.05, 0.05, 0.03, 0.05, 0.03, 0.01, 0.05]
+
+N_COMMUNES_MAX = 600     # communes du plus gros département (les autres : loi de Zipf)
+N_VOIES_MAX = 3000       # voies de la plus grosse commune
+PART_MULTI_LIGNES = 0.15 # mutations dont le local principal est suivi d'une dépendance
+PART_ABERRANTS = 0.01    # prix hors bornes (valeur symbolique ou surface erronée)
+CHUNK_ROWS = 500_000
+
+
+def _zipf_weights(n, s=1.1):
+    w = 1.0 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+
+class _Geography:
+    """Départements, communes et voies tirés une fois : cardinalités et prix de base par commune."""
+
+    def __init__(self, rng):
+        self.dep_weights = _zipf_weights(len(DEPARTEMENTS), 0.8)
+        self.n_communes = np.maximum(5, (N_COMMUNES_MAX * _zipf_weights(len(DEPARTEMENTS), 0.5)
+                                         / _zipf_weights(len(DEPARTEMENTS), 0.5)[0]).astype(int))
+        self.commune_offset = np.concatenate(([0], np.cumsum(self.n_communes)))
+        n_total = self.commune_offset[-1]
+
+        # prix de base au m² : niveau du département x écart de la commune (log-normal)
+        dep_level = rng.lognormal(np.log(2800), 0.45, len(DEPARTEMENTS))
+        dep_of_commune = np.repeat(np.arange(len(DEPARTEMENTS)), self.n_communes)
+        self.commune_price = dep_level[dep_of_commune] * rng.lognormal(0, 0.3, n_total)
+        self.commune_zip = rng.integers(0, 99, n_total)
+        # voies par commune : les premières communes de chaque département sont les plus grandes
+        rank = np.arange(n_total) - self.commune_offset[dep_of_commune]
+        self.n_voies = np.maximum(3, (N_VOIES_MAX / (1 + rank) ** 0.9).astype(int))
+
+    def draw(self, rng, n):
+        dep = rng.choice(len(DEPARTEMENTS), n, p=self.dep_weights)
+        # rang de commune dans le département selon Zipf (tirage par inversion de la loi continue)
+        u = rng.random(n)
+        local = np.minimum((self.n_communes[dep] ** u).astype(int) - 1, self.n_communes[dep] - 1)
+        commune = self.commune_offset[dep] + local
+        voie = np.minimum((self.n_voies[commune] ** rng.random(n)).astype(int) - 1, self.n_voies[commune] - 1)
+        return dep, local, commune, voie
+
+
+def _fr_decimal(values, decimals=2):
+    """Nombres au format DVF ("123000,00"), chaîne vide pour NaN."""
+    out = pd.Series(np.round(values, decimals)).map(f"{{:.{decimals}f}}".format).str.replace(".", ",", regex=False)
+    return out.where(~np.isnan(values), "")
+
+
+def _int_str(values):
+    out = pd.Series(values).astype("Int64").astype("string")
+    return out.fillna("")
+
+
+def generate_chunk(rng, geo, n, annee):
+    """Un bloc de n lignes au format brut (toutes les colonnes en texte)."""
+    # mutations : une ligne, ou local principal + dépendance (même document, même valeur)
+    n_mut = int(n / (1 + PART_MULTI_LIGNES))
+    multi = rng.random(n_mut) < PART_MULTI_LIGNES
+    mut_of_row = np.repeat(np.arange(n_mut), 1 + multi)[:n]
+    first_row = np.r_[True, mut_of_row[1:] != mut_of_row[:-1]]
+    n = len(mut_of_row)
+
+    dep, local, commune, voie = geo.draw(rng, n_mut)
+    dep, local, commune, voie = dep[mut_of_row], local[mut_of_row], commune[mut_of_row], voie[mut_of_row]
+
+    type_local = rng.choice(len(TYPES_LOCAUX), n, p=TYPES_POIDS)
+    type_local[~first_row] = TYPES_LOCAUX.index("Dépendance")
+    is_maison = type_local == 0
+    is_bati = type_local < 4
+
+    surface = np.where(is_maison, rng.lognormal(np.log(105), 0.35, n), rng.lognormal(np.log(55), 0.45, n))
+    surface = np.where(type_local == 2, rng.lognormal(np.log(15), 0.5, n), surface)
+    surface = np.where(is_bati, np.maximum(1, np.round(surface)), np.nan)
+    pieces = np.where(type_local < 2, np.clip(np.round(surface / 22), 1, 12), np.where(is_bati, 0, np.nan))
+    terrain = np.where(is_maison | (type_local == 4), np.round(rng.lognormal(np.log(600), 0.9, n)), np.nan)
+
+    # valeur de la mutation portée par toutes ses lignes
+    prix_m2 = geo.commune_price[commune] * rng.lognormal(0, 0.25, n) * np.where(is_maison, 0.85, 1.0)
+    valeur = np.where(np.isnan(surface), rng.lognormal(np.log(60_000), 0.8, n), prix_m2 * np.nan_to_num(surface))
+    valeur = np.round(valeur[np.flatnonzero(first_row)][mut_of_row], 2)
+    aberrant = rng.random(n) < PART_ABERRANTS
+    valeur = np.where(aberrant, rng.choice([1.0, 15.0, 150.0, 9.9e6], n), valeur)
+    valeur = np.where(rng.random(n) < 0.01, np.nan, valeur)
+
+    lots = rng.choice([0, 1, 2, 3, 4], n, p=[0.45, 0.35, 0.12, 0.05, 0.03])
+    lots = np.where(type_local == 1, np.maximum(lots, 1), lots)
+
+    day = rng.integers(0, 365 + (annee % 4 == 0), n_mut)[mut_of_row]
+    dates = (pd.Timestamp(f"{annee}-01-01") + pd.to_timedelta(day, unit="D")).strftime("%d/%m/%Y")
+
+    nature = rng.choice(len(NATURES), n_mut, p=NATURES_POIDS)[mut_of_row]
+    type_voie = rng.choice(len(TYPES_VOIE), n, p=TYPES_VOIE_POIDS)
+    dep_codes = np.asarray(DEPARTEMENTS, dtype=object)[dep]
+    code_commune = local + 1
+    dep_num = pd.Series(dep_codes).str.replace("2A", "20").str.replace("2B", "20").str[:2].astype(int).to_numpy()
+    code_postal = dep_num * 1000 + geo.commune_zip[commune] * 10
+
+    empty = np.full(n, "", dtype=object)
+    data = {col: empty for col in COLUMNS}
+    data.update({
+        "No disposition": np.full(n, "000001", dtype=object),
+        "Date mutation": np.asarray(dates, dtype=object),
+        "Nature mutation": np.asarray(NATURES, dtype=object)[nature],
+        "Valeur fonciere": _fr_decimal(valeur).to_numpy(),
+        "No voie": _int_str(rng.integers(1, 250, n)).to_numpy(),
+        "Type de voie": np.asarray(TYPES_VOIE, dtype=object)[type_voie],
+        "Code voie": pd.Series(voie).map("{:04d}".format).to_numpy(),
+        "Voie": pd.Series(voie).map("VOIE {}".format).to_numpy(),
+        "Code postal": pd.Series(code_postal).map("{:05d}".format).to_numpy(),
+        "Commune": (pd.Series(dep_codes) + "-" + pd.Series(code_commune).astype(str)).radd("COMMUNE ").to_numpy(),
+        "Code departement": dep_codes,
+        "Code commune": _int_str(code_commune).to_numpy(),
+        "Section": np.full(n, "AB", dtype=object),
+        "No plan": _int_str(rng.integers(1, 2000, n)).to_numpy(),
+        "Nombre de lots": _int_str(lots).to_numpy(),
+        "Code type local": pd.Series(TYPES_LOCAUX).map(CODES_TYPE_LOCAL).to_numpy()[type_local],
+        "Type local": np.asarray(TYPES_LOCAUX, dtype=object)[type_local],
+        "Surface reelle bati": _int_str(surface).to_numpy(),
+        "Nombre pieces principales": _int_str(pieces).to_numpy(),
+        "Nature culture": np.where(np.isnan(terrain), "", "S"),
+        "Surface terrain": _int_str(terrain).to_numpy(),
+    })
+    return pd.DataFrame(data, columns=COLUMNS)
+
+
+def generate_dvf(path, n_rows, annee=2024, seed=0, chunk_rows=CHUNK_ROWS):
+    """Écrit un fichier DVF synthétique de n_rows lignes (par blocs : mémoire bornée)."""
+    rng = np.random.default_rng(seed)
+    geo = _Geography(rng)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    written = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("|".join(COLUMNS) + "\n")
+        while written < n_rows:
+            chunk = generate_chunk(rng, geo, min(chunk_rows, n_rows - written), annee)
+            chunk.to_csv(f, sep="|", header=False, index=False, lineterminator="\n")
+            written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Génère un fichier DVF synthétique (format ValeursFoncieres)")
+    parser.add_argument("output", help="fichier de sortie, ex. data/raw/ValeursFoncieres-2024.txt")
+    parser.add_argument("-n", "--rows", type=int, default=1_000_000)
+    parser.add_argument("--annee", type=int, default=2024)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    n = generate_dvf(args.output, args.rows, args.annee, args.seed)
+    print(f"Lignes générées : {n:,} -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import os
+import sys
+import json
+import time
+import glob
+import atexit
+import functools
+import threading
+import multiprocessing
+import tracemalloc
+from collections import Counter
+
+# Instrumentation des étapes : spans nommés (temps, RSS, pic de RSS, allocations en option)
+# enregistrés au format Chrome trace (chrome://tracing, Perfetto, speedscope). Désactivée par
+# défaut : un span ne coûte alors qu'un test. Activation par variables d'environnement, héritées
+# par les scripts lancés depuis run_pipeline :
+#   DVF_TRACE=1 (ou un répertoire)  trace JSON par exécution dans output/traces
+#   DVF_TRACE_ALLOC=1               pic d'allocations Python/numpy par span (tracemalloc, coûteux)
+#   DVF_PROFILE=100                 échantillonnage de la pile à 100 Hz (piles agrégées .folded)
+# Les spans ouverts dans les workers forkés sont écrits dans des fichiers partiels, fusionnés
+# à la fin du processus principal.
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACE_DIR = os.path.join(BASE_DIR, "output", "traces")
+TRACE_ENV = "DVF_TRACE"
+ALLOC_ENV = "DVF_TRACE_ALLOC"
+PROFILE_ENV = "DVF_PROFILE"
+PROFILE_MAX_DEPTH = 64
+
+
+def _proc_status(*fields):
+    """Champs de /proc/self/status en Mo (VmRSS, VmHWM) ; None hors Linux."""
+    out = dict.fromkeys(fields)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key = line.split(":", 1)[0]
+                if key in out:
+                    out[key] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return out
+
+
+def _reset_hwm():
+    """Remet le pic de RSS du processus au niveau courant (Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start", "rss", "peak", "alloc_peak")
+
+    def __init__(self, tracer, name, args):
+        self.tracer, self.name, self.args = tracer, name, args
+
+    def __enter__(self):
+        self.tracer._enter(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._exit(self)
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Pile de spans par thread ; le pic de RSS d'un span inclut celui de ses enfants
+    (le pic système est remis à zéro à chaque ouverture, la partie déjà écoulée est reportée au parent).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.out_dir = None
+        self.events = []
+        self._stacks = {}
+        self._pid = os.getpid()
+        self._main_pid = self._pid
+        self._run = None
+        self._hwm = False
+        self._alloc = False
+        self._profiler = None
+        self._root = None
+        self._written = False
+        self._cost_ns = 0  # temps passé dans la tenue des spans (surcoût mesuré)
+
+    # --- activation ---
+
+    def enable(self, out_dir=TRACE_DIR, alloc=False, profile_hz=0, name=None):
+        """Active la trace pour le processus courant ; le span racine couvre toute l'exécution."""
+        if self.enabled:
+            return
+        self.enabled = True
+        self.out_dir = out_dir
+        name = name or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+        self._run = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self._hwm = _reset_hwm()
+        self._alloc = alloc
+        if alloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if profile_hz:
+            self._profiler = _SamplingProfiler(self, threading.get_ident(), profile_hz)
+            self._profiler.start()
+        self.events.append({"name": "process_name", "ph": "M", "pid": self._pid, "args": {"name": name}})
+        self._root = _Span(self, name, {})
+        self._enter(self._root)
+        atexit.register(self.write)
+
+    def span(self, name, **args):
+        """Context manager : with span("pca", lignes=n): ..."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    # --- pile de spans ---
+
+    def _check_fork(self):
+        """Premier span dans un worker forké : pile et événements hérités du parent abandonnés."""
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self.events = []
+            self._stacks = {}
+            self._profiler = None
+            self._root = None
+            self._hwm = _reset_hwm()
+
+    def _enter(self, span):
+        t0 = time.perf_counter_ns()
+        self._check_fork()
+        stack = self._stacks.setdefault(threading.get_ident(), [])
+        if self._hwm:
+            # pic atteint depuis la dernière remise à zéro : appartient au span parent
+            hwm = _proc_status("VmHWM")["VmHWM"]
+            for parent in stack:
+                parent.peak = max(parent.peak, hwm)
+            _reset_hwm()
+        if self._alloc:
+            peak = tracemalloc.get_traced_memory()[1]
+            for parent in stack:
+                parent.alloc_peak = max(parent.alloc_peak, peak)
+            tracemalloc.reset_peak()
+        span.rss = _proc_status("VmRSS")["VmRSS"]
+        span.peak = span.rss or 0.0
+        span.alloc_peak = 0
+        stack.append(span)
+        span.start = time.perf_counter_ns()
+        self._cost_ns += span.start - t0
+
+    def _exit(self, span):
+        end = time.perf_counter_ns()
+        stack = self._stacks.get(threading.get_ident(), [])
+        if span in stack:
+            stack.remove(span)
+        status = _proc_status("VmRSS", "VmHWM")
+        args = {"rss_debut_mo": _round(span.rss), "rss_fin_mo": _round(status["VmRSS"])}
+        if self._hwm:
+            span.peak = max(span.peak, status["VmHWM"] or 0.0)
+            for parent in stack:
+                parent.peak = max(parent.peak, span.peak)
+            args["rss_pic_mo"] = _round(span.peak)
+        if self._alloc:
+            span.alloc_peak = max(span.alloc_peak, tracemalloc.get_traced_memory()[1])
+            for parent in stack:
+                parent.alloc_peak = max(parent.alloc_peak, span.alloc_peak)
+            args["alloc_pic_mo"] = _round(span.alloc_peak / 1024 ** 2)
+        args.update(span.args)
+        self.events.append({
+            "name": span.name, "cat": "dvf", "ph": "X",
+            "ts": span.start / 1000, "dur": (end - span.start) / 1000,
+            "pid": os.getpid(), "tid": threading.get_ident() % 2 ** 31, "args": args,
+        })
+        # worker : pas d'atexit, chaque span est écrit tout de suite
+        if os.getpid() != self._main_pid:
+            self._write_part()
+        self._cost_ns += time.perf_counter_ns() - end
+
+    # --- écriture ---
+
+    def _part_path(self, pid):
+        return os.path.join(self.out_dir, f".{self._run}.{pid}.part")
+
+    def _write_part(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(self._part_path(os.getpid()), "a", encoding="utf-8") as f:
+            for event in self.events:
+                f.write(json.dumps(event, ensure_ascii=False, default=_json_value) + "\n")
+        self.events = []
+
+    def write(self):
+        """Ferme le span racine, fusionne les spans des workers et écrit la trace (une seule fois)."""
+        if not self.enabled or self._written or os.getpid() != self._main_pid:
+            return None
+        self._written = True
+        if self._profiler is not None:
+            self._profiler.stop()
+        if self._root is not None:
+            self._exit(self._root)
+            # surcoût de l'instrumentation du processus principal, rapporté à sa durée totale
+            root = self.events[-1]
+            cost_ms = self._cost_ns / 1e6
+            profile_ms = self._profiler.cpu_ns / 1e6 if self._profiler is not None else 0.0
+            root["args"].update({
+                "surcout_spans_ms": round(cost_ms, 2),
+                "profil_cpu_ms": round(profile_ms, 2),
+                "surcout_pct": round(100 * (cost_ms + profile_ms) / max(root["dur"] / 1000, 1e-9), 2),
+            })
+
+        events = list(self.events)
+        for part in sorted(glob.glob(self._part_path("*"))):
+            with open(part, encoding="utf-8") as f:
+                events.extend(json.loads(line) for line in f if line.strip())
+            os.remove(part)
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"{self._run}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=_json_value)
+        if self._profiler is not None:
+            self._profiler.write(os.path.join(self.out_dir, f"{self._run}.folded"))
+        print(f"Trace d'exécution : {path}")
+        return path
+
+
+class _SamplingProfiler(threading.Thread):
+    """
+    Échantillonne la pile Python d'un thread à fréquence fixe ; chaque pile est préfixée par
+    les spans ouverts. Sortie au format « piles repliées » (flamegraph.pl, speedscope).
+    """
+
+    def __init__(self, tracer, thread_id, hz):
+        super().__init__(name="dvf-profiler", daemon=True)
+        self.tracer, self.thread_id, self.interval = tracer, thread_id, 1.0 / hz
+        self.samples = Counter()
+        self.cpu_ns = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            self._sample_loop()
+        finally:
+            self.cpu_ns = time.thread_time_ns()  # temps CPU du thread d'échantillonnage
+
+    def _sample_loop(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                code = frame.f_code
+                if code.co_filename != __file__:  # enveloppes des spans : déjà dans le préfixe
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            spans = [s.name for s in self.tracer._stacks.get(self.thread_id, [])]
+            self.samples[";".join(spans + stack[::-1])] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _json_value(value):
+    """Arguments de span non JSON (scalaires numpy, chemins) : valeur Python ou texte."""
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+_TRACER = Tracer()
+
+
+def enable(out_dir=TRACE_DIR, alloc=False, profile_hz=0, name=None):
+    _TRACER.enable(out_dir, alloc=alloc, profile_hz=profile_hz, name=name)
+
+
+def enabled():
+    return _TRACER.enabled
+
+
+def span(name, **args):
+    """Span nommé (sans effet si la trace est désactivée)."""
+    return _TRACER.span(name, **args)
+
+
+def traced(fn=None, name=None):
+    """
+    Décorateur : un span par appel, nommé d'après la fonction ; le nombre de lignes du
+    premier argument (DataFrame, tableau) est noté. @traced ou @traced(name="...").
+    """
+    if fn is None:
+        return functools.partial(traced, name=name)
+    label = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _TRACER.enabled:
+            return fn(*args, **kwargs)
+        rows = {"lignes": len(args[0])} if args and hasattr(args[0], "shape") else {}
+        with _TRACER.span(label, **rows):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def write_trace():
+    """Écrit la trace maintenant (sinon à la fin du processus) ; renvoie son chemin."""
+    return _TRACER.write()
+
+
+def merge_traces(paths, out_path):
+    """Fusionne des traces Chrome (une par script) en une seule ; chaque processus garde sa ligne."""
+    events = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            events.extend(json.load(f)["traceEvents"])
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    return out_path
+
+
+def _enable_from_env():
+    value = os.environ.get(TRACE_ENV, "")
+    if value.lower() in ("", "0", "false", "non"):
+        return
+    # worker lancé en spawn (sans atexit) : seuls les workers forkés sont suivis
+    if multiprocessing.parent_process() is not None:
+        return
+    out_dir = TRACE_DIR if value.lower() in ("1", "true", "oui") else value
+    profile_hz = float(os.environ.get(PROFILE_ENV) or 0)
+    enable(out_dir, alloc=os.environ.get(ALLOC_ENV) == "1", profile_hz=profile_hz)
+
+
+_enable_from_env()
@@ -0,0 +1,350 @@
+import os
+import time
+import argparse
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score, adjusted_rand_score
+from threadpoolctl import threadpool_limits
+
+from dvf_silhouette import silhouette
+from dvf_store import FeatureStore
+from dvf_telemetry import span, traced
+
+# Re-segmentation « what-if » en mémoire, sans relancer 04 et 05 : la matrice standardisée, la base
+# PCA complète et les scores PC restent chargés ; chaque requête (composantes, k, sous-ensemble de
+# lignes) découpe les scores en mémoire et part des centroïdes d'une segmentation déjà connue
+# (celle de 05 ou une requête précédente) au lieu d'un k-means++ complet. Partant de centroïdes
+# déjà proches, quelques itérations de Lloyd sur toutes les lignes convergent plus vite (et plus
+# bas en inertie) que les centaines de mini-lots qu'enchaîne MiniBatchKMeans avant de s'arrêter.
+
+# étapes du pipeline réutilisées telles quelles (scripts numérotés)
+_reduction = importlib.import_module("04_dimensionality_reduction")
+_clustering = importlib.import_module("05_clustering_algorithms")
+
+GLOBAL = "global"  # toutes les lignes ; sinon un type de bien ("Appartement", "Maison")
+N_WORKERS = 1      # requêtes d'un lot réparties par chaînes (sous-ensemble, composantes)
+INIT_SAMPLE = 5_000  # échantillon pour ajouter des centroïdes (k supérieur à la source)
+WARM_MAX_ITER = 30   # itérations de Lloyd au plus depuis des centroïdes connus
+
+
+def pc_indices(pcs, n_available):
+    """Composantes demandées : n (les n premières), ou liste de noms "PC4" / d'indices à partir de 0."""
+    if isinstance(pcs, (int, np.integer)):
+        idx = tuple(range(int(pcs)))
+    else:
+        idx = tuple(int(p[2:]) - 1 if isinstance(p, str) else int(p) for p in pcs)
+    if not idx or min(idx) < 0 or max(idx) >= n_available:
+        raise ValueError(f"Composantes invalides : {pcs} ({n_available} disponibles)")
+    return idx
+
+
+def pc_label(idx):
+    if idx == tuple(range(len(idx))):
+        return f"PC1-PC{len(idx)}"
+    return ",".join(f"PC{i + 1}" for i in idx)
+
+
+def cluster_means(X, labels, k):
+    """Centroïdes (moyennes par cluster) de X pour des labels 0..k-1 ; NaN pour un cluster vide."""
+    counts = np.bincount(labels, minlength=k)
+    sums = np.zeros((k, X.shape[1]))
+    np.add.at(sums, labels, X)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts[:, None], counts
+
+
+def segmentation_metrics(X, labels, centers, reference=None, inertia=None):
+    """Inertie et indicateurs de 05 (silhouette simplifiée, O(n·k)), accord avec la référence."""
+    if inertia is None:
+        inertia = ((X - centers[labels]) ** 2).sum()
+    metrics = {"inertia": float(inertia)}
+    if len(np.unique(labels)) > 1:
+        metrics["silhouette"], _ = silhouette(X, labels, mode="simplified", centers=centers)
+        metrics["calinski_harabasz"] = calinski_harabasz_score(X, labels)
+        metrics["davies_bouldin"] = davies_bouldin_score(X, labels)
+    else:
+        metrics.update(silhouette=np.nan, calinski_harabasz=np.nan, davies_bouldin=np.nan)
+    metrics["ari_reference"] = np.nan if reference is None else adjusted_rand_score(reference, labels)
+    return metrics
+
+
+class SegmentationSession:
+    """
+    Modèles et données résidents pour répondre à des requêtes de segmentation :
+    scores PC de toutes les lignes (magasin de 04), standardisation et base PCA complète
+    (pca.joblib), segmentations ajustées indexées par (sous-ensemble, composantes, k).
+    La segmentation de 05 (global, Appartements, Maisons) sert de référence et de point de départ.
+    """
+
+    def __init__(self, store_dir=_clustering.STORE_DIR, model_path=_reduction.MODEL_PATH, load_reference=True):
+        self.store = FeatureStore(store_dir)
+        with span("whatif_chargement"):
+            # copie en RAM : les requêtes ne repassent plus par le memory-map
+            self.scores = np.array(self.store.matrix("pca"), dtype=np.float32)
+
+        model = joblib.load(model_path)
+        self.feature_cols = model["feature_cols"]
+        self.scaler = model["scaler"]
+        self.pca = model["pca"]
+        self._standardized = None
+        self._basis = None
+
+        self.rows = {GLOBAL: None}
+        for name in ("Appartement", "Maison"):
+            if f"type_local={name}" in self.store:
+                self.rows[name] = np.asarray(self.store.rows("type_local", name))
+
+        # (sous-ensemble, composantes, k) -> {"labels", "centers", "metrics", "init"}
+        self.results = {}
+        self.reference = {}
+        if load_reference:
+            self._load_reference()
+
+    # --- données ---
+
+    @property
+    def standardized(self):
+        """Matrice standardisée (float32), calculée à la première demande depuis les variables du magasin."""
+        if self._standardized is None:
+            X = self.store.matrix("features", self.feature_cols)
+            self._standardized = ((X - self.scaler.mean_) / self.scaler.scale_).astype(np.float32)
+        return self._standardized
+
+    @property
+    def basis(self):
+        """
+        Base PCA complète (une composante par variable) : celle de 04 si elle est complète, sinon
+        complétée par la décomposition propre de la covariance de la matrice standardisée.
+        """
+        if self._basis is None:
+            components = self.pca.components_
+            if len(components) < len(self.feature_cols):
+                Z = self.standardized.astype(np.float64)
+                eigvals, eigvecs = np.linalg.eigh(np.cov(Z, rowvar=False))
+                full = _reduction._flip_signs(eigvecs[:, np.argsort(eigvals)[::-1]].T)
+                components = np.vstack([components, full[len(components):]])
+            self._basis = components
+        return self._basis
+
+    def n_components(self):
+        return len(self.feature_cols)
+
+    def matrix(self, pcs=_clustering.N_PCA_CLUSTER, subset=GLOBAL):
+        """Scores des composantes demandées pour les lignes du sous-ensemble (float32)."""
+        idx = pcs if isinstance(pcs, tuple) else pc_indices(pcs, self.n_components())
+        rows = self.rows[subset]
+        stored = self.scores.shape[1]
+        if max(idx) < stored:
+            if idx == tuple(range(idx[0], idx[0] + len(idx))):
+                X = self.scores[:, idx[0]:idx[0] + len(idx)]
+            else:
+                X = self.scores[:, list(idx)]
+            return np.ascontiguousarray(X if rows is None else X[rows])
+
+        # composantes au-delà de celles écrites par 04 : projection de la matrice standardisée
+        Z = self.standardized if rows is None else self.standardized[rows]
+        cols = []
+        for i in idx:
+            if i < stored:
+                cols.append(self.scores[:, i] if rows is None else self.scores[rows, i])
+            else:
+                cols.append((Z - self.pca.mean_) @ self.basis[i])
+        return np.column_stack(cols).astype(np.float32)
+
+    def _load_reference(self):
+        """Segmentations persistées par 05 (labels de chaque ligne, centroïdes)."""
+        clusters = FeatureStore(_clustering.CLUSTER_STORE_DIR)
+        if "cluster_kmeans" in clusters:
+            labels = np.asarray(clusters.array("cluster_kmeans"))
+            idx = tuple(range(_clustering.N_PCA_CLUSTER))
+            if os.path.exists(_clustering.OUT_CENTROIDS_GLOBAL):
+                centers = np.load(_clustering.OUT_CENTROIDS_GLOBAL)
+                idx = tuple(range(centers.shape[1]))
+            else:
+                centers = None
+            self._add_reference(GLOBAL, idx, labels, centers)
+
+        by_type = {
+            "Appartement": (_clustering.OUT_KMEANS_APPART, _clustering.OUT_CENTROIDS_APPART),
+            "Maison": (_clustering.OUT_KMEANS_MAISON, _clustering.OUT_CENTROIDS_MAISON),
+        }
+        for name, (path, centroids_path) in by_type.items():
+            if name in self.rows and os.path.exists(path):
+                labels = pd.read_parquet(path, columns=["cluster_kmeans"])["cluster_kmeans"].to_numpy()
+                centers = np.load(centroids_path) if os.path.exists(centroids_path) else None
+                idx = tuple(range(_clustering.N_PCA_TYPE if centers is None else centers.shape[1]))
+                self._add_reference(name, idx, labels, centers)
+
+    def _add_reference(self, subset, idx, labels, centers):
+        n_rows = len(self.scores) if self.rows[subset] is None else len(self.rows[subset])
+        if len(labels) != n_rows:
+            print(f"  Référence {subset} ignorée : {len(labels):,} labels pour {n_rows:,} lignes (relancer 05)")
+            return
+        labels = labels.astype(np.int32)
+        k = int(labels.max()) + 1
+        if centers is None:
+            centers, _ = cluster_means(self.matrix(idx, subset), labels, k)
+        self.reference[subset] = labels
+        self.results[(subset, idx, k)] = {"labels": labels, "centers": centers, "metrics": None, "init": "05"}
+
+    # --- requêtes ---
+
+    def _warm_init(self, X, subset, idx, k, rng):
+        """
+        Centroïdes initiaux pris dans la segmentation connue la plus proche du même sous-ensemble :
+        mêmes composantes et k le plus proche (centroïdes repris), sinon moyennes de X par ses labels
+        (centroïdes transportés dans le nouvel espace). Centroïdes retirés (plus petits clusters)
+        ou ajoutés (à la manière de k-means++) pour obtenir k.
+        """
+        sources = [key for key in self.results if key[0] == subset]
+        if not sources:
+            return None, "k-means++"
+        key = min(sources, key=lambda s: (s[1] != idx, abs(s[2] - k)))
+        source = self.results[key]
+        if key[1] == idx:
+            centers = np.asarray(source["centers"], dtype=np.float64)
+            counts = np.bincount(source["labels"], minlength=len(centers))
+            how = "centroïdes"
+        else:
+            centers, counts = cluster_means(X, source["labels"], key[2])
+            how = "moyennes"
+
+        keep = counts > 0
+        centers, counts = centers[keep], counts[keep]
+        if len(centers) > k:
+            centers = centers[np.sort(np.argsort(counts)[::-1][:k])]
+        if len(centers) < k:
+            sample = X[rng.choice(len(X), min(INIT_SAMPLE, len(X)), replace=False)].astype(np.float64)
+            while len(centers) < k:
+                centers = np.vstack([centers, _clustering._next_centroid(sample, centers, rng)])
+        return centers, f"{how} {pc_label(key[1])} k={key[2]}"
+
+    @traced
+    def segment(self, k, pcs=_clustering.N_PCA_CLUSTER, subset=GLOBAL, warm_start=True):
+        """
+        Segmentation K-Means de subset sur les composantes pcs avec k clusters (résultat en cache).
+        Renvoie {"labels", "centers", "metrics", "init"} ; metrics contient aussi l'ARI avec la
+        segmentation de référence du sous-ensemble.
+        """
+        idx = pc_indices(pcs, self.n_components())
+        key = (subset, idx, k)
+        result = self.results.get(key)
+        if result is not None and result["metrics"] is not None:
+            return result
+
+        start = time.perf_counter()
+        X = self.matrix(idx, subset)
+        if result is None:
+            rng = np.random.RandomState(_clustering.RANDOM_STATE)
+            init, how = self._warm_init(X, subset, idx, k, rng) if warm_start else (None, "k-means++")
+            if init is None:
+                # départ à froid : même ajustement que 05
+                km = MiniBatchKMeans(
+                    n_clusters=k,
+                    batch_size=_clustering.BATCH_SIZE,
+                    random_state=_clustering.RANDOM_STATE,
+                    n_init="auto"
+                )
+            else:
+                km = KMeans(n_clusters=k, init=init, n_init=1, max_iter=WARM_MAX_ITER,
+                            random_state=_clustering.RANDOM_STATE)
+            with span("whatif_kmeans", sous_ensemble=subset, composantes=pc_label(idx), k=k, init=how):
+                km.fit(X)
+            result = {"labels": km.labels_.astype(np.int32), "centers": km.cluster_centers_,
+                      "init": how, "inertia": km.inertia_}
+
+        metrics = segmentation_metrics(
+            X, result["labels"], result["centers"], self.reference.get(subset), result.get("inertia")
+        )
+        metrics.update(
+            sous_ensemble=subset, composantes=pc_label(idx), k=k, n=len(X),
+            init=result["init"], secondes=time.perf_counter() - start,
+        )
+        result["metrics"] = metrics
+        self.results[key] = result
+        return result
+
+    @traced
+    def run(self, queries, warm_start=True, n_workers=N_WORKERS):
+        """
+        Lot de requêtes {"k", "pcs", "subset"} (pcs et subset optionnels). Les requêtes d'un même
+        (sous-ensemble, composantes) forment une chaîne traitée par k croissant, chaque k partant du
+        précédent ; les chaînes sont réparties sur n_workers processus.
+        Renvoie la table des indicateurs (ordre des requêtes) et {(subset, composantes, k): labels}.
+        """
+        keys = []
+        for q in queries:
+            idx = pc_indices(q.get("pcs", _clustering.N_PCA_CLUSTER), self.n_components())
+            keys.append((q.get("subset", GLOBAL), idx, q["k"]))
+
+        chains = {}
+        for key in dict.fromkeys(keys):
+            chains.setdefault(key[:2], []).append(key[2])
+        chains = [(subset, idx, sorted(ks)) for (subset, idx), ks in chains.items()]
+
+        if n_workers > 1 and len(chains) > 1:
+            n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+            context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+            with ProcessPoolExecutor(
+                max_workers=min(n_workers, len(chains)), mp_context=context,
+                initializer=_init_session_worker, initargs=(self, n_threads)
+            ) as executor:
+                futures = [executor.submit(_run_chain, *chain, warm_start) for chain in chains]
+                for fut in futures:
+                    self.results.update(fut.result())
+        else:
+            for subset, idx, ks in chains:
+                for k in ks:
+                    self.segment(k, idx, subset, warm_start=warm_start)
+
+        table = pd.DataFrame([self.results[key]["metrics"] for key in keys])
+        columns = ["sous_ensemble", "composantes", "k", "n", "init"]
+        table = table[columns + [c for c in table.columns if c not in columns]]
+        return table, {key: self.results[key]["labels"] for key in keys}
+
+
+# session partagée avec les processus d'un lot (fork : aucune copie des scores)
+_SESSION = {}
+
+
+def _init_session_worker(session, n_threads):
+    _SESSION["session"] = session
+    threadpool_limits(limits=n_threads)
+
+
+def _run_chain(subset, idx, ks, warm_start):
+    session = _SESSION["session"]
+    for k in ks:
+        session.segment(k, idx, subset, warm_start=warm_start)
+    return {(subset, idx, k): session.results[(subset, idx, k)] for k in ks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segmentations what-if à partir des modèles de 04 et 05")
+    parser.add_argument("-k", type=int, nargs="+", default=[_clustering.N_CLUSTERS_GLOBAL], help="nombres de clusters")
+    parser.add_argument("--pcs", type=int, nargs="+", default=[_clustering.N_PCA_CLUSTER],
+                        help="nombres de composantes (les n premières)")
+    parser.add_argument("--subset", nargs="+", default=[GLOBAL], help="global, Appartement, Maison")
+    parser.add_argument("--workers", type=int, default=N_WORKERS)
+    args = parser.parse_args()
+
+    start = time.time()
+    session = SegmentationSession()
+    print(f"Session chargée en {time.time() - start:.1f}s : {session.scores.shape[0]:,} lignes, "
+          f"{len(session.reference)} segmentations de référence")
+
+    queries = [{"subset": s, "pcs": p, "k": k} for s in args.subset for p in args.pcs for k in args.k]
+    start = time.time()
+    table, _ = session.run(queries, n_workers=args.workers)
+    print(table.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    print(f"{len(queries)} requêtes en {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+import os
+import ast
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import dvf_telemetry
+
+# Lance les scripts numérotés comme un graphe d'étapes : chaque étape déclare ses entrées,
+# ses sorties et ses paramètres. Une étape dont l'empreinte (code, paramètres, contenu des
+# entrées) n'a pas changé depuis la dernière exécution réussie est sautée ; les étapes
+# indépendantes tournent en parallèle.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+CACHE_PATH = os.path.join(BASE_DIR, "data", ".pipeline_cache.json")
+N_JOBS = 3
+
+STAGES = [
+    {
+        "name": "01_chargement",
+        "script": "01_data_loading_dvf.py",
+        "inputs": ["data/raw"],
+        "outputs": ["data/clean/dvf_prefiltre"],
+        "params": ["ANNEES", "MODE_INGESTION", "COLUMNS_TO_KEEP"],
+    },
+    {
+        "name": "02_nettoyage",
+        "script": "02_cleaning_dvf.py",
+        "inputs": ["data/clean/dvf_prefiltre"],
+        "outputs": ["data/clean/dvf_clean"],
+        "params": ["ANNEES", "DEPARTEMENTS", "VALEUR_MIN", "SURFACE_MIN", "PRIX_M2_MIN", "PRIX_M2_MAX"],
+    },
+    {
+        "name": "03_features",
+        "script": "03_feature_engineering_clustering.py",
+        "inputs": ["data/clean/dvf_clean", "data/ref"],
+        "outputs": ["data/processed/dvf_features", "data/models/encoders"],
+        # sorties écrites selon la valeur d'un paramètre : {sortie: (paramètre, valeur)}
+        "conditional_outputs": {"data/models/sketches": ("MODE_QUANTILES", "sketch")},
+        "params": [
+            "ANNEES", "DEPARTEMENTS", "FEATURES_GEO", "K_VOISINS", "RAYON_KM", "ENCODAGE_PRIX", "N_FOLDS",
+            "MODE_QUANTILES", "ALPHA",
+        ],
+    },
+    {
+        "name": "04_pca",
+        "script": "04_dimensionality_reduction.py",
+        "inputs": ["data/processed/dvf_features"],
+        "outputs": [
+            "data/processed/dvf_2024_pca20.parquet",
+            "data/processed/dvf_2024_pca2.parquet",
+            "data/processed/feature_store",
+            "data/models/pca.joblib",
+        ],
+        "params": ["ANNEES", "DEPARTEMENTS"],
+    },
+    {
+        "name": "04bis_umap",
+        "script": "04bis_visu.py",
+        "inputs": ["data/processed/feature_store"],
+        "outputs": [],
+        "params": ["SAMPLE_SIZE", "N_PCA_UMAP"],
+    },
+    {
+        "name": "05_clustering",
+        "script": "05_clustering_algorithms.py",
+        "inputs": ["data/processed/feature_store"],
+        "outputs": [
+            "data/processed/dvf_kmeans_global.parquet",
+            "data/processed/feature_store_clusters",
+            "data/processed/dvf_kmeans_appart.parquet",
+            "data/processed/dvf_kmeans_maison.parquet",
+            "data/processed/dvf_hdbscan_sample.parquet",
+            "data/processed/dvf_hdbscan_full.parquet",
+            "data/models/kmeans_global_centroids.npy",
+            "data/models/kmeans_appart_centroids.npy",
+            "data/models/kmeans_maison_centroids.npy",
+        ],
+        "params": [
+            "N_PCA_CLUSTER", "N_PCA_TYPE", "N_CLUSTERS_GLOBAL", "K_MIN", "K_MAX", "WARM_START", "SIL_MODE", "SWEEP_SIL_MODE",
+            "HDBSCAN_SAMPLE_SIZE", "MIN_CLUSTER_SIZE", "MIN_SAMPLES", "HDBSCAN_FULL",
+        ],
+    },
+    {
+        "name": "06_interpretation",
+        "script": "06_cluster_interpretation.py",
+        "inputs": [
+            "data/processed/dvf_features", "data/processed/feature_store",
+            "data/processed/feature_store_clusters", "data/ref",
+        ],
+        "outputs": ["output/cluster_analysis"],
+        "params": ["RAYON_KM", "MODE_QUANTILES", "ALPHA"],
+    },
+    {
+        "name": "07_anomalies",
+        "script": "07_anomaly_detection.py",
+        "inputs": [
+            "data/processed/dvf_features", "data/processed/feature_store",
+            "data/processed/feature_store_clusters",
+        ],
+        "outputs": [
+            "data/processed/dvf_anomalies_isolation_forest.parquet",
+            "data/models/isolation_forests.joblib",
+        ],
+        "params": ["CONTAMINATION", "N_ESTIMATORS", "ANOMALY_FEATURES"],
+    },
+    {
+        "name": "07_visu",
+        "script": "07visu.py",
+        "inputs": ["data/processed/dvf_anomalies_isolation_forest.parquet"],
+        "outputs": ["output/figures"],
+        "params": [],
+    },
+    {
+        "name": "08_opportunites",
+        "script": "08.py",
+        "inputs": [
+            "data/processed/dvf_anomalies_isolation_forest.parquet",
+            "output/cluster_analysis/cluster_profiles.csv",
+        ],
+        "outputs": ["output/top_opportunities.parquet", "output/top_opportunities_par_groupe.parquet"],
+        "params": ["DECOTE_MIN", "POIDS_ANOMALIE", "TOP_N", "GROUPE_TOP", "TOP_N_GROUPE"],
+    },
+]
+
+
+# EMPREINTES
+
+def _hash_file(path, file_cache):
+    """Hash du contenu d'un fichier, mis en cache par (taille, date de modification)."""
+    stat = os.stat(path)
+    stamp = f"{stat.st_size}:{stat.st_mtime_ns}"
+    cached = file_cache.get(path)
+    if cached and cached["stamp"] == stamp:
+        return cached["hash"]
+
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    file_cache[path] = {"stamp": stamp, "hash": digest}
+    return digest
+
+
+def hash_path(path, file_cache):
+    """Hash du contenu d'un fichier ou de tous les fichiers d'un dossier (None si absent)."""
+    if os.path.isfile(path):
+        return _hash_file(path, file_cache)
+    if not os.path.isdir(path):
+        return None
+
+    h = hashlib.blake2b(digest_size=16)
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            h.update(os.path.relpath(full, path).encode("utf-8"))
+            h.update(_hash_file(full, file_cache).encode("ascii"))
+    return h.hexdigest()
+
+
+def _local_modules(tree):
+    """
+    Modules du projet importés par un script (from dvf_xxx import ..., import dvf_xxx,
+    importlib.import_module("0X_...")).
+    """
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module:
+            names.add(node.module)
+        elif isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+              and node.func.attr == "import_module" and node.args
+              and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+            names.add(node.args[0].value)
+    return sorted(n for n in names if os.path.exists(os.path.join(SCRIPT_DIR, f"{n}.py")))
+
+
+def _module_closure(tree):
+    """Modules du projet dont dépend un script, directement ou via d'autres modules (ordre stable)."""
+    seen, todo = set(), _local_modules(tree)
+    while todo:
+        module = todo.pop()
+        if module in seen:
+            continue
+        seen.add(module)
+        todo.extend(_local_modules(_parse(os.path.join(SCRIPT_DIR, f"{module}.py"))))
+    return sorted(seen)
+
+
+def _parse(path):
+    with open(path, encoding="utf-8") as f:
+        return ast.parse(f.read())
+
+
+def _constants(tree):
+    """Valeurs littérales des affectations de niveau module."""
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    try:
+                        values[target.id] = ast.literal_eval(node.value)
+                    except ValueError:
+                        pass
+    return values
+
+
+def stage_fingerprint(stage, file_cache):
+    """
+    Empreinte d'une étape. Le code est haché via son AST : commentaires et mise en forme
+    n'invalident pas le cache. Les modules du projet importés, directement ou non, font partie
+    du code de l'étape.
+    """
+    tree = _parse(os.path.join(SCRIPT_DIR, stage["script"]))
+    code = hashlib.blake2b(ast.dump(tree).encode("utf-8"), digest_size=16)
+    constants = {}
+    for module in _module_closure(tree):
+        if module == os.path.splitext(stage["script"])[0]:
+            continue
+        module_tree = _parse(os.path.join(SCRIPT_DIR, f"{module}.py"))
+        code.update(ast.dump(module_tree).encode("utf-8"))
+        constants.update(_constants(module_tree))
+    constants.update(_constants(tree))
+
+    params = {name: repr(constants.get(name)) for name in stage["params"]}
+    inputs = {p: hash_path(os.path.join(BASE_DIR, p), file_cache) for p in stage["inputs"]}
+    return {"code": code.hexdigest(), "params": params, "inputs": inputs}
+
+
+def expected_outputs(stage, fingerprint):
+    """Sorties attendues d'une étape, sorties conditionnelles comprises si leur paramètre a la valeur requise."""
+    outputs = list(stage["outputs"])
+    for output, (param, value) in stage.get("conditional_outputs", {}).items():
+        if fingerprint["params"].get(param) == repr(value):
+            outputs.append(output)
+    return outputs
+
+
+# GRAPHE
+
+def _inside(path, parent):
+    return path == parent or path.startswith(parent.rstrip("/") + "/")
+
+
+def build_dependencies(stages):
+    """Une étape dépend de celles qui produisent (un parent de) l'une de ses entrées."""
+    deps = {}
+    for stage in stages:
+        deps[stage["name"]] = {
+            other["name"]
+            for other in stages
+            if other is not stage
+            and any(
+                _inside(i, o) or _inside(o, i)
+                for i in stage["inputs"]
+                for o in list(other["outputs"]) + list(other.get("conditional_outputs", {}))
+            )
+        }
+    return deps
+
+
+def _load_cache():
+    if os.path.exists(CACHE_PATH):
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    return {"stages": {}, "files": {}}
+
+
+def _save_cache(cache):
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    tmp = CACHE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1)
+    os.replace(tmp, CACHE_PATH)
+
+
+def _run_script(stage):
+    env = dict(os.environ, MPLBACKEND="Agg")  # pas de fenêtre plt.show() en exécution automatique
+    start = time.time()
+    with dvf_telemetry.span(stage["name"]):
+        result = subprocess.run(
+            [sys.executable, os.path.join(SCRIPT_DIR, stage["script"])],
+            cwd=BASE_DIR, env=env, capture_output=True, text=True
+        )
+    return result, time.time() - start
+
+
+def _changes(old, new):
+    if old is None:
+        return "jamais exécutée"
+    parts = [k for k in ("code", "params", "inputs") if old.get(k) != new.get(k)]
+    return ", ".join(parts)
+
+
+def run_pipeline(targets=None, force=False, n_jobs=N_JOBS):
+    """Exécute les étapes (et leurs dépendances) dont l'empreinte a changé."""
+    stages = {s["name"]: s for s in STAGES}
+    deps = build_dependencies(STAGES)
+
+    # restriction aux cibles demandées et à leurs ancêtres
+    selected = set(stages)
+    if targets:
+        selected = set()
+        todo = list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in stages:
+                raise ValueError(f"Étape inconnue : {name}")
+            if name not in selected:
+                selected.add(name)
+                todo.extend(deps[name])
+
+    cache = _load_cache()
+    done, failed, running = set(), set(), {}
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        while True:
+            for name in [s["name"] for s in STAGES if s["name"] in selected]:
+                if name in done or name in failed or name in running:
+                    continue
+                if deps[name] & failed:
+                    failed.add(name)
+                    print(f"[{name}] non exécutée (dépendance en échec)")
+                    continue
+                if not (deps[name] & selected) <= done:
+                    continue
+
+                stage = stages[name]
+                fingerprint = stage_fingerprint(stage, cache["files"])
+                previous = cache["stages"].get(name)
+                outputs_ok = all(
+                    os.path.exists(os.path.join(BASE_DIR, o)) for o in expected_outputs(stage, fingerprint)
+                )
+                if not force and previous == fingerprint and outputs_ok:
+                    print(f"[{name}] inchangée, sautée")
+                    done.add(name)
+                    continue
+
+                print(f"[{name}] lancement ({_changes(previous, fingerprint) or 'sorties absentes'})")
+                running[name] = (executor.submit(_run_script, stage), fingerprint)
+
+            if not running:
+                break
+
+            finished, _ = wait([fut for fut, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name in [n for n, (fut, _) in running.items() if fut in finished]:
+                fut, fingerprint = running.pop(name)
+                result, elapsed = fut.result()
+                if result.returncode == 0:
+                    cache["stages"][name] = fingerprint
+                    _save_cache(cache)
+                    done.add(name)
+                    print(f"[{name}] terminée en {elapsed:.1f}s")
+                else:
+                    failed.add(name)
+                    print(f"[{name}] ÉCHEC (code {result.returncode})")
+                    print(result.stderr[-2000:])
+
+    _save_cache(cache)
+    return done, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exécution incrémentale du pipeline DVF")
+    parser.add_argument("targets", nargs="*", help="étapes à produire (défaut : toutes)")
+    parser.add_argument("--force", action="store_true", help="ignore le cache d'empreintes")
+    parser.add_argument("--jobs", type=int, default=N_JOBS, help="étapes exécutées en parallèle")
+    parser.add_argument("--trace", action="store_true",
+                        help="trace Chrome de l'exécution (étapes et spans de chaque script)")
+    args = parser.parse_args()
+
+    if args.trace:
+        # chaque script écrit sa trace dans le répertoire de l'exécution (variable héritée)
+        trace_dir = os.path.join(dvf_telemetry.TRACE_DIR, f"run-{time.strftime('%Y%m%d-%H%M%S')}")
+        os.environ[dvf_telemetry.TRACE_ENV] = trace_dir
+        dvf_telemetry.enable(trace_dir, name="run_pipeline")
+
+    _, failed = run_pipeline(args.targets, force=args.force, n_jobs=args.jobs)
+
+    if args.trace:
+        dvf_telemetry.write_trace()
+        paths = sorted(os.path.join(trace_dir, name) for name in os.listdir(trace_dir) if name.endswith(".json"))
+        merged = dvf_telemetry.merge_traces(paths, trace_dir + ".json")
+        print(f"Trace fusionnée ({len(paths)} processus) : {merged}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
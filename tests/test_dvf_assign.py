@@ -0,0 +1,41 @@
+import importlib
+
+import numpy as np
+import pytest
+from sklearn.datasets import make_blobs
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+
+from dvf_assign import CentroidAssigner
+
+pytest.importorskip("hdbscan")  # importé par 05
+_clustering = importlib.import_module("05_clustering_algorithms")
+
+
+def test_assign_matches_kmeans_labels():
+    """Mêmes labels que le K-Means de 05 (fit_predict) à partir de ses centroïdes."""
+    X, _ = make_blobs(n_samples=30_000, centers=6, n_features=3, random_state=0)
+    labels, _, centers = _clustering.run_kmeans(X, 6, None, "test")
+
+    assigned, distances = CentroidAssigner(centers, chunk_rows=4_096).assign(X)
+
+    np.testing.assert_array_equal(assigned, labels)
+    expected = np.linalg.norm(X - centers[labels], axis=1)
+    np.testing.assert_allclose(distances, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_raw_projection_matches_scaler_pca():
+    """raw=True : projection fusionnée identique à scaler + PCA (04) restreinte aux composantes des centroïdes."""
+    rng = np.random.RandomState(0)
+    X_raw = rng.lognormal(size=(5_000, 8)) * np.arange(1, 9)
+    scaler = StandardScaler().fit(X_raw)
+    pca = PCA(n_components=5).fit(scaler.transform(X_raw))
+    Z = pca.transform(scaler.transform(X_raw))[:, :3]
+    centers = Z[rng.choice(len(Z), 6, replace=False)]
+
+    assigner = CentroidAssigner(centers, scaler, pca)
+    np.testing.assert_allclose(assigner.project(X_raw), Z, rtol=1e-4, atol=1e-4)
+
+    labels, _ = assigner.assign(X_raw, raw=True)
+    expected = ((Z[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    assert (labels == expected).mean() > 0.999  # float32 : seules des quasi-égalités peuvent différer
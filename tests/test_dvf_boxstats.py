@@ -0,0 +1,24 @@
+import numpy as np
+from matplotlib import cbook
+
+from dvf_boxstats import WHIS, box_stats
+
+
+def test_exact_matches_boxplot_stats():
+    """Mode exact : mêmes statistiques que matplotlib.cbook.boxplot_stats, groupe par groupe."""
+    rng = np.random.RandomState(0)
+    n_groups = 7
+    codes = rng.randint(-1, n_groups, size=50_000)
+    values = rng.lognormal(mean=8, sigma=1, size=len(codes))
+    values[rng.rand(len(values)) < 0.01] = np.nan
+
+    stats, mode = box_stats(codes, n_groups, values, mode="exact", n_fliers=10_000)
+    assert mode == "exact"
+
+    for g in range(n_groups):
+        v = values[(codes == g) & ~np.isnan(values)]
+        expected = cbook.boxplot_stats(v, whis=WHIS)[0]
+        assert stats["n"][g] == len(v)
+        for key in ("mean", "q1", "med", "q3", "whislo", "whishi"):
+            assert abs(stats[key][g] - expected[key]) <= 1e-14 * abs(expected[key]), (g, key)
+        np.testing.assert_array_equal(np.sort(stats["fliers"][g]), np.sort(expected["fliers"]))
@@ -0,0 +1,51 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dvf_encoders import load_encoders, save_encoders, transform_encoders
+from dvf_schema import apply_schema
+
+_features = importlib.import_module("03_feature_engineering_clustering")
+
+
+def _sales(n=5_000, seed=0):
+    rng = np.random.RandomState(seed)
+    dep = rng.choice(["75", "69", "2A"], n)
+    commune = np.char.add("COMMUNE ", np.char.add(dep, rng.choice(["-1", "-2", "-3", "-4"], n)))
+    voie = pd.Series(np.char.add(commune, rng.choice([" VOIE 1", " VOIE 2", " VOIE 3"], n)), dtype="object")
+    voie[rng.rand(n) < 0.05] = None
+    type_voie = pd.Series(rng.choice(["RUE", "AV", "BD"], n), dtype="object")
+    type_voie[rng.rand(n) < 0.1] = None
+    surface = rng.randint(15, 200, n).astype(float)
+    df = pd.DataFrame({
+        "Date mutation": (pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.randint(0, 366, n), unit="D")).strftime("%d/%m/%Y"),
+        "Valeur fonciere": (surface * rng.lognormal(8, 0.4, n)).round(2),
+        "Code postal": np.char.add(dep, rng.choice(["001", "002"], n)),
+        "Commune": commune,
+        "Code departement": dep,
+        "Type local": rng.choice(["Maison", "Appartement"], n),
+        "Surface reelle bati": surface,
+        "Surface terrain": np.where(rng.rand(n) < 0.5, rng.randint(100, 1_000, n), np.nan),
+        "Type de voie": type_voie,
+        "Voie": voie,
+    })
+    return _features.add_temporal_features(_features.add_basic_features(apply_schema(df)))
+
+
+@pytest.mark.parametrize("mode", ["mediane", "hierarchique"])
+def test_transform_matches_fit(monkeypatch, tmp_path, mode):
+    """Tables sauvegardées puis relues : transform_encoders restitue les variables de 03 sur les mêmes ventes."""
+    monkeypatch.setattr(_features, "ENCODAGE_PRIX", mode)
+    monkeypatch.setattr(_features, "MODE_QUANTILES", "exact")
+    df = _sales()
+    tables = {}
+    fitted = _features.add_group_features(df.copy(), tables)
+    save_encoders(tables, str(tmp_path))
+
+    encoded = [c for c in fitted.columns if c not in df.columns]
+    assert "prix_median_commune" in encoded and "freq_type_voie" in encoded
+    out = transform_encoders(df.copy(), load_encoders(str(tmp_path)))
+    for col in encoded:
+        np.testing.assert_allclose(out[col].to_numpy(dtype=float), fitted[col].to_numpy(dtype=float), rtol=1e-6, err_msg=col)
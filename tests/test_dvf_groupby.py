@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from dvf_groupby import broadcast, factorize_key, group_median, group_quantiles, value_order
+
+
+def _frame(n, n_keys, seed=0):
+    rng = np.random.RandomState(seed)
+    key = pd.Series(rng.randint(0, n_keys, n).astype(str), dtype="object")
+    key[rng.rand(n) < 0.03] = None
+    values = rng.lognormal(8, 1, n)
+    values[rng.rand(n) < 0.05] = np.nan
+    return pd.DataFrame({"key": key, "v": values})
+
+
+def _check(df, qs, dropna=True, order=None):
+    """Valeur de chaque ligne : quantile de son groupe, comparé à pandas groupby."""
+    codes, n_groups = factorize_key(df["key"], dropna=dropna)
+    got = group_quantiles(codes, n_groups, df["v"], qs, order=order)
+    grouped = df.groupby("key", observed=True, dropna=dropna)["v"]
+    for q in qs:
+        expected = grouped.transform("quantile", q).to_numpy(dtype=float)
+        np.testing.assert_allclose(broadcast(got[q], codes), expected, rtol=1e-12)
+
+
+def test_median_matches_pandas():
+    df = _frame(20_000, 300)
+    codes, n_groups = factorize_key(df["key"])
+    expected = df.groupby("key")["v"].transform("median").to_numpy(dtype=float)
+    order = value_order(df["v"])  # tri partagé entre clés, comme dans add_group_features
+    np.testing.assert_allclose(broadcast(group_median(codes, n_groups, df["v"], order=order), codes), expected)
+
+
+def test_quantiles_match_pandas():
+    _check(_frame(20_000, 300), [0.1, 0.25, 0.5, 0.75, 0.9])
+
+
+def test_categorical_key_with_unused_categories():
+    df = _frame(20_000, 300)
+    df["key"] = df["key"].astype(pd.CategoricalDtype([str(i) for i in range(400)]))
+    _check(df, [0.25, 0.5])
+
+
+def test_missing_key_as_own_group():
+    _check(_frame(20_000, 300), [0.5], dropna=False)
+
+
+def test_many_groups():
+    """Plus de 65 536 groupes : tri d'une clé (groupe, rang) au lieu du tri radix 16 bits."""
+    _check(_frame(300_000, 100_000, seed=1), [0.5, 0.9])
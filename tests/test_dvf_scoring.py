@@ -0,0 +1,31 @@
+import numpy as np
+from sklearn.ensemble import IsolationForest
+
+import dvf_scoring
+from dvf_scoring import ForestScorer
+
+
+def _forest(max_features=1.0):
+    rng = np.random.RandomState(0)
+    X = rng.lognormal(size=(3_000, 5)).astype(np.float32)
+    forest = IsolationForest(n_estimators=50, max_samples=256, max_features=max_features, random_state=0).fit(X)
+    return forest, rng.lognormal(size=(2_000, 5)).astype(np.float32)
+
+
+def test_forest_scorer_matches_decision_function():
+    """Parcours compilé des arbres : mêmes scores que IsolationForest.decision_function (sous-ensembles de variables compris)."""
+    for max_features in (1.0, 0.6):
+        forest, X = _forest(max_features)
+        for n_jobs in (1, 3):
+            scorer = ForestScorer(forest, n_jobs=n_jobs)
+            assert scorer.fast
+            np.testing.assert_allclose(scorer.decision_function(X), forest.decision_function(X), rtol=0, atol=1e-12)
+
+
+def test_forest_scorer_falls_back_without_internals(monkeypatch):
+    """Attributs privés de sklearn absents : repli sur le decision_function public."""
+    forest, X = _forest()
+    monkeypatch.setattr(dvf_scoring, "FOREST_INTERNALS", dvf_scoring.FOREST_INTERNALS + ["_absent"])
+    scorer = ForestScorer(forest)
+    assert not scorer.fast
+    np.testing.assert_array_equal(scorer.decision_function(X), forest.decision_function(X))
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from dvf_encoders import transform_encoders
+from dvf_shrinkage import N_FOLDS, hierarchical_encode, hierarchical_tables, hierarchy_moments
+
+FEATURES = {
+    "departement": "prix_median_departement",
+    "commune": "prix_median_commune",
+    "voie": "prix_median_voie",
+    "code_postal": "prix_median_cp",
+}
+
+
+def _sales(n=3_000, seed=0):
+    rng = np.random.RandomState(seed)
+    dep = rng.choice(["75", "69", "13"], n)
+    commune = np.char.add(dep, rng.choice(["A", "B", "C", "D"], n))
+    voie = pd.Series(np.char.add(commune, rng.choice(["RUE 1", "RUE 2", "RUE 3"], n)), dtype="object")
+    voie[rng.rand(n) < 0.05] = None  # voie manquante : valeur de la commune
+    return pd.DataFrame({
+        "Date mutation": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.randint(0, 366, n), unit="D"),
+        "Valeur fonciere": rng.lognormal(12, 0.5, n).round(2),
+        "Surface reelle bati": rng.randint(15, 200, n).astype(np.float32),
+        "Code departement": dep,
+        "Commune": commune,
+        "Voie": voie,
+        "Code postal": np.char.add(dep, rng.choice(["001", "002"], n)),
+        "log_prix_m2": rng.normal(8, 0.4, n),
+    })
+
+
+def test_tables_reproduce_fit_values():
+    """Vente connue réencodée par les tables (même fold) : valeurs identiques à celles du fit."""
+    df = _sales()
+    tables = {}
+    encoded = hierarchical_encode(df, df["log_prix_m2"], FEATURES, tables=tables)
+    assert all(table.n_folds == N_FOLDS for table in tables.values())
+
+    out = transform_encoders(df.drop(columns="log_prix_m2"), tables)
+    for name, values in encoded.items():
+        np.testing.assert_array_equal(out[name].to_numpy(), values)
+
+
+def test_accumulated_moments_give_fit_tables():
+    """Moments additionnés lot par lot (mise à jour incrémentale) : mêmes tables qu'un fit unique."""
+    df = _sales()
+    tables = {}
+    hierarchical_encode(df, df["log_prix_m2"], FEATURES, tables=tables)
+
+    parts = [hierarchy_moments(part, part["log_prix_m2"]) for part in (df.iloc[:1_200], df.iloc[1_200:])]
+    root = [sum(np.asarray(r[i]) for _, r in parts) for i in range(2)]
+    moments = {}
+    for level in FEATURES:
+        keys = np.concatenate([m[level][0] for m, _ in parts])
+        parent_keys = np.concatenate([m[level][1] for m, _ in parts])
+        n = np.concatenate([m[level][2] for m, _ in parts], axis=1)
+        s = np.concatenate([m[level][3] for m, _ in parts], axis=1)
+        # clés répétées d'un lot à l'autre : sommées comme dans GroupSums
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        summed_n = np.stack([np.bincount(inverse, weights=row, minlength=len(uniq)) for row in n])
+        summed_s = np.stack([np.bincount(inverse, weights=row, minlength=len(uniq)) for row in s])
+        first = np.unique(inverse, return_index=True)[1]
+        moments[level] = (uniq, parent_keys[first], summed_n, summed_s, sum(m[level][4] for m, _ in parts))
+
+    rebuilt = hierarchical_tables(moments, root, FEATURES)
+    for name, table in tables.items():
+        np.testing.assert_array_equal(rebuilt[name].hashes, table.hashes)
+        for feature, values in table.values.items():
+            np.testing.assert_allclose(rebuilt[name].values[feature], values, rtol=1e-6)
+        assert rebuilt[name].fallback.keys() == table.fallback.keys()
@@ -0,0 +1,55 @@
+import numpy as np
+from sklearn.datasets import make_blobs
+from sklearn.metrics import silhouette_samples, silhouette_score
+
+from dvf_silhouette import (
+    EXACT_MAX_ROWS, MODE_LABELS, distance_matrix, resolve_mode, silhouette, silhouette_exact,
+    silhouette_precomputed, silhouette_samples_exact,
+)
+
+
+def _data():
+    X, labels = make_blobs(n_samples=3_000, centers=5, n_features=4, cluster_std=2.0, random_state=0)
+    labels[0] = 5  # cluster d'un seul point : silhouette nulle, comme sklearn
+    return X, labels
+
+
+def test_exact_matches_sklearn():
+    X, labels = _data()
+    assert abs(silhouette_exact(X, labels) - silhouette_score(X, labels)) < 1e-5
+
+
+def test_samples_match_sklearn_across_blocks():
+    """Blocs de lignes forcés petits : même résultat point par point."""
+    X, labels = _data()
+    s = silhouette_samples_exact(X, labels, working_memory_mb=0.1)
+    np.testing.assert_allclose(s, silhouette_samples(X, labels), atol=1e-4)
+    assert s[0] == 0.0
+
+
+def test_auto_is_exact_on_small_data():
+    X, labels = _data()
+    value, interval = silhouette(X, labels, mode="auto")
+    assert interval is None
+    assert abs(value - silhouette_score(X, labels)) < 1e-5
+
+
+def test_bootstrap_single_cluster_is_nan():
+    """Aucun sous-échantillon à deux clusters : score et intervalle NaN, pas d'exception."""
+    X, _ = _data()
+    value, (low, high) = silhouette(X, np.zeros(len(X), dtype=int), mode="bootstrap", n_boot=3, sample_size=500)
+    assert np.isnan(value) and np.isnan(low) and np.isnan(high)
+
+
+def test_auto_mode_label():
+    assert MODE_LABELS[resolve_mode("auto", EXACT_MAX_ROWS)] == "Silhouette"
+    assert MODE_LABELS[resolve_mode("auto", EXACT_MAX_ROWS + 1)] == "Silhouette simplifiée"
+
+
+def test_precomputed_matches_exact_for_every_k():
+    """Une seule matrice de distances, réutilisée pour plusieurs partitions (grille de k)."""
+    X, _ = _data()
+    dist = distance_matrix(X, working_memory_mb=0.1)
+    for k in (2, 4, 6):
+        labels = np.arange(len(X)) % k
+        assert abs(silhouette_precomputed(dist, labels, working_memory_mb=0.1) - silhouette_exact(X, labels)) < 1e-6
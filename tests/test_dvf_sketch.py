@@ -0,0 +1,84 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+
+from dvf_dataset import write_dvf_dataset
+from dvf_sketch import ALPHA, QUANTILES, QuantileSketch
+
+_features = importlib.import_module("03_feature_engineering_clustering")
+
+
+def test_quantiles_within_alpha():
+    """Chaque quantile de chaque groupe est à ALPHA près (erreur relative) du quantile exact (numpy, linéaire)."""
+    rng = np.random.RandomState(0)
+    keys = rng.randint(0, 50, size=200_000)
+    values = rng.lognormal(mean=8, sigma=1.5, size=len(keys))
+
+    sketch = QuantileSketch()
+    for start in range(0, len(keys), 30_000):  # alimenté par lots, comme dans le pipeline
+        sketch.update(keys[start:start + 30_000], values[start:start + 30_000])
+
+    group_keys, approx = sketch.quantiles(QUANTILES)
+    np.testing.assert_array_equal(group_keys, np.arange(50))
+    for q in QUANTILES:
+        exact = np.array([np.quantile(values[keys == k], q) for k in range(50)])
+        assert (np.abs(approx[q] - exact) / exact).max() <= ALPHA + 1e-12, q
+
+
+def test_merge_equals_single_sketch():
+    rng = np.random.RandomState(1)
+    keys = rng.randint(0, 10, size=20_000)
+    values = rng.lognormal(size=len(keys))
+
+    whole = QuantileSketch()
+    whole.update(keys, values)
+    left, right = QuantileSketch(), QuantileSketch()
+    left.update(keys[:7_000], values[:7_000])
+    right.update(keys[7_000:], values[7_000:])
+    left.merge(right)
+
+    for q in QUANTILES:
+        np.testing.assert_array_equal(left.lookup(np.arange(10), q), whole.lookup(np.arange(10), q))
+
+
+def _write_year(path, annee, seed):
+    rng = np.random.RandomState(seed)
+    n = 2_000
+    df = pd.DataFrame({
+        "Commune": rng.choice(["PARIS", "LYON", "NANTES"], n),
+        "Code departement": rng.choice(["75", "69"], n),
+        "Valeur fonciere": rng.lognormal(12, 0.5, n),
+        "Surface reelle bati": rng.uniform(20, 150, n),
+    })
+    write_dvf_dataset(df, str(path), annee=annee)
+
+
+def test_saved_years_are_reloaded(tmp_path, monkeypatch):
+    """Seule l'année ajoutée est parcourue ; la fusion est identique à une construction complète."""
+    data, out = tmp_path / "clean", tmp_path / "sketches"
+    specs = [("Commune", "prix_m2")]
+    _write_year(data, 2023, 0)
+    _features.build_median_sketches(str(data), [2023], None, specs, out_dir=str(out))
+
+    _write_year(data, 2024, 1)
+    streamed = []
+    iter_batches = _features.iter_dvf_batches
+
+    def spy(path, annees, *args, **kwargs):
+        streamed.extend(annees)
+        return iter_batches(path, annees, *args, **kwargs)
+
+    monkeypatch.setattr(_features, "iter_dvf_batches", spy)
+    merged = _features.build_median_sketches(str(data), [2023, 2024], None, specs, out_dir=str(out))
+    assert streamed == [2024]
+
+    fresh = _features.build_median_sketches(str(data), [2023, 2024], None, specs)
+    for q in QUANTILES:
+        np.testing.assert_array_equal(merged[specs[0]].quantiles()[1][q], fresh[specs[0]].quantiles()[1][q])
+
+    # année réécrite (nouvelle signature des partitions) : parcourue à nouveau
+    streamed.clear()
+    _write_year(data, 2023, 2)
+    _features.build_median_sketches(str(data), [2023, 2024], None, specs, out_dir=str(out))
+    assert streamed == [2023]
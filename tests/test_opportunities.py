@@ -0,0 +1,18 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+
+_opportunities = importlib.import_module("08")
+
+
+def test_unknown_cluster_has_nan_mean():
+    """Cluster absent des profils (identifiant au-delà du plus grand profil) : décote NaN, pas d'IndexError."""
+    profiles = pd.DataFrame({"cluster": [0, 1], "prix_m2_mean": [2000.0, 4000.0]})
+    lookup = _opportunities.cluster_lookup(profiles)
+    mean, decote, _ = _opportunities.opportunity_scores(
+        np.array([1000.0, 3000.0, 1500.0]), np.zeros(3), np.array([0, 1, 5]), lookup
+    )
+    np.testing.assert_array_equal(mean[:2], [2000.0, 4000.0])
+    np.testing.assert_allclose(decote[:2], [0.5, 0.25])
+    assert np.isnan(mean[2]) and np.isnan(decote[2])